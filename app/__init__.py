@@ -3,90 +3,171 @@
 # standard library
 import os
 import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
+from logging.handlers import SMTPHandler, WatchedFileHandler
 
 # flask
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_bootstrap import Bootstrap
 from flask_moment import Moment
 
+try:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+except ImportError:  # werkzeug < 0.15
+    from werkzeug.contrib.fixers import ProxyFix
+
 # config
 from config import Config
 
+# relative
+from .last_seen import LastSeenTracker
+from .cache import FragmentCache
+from .location_index import LocationIndex
+from .mail_queue import MailQueue
+from .passwords import PasswordHasher, AttemptLimiter
+from .user_cache import UserCache
+from .avatars import AvatarStore
+from .assets import Assets
+from .boot import BootTimer
+from .metrics import Metrics
+from .search import SearchIndex
+from .live import LiveBroker
+
 db = SQLAlchemy()
-migrate = Migrate()
 login = LoginManager()
 login.login_view = "main.home"
 login.login_message = "Please log in to access this page"
 mail = Mail()
 bootstrap = Bootstrap()
 moment = Moment()
+last_seen = LastSeenTracker()
+fragment_cache = FragmentCache()
+location_index = LocationIndex()
+mail_queue = MailQueue()
+passwords = PasswordHasher()
+login_attempts = AttemptLimiter()
+user_cache = UserCache()
+avatars = AvatarStore()
+assets = Assets()
+metrics = Metrics()
+search_index = SearchIndex()
+live = LiveBroker()
+
+
+def configure_logging(app):
+    if app.config["MAIL_SERVER"]:
+        auth = None
+        if app.config["MAIL_USERNAME"] or app.config["MAIL_PASSWORD"]:
+            auth = (app.config["MAIL_USERNAME"], app.config["MAIL_PASSWORD"])
+        secure = None
+        if app.config["MAIL_USE_TLS"]:
+            secure = ()
+        mail_handler = SMTPHandler(
+            mailhost=(app.config["MAIL_SERVER"], app.config["MAIL_PORT"]),
+            fromaddr="no-reply@" + app.config["MAIL_SERVER"],
+            toaddrs=app.config["ADMINS"],
+            subject="Microblog Failure",
+            credentials=auth,
+            secure=secure,
+        )
+        mail_handler.setLevel(logging.ERROR)
+        app.logger.addHandler(mail_handler)
 
-
-def create_app(config_class=Config):
-    app = Flask(__name__)
-    app.config.from_object(config_class)
-
-    db.init_app(app)
-    migrate.init_app(app, db)
-    login.init_app(app)
-    mail.init_app(app)
-    bootstrap.init_app(app)
-    moment.init_app(app)
-
-    from .errors import bp as errors_bp
-
-    app.register_blueprint(errors_bp)
-
-    from .auth import bp as auth_bp
-
-    app.register_blueprint(auth_bp, url_prefix="/auth")
-
-    from .main import bp as main_bp
-
-    app.register_blueprint(main_bp)
-
-    with app.app_context():
-        db.create_all()
-
-    if not app.debug and not app.testing:
-        if app.config["MAIL_SERVER"]:
-            auth = None
-            if app.config["MAIL_USERNAME"] or app.config["MAIL_PASSWORD"]:
-                auth = (app.config["MAIL_USERNAME"], app.config["MAIL_PASSWORD"])
-            secure = None
-            if app.config["MAIL_USE_TLS"]:
-                secure = ()
-            mail_handler = SMTPHandler(
-                mailhost=(app.config["MAIL_SERVER"], app.config["MAIL_PORT"]),
-                fromaddr="no-reply@" + app.config["MAIL_SERVER"],
-                toaddrs=app.config["ADMINS"],
-                subject="Microblog Failure",
-                credentials=auth,
-                secure=secure,
-            )
-            mail_handler.setLevel(logging.ERROR)
-            app.logger.addHandler(mail_handler)
-
+    if app.config["LOG_TO_STDOUT"]:
+        handler = logging.StreamHandler()
+    else:
         if not os.path.exists("logs"):
             os.mkdir("logs")
-        file_handler = RotatingFileHandler(
-            "logs/microblog.log", maxBytes=10240, backupCount=10
-        )
-        file_handler.setFormatter(
-            logging.Formatter(
-                "%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]"
-            )
+        # reopens the file after logrotate moved it; unlike rotating from
+        # python this is safe with several worker processes
+        handler = WatchedFileHandler("logs/microblog.log")
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s %(process)d %(levelname)s: %(message)s "
+            "[in %(pathname)s:%(lineno)d]"
         )
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
+    )
+    handler.setLevel(logging.INFO)
+    app.logger.addHandler(handler)
+
+    app.logger.setLevel(logging.INFO)
+    app.logger.info("Microblog startup")
+
+
+def create_app(config_class=Config):
+    # `flask boot-profile` reports these phases
+    boot = BootTimer()
+
+    with boot.phase("config"):
+        app = Flask(__name__)
+        app.config.from_object(config_class)
+        app.extensions["boot"] = boot
+        if app.config["BEHIND_PROXY"]:
+            # request.remote_addr from nginx' X-Forwarded-For
+            app.wsgi_app = ProxyFix(app.wsgi_app)
+
+    with boot.phase("metrics"):
+        # first, so its before_request starts the clock before the others run
+        metrics.init_app(app)
+
+    with boot.phase("database"):
+        db.init_app(app)
+        # the schema is only changed by `flask db upgrade`; alembic is a large
+        # import that the web workers never use, so only commands load it
+        if click.get_current_context(silent=True) is not None:
+            from flask_migrate import Migrate
+
+            Migrate(app, db, render_as_batch=True)
+
+    with boot.phase("login"):
+        login.init_app(app)
+        passwords.init_app(app)
+        login_attempts.init_app(app)
+
+    with boot.phase("mail"):
+        # connects to nothing: the queue starts its workers on the first
+        # enqueue, in the process that sends
+        mail.init_app(app)
+        mail_queue.init_app(app)
+
+    with boot.phase("templates"):
+        bootstrap.init_app(app)
+        moment.init_app(app)
+        assets.init_app(app)
+        avatars.init_app(app)
+
+    with boot.phase("caches"):
+        last_seen.init_app(app)
+        fragment_cache.init_app(app)
+        location_index.init_app(app)
+        search_index.init_app(app)
+        live.init_app(app)
+        user_cache.init_app(app)
+
+    with boot.phase("blueprints"):
+        from .errors import bp as errors_bp
+
+        app.register_blueprint(errors_bp)
+
+        from .auth import bp as auth_bp
+
+        app.register_blueprint(auth_bp, url_prefix="/auth")
+
+        from .main import bp as main_bp
+
+        app.register_blueprint(main_bp)
+
+    with boot.phase("cli"):
+        from . import cli
+
+        cli.register(app)
 
-        app.logger.setLevel(logging.INFO)
-        app.logger.info("Microblog startup")
+    with boot.phase("logging"):
+        if not app.debug and not app.testing:
+            configure_logging(app)
 
     @app.shell_context_processor
     def make_shell_context():
@@ -94,7 +175,10 @@ def create_app(config_class=Config):
             "db":db,
             "User":User,
             "Event":Event,
+            "Series":Series,
             "Location":Location,
+            "Team":Team,
+            "Match":Match,
         }
         return context
 
@@ -102,4 +186,5 @@ def create_app(config_class=Config):
 
 
 # relative imports
-from .models import User, Event, Location
+from .models import User, Event, Series, Location, Team, Match
+from . import ratings
@@ -0,0 +1,244 @@
+## Imports
+
+# standard library
+import io
+import os
+import re
+import gzip
+import json
+import shutil
+import importlib
+from hashlib import md5
+
+# flask
+from flask import request, url_for
+
+
+IMAGES = (".png", ".jpg", ".jpeg")
+# worth compressing, images are compressed already
+TEXT = (".js", ".css", ".svg", ".json", ".txt")
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{8}\.\w+$")
+
+
+def fingerprint(name, data):
+    root, extension = os.path.splitext(name)
+    return "{}.{}{}".format(root, md5(data).hexdigest()[:8], extension)
+
+
+## Transforms, each falls back to the original bytes without its library
+
+# step: (module, package to install)
+OPTIONAL = {
+    "image optimization and webp": ("PIL", "Pillow"),
+    "javascript minifying": ("rjsmin", "rjsmin"),
+    "css minifying": ("rcssmin", "rcssmin"),
+    "brotli compression": ("brotli", "brotli"),
+}
+
+
+# {step: package} of the steps a build would skip here
+def missing_steps():
+    missing = {}
+    for step, (module, package) in OPTIONAL.items():
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            missing[step] = package
+    return missing
+
+
+def minify(name, data):
+    try:
+        if name.endswith(".js"):
+            from rjsmin import jsmin
+
+            return jsmin(data.decode("utf-8")).encode("utf-8")
+        if name.endswith(".css"):
+            from rcssmin import cssmin
+
+            return cssmin(data.decode("utf-8")).encode("utf-8")
+    except ImportError:
+        pass
+    return data
+
+
+# (re-encoded image, webp version or None)
+def optimize_image(name, data, max_width):
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, None
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    if image.width > max_width:
+        height = round(image.height * max_width / image.width)
+        image = image.resize((max_width, height), Image.LANCZOS)
+
+    encoded = io.BytesIO()
+    if name.lower().endswith(".png"):
+        image.save(encoded, "PNG", optimize=True)
+    else:
+        image.convert("RGB").save(
+            encoded, "JPEG", quality=85, optimize=True, progressive=True
+        )
+    webp = io.BytesIO()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    image.save(webp, "WEBP", quality=80, method=6)
+    # never ship something bigger than what we started with
+    return min(encoded.getvalue(), data, key=len), webp.getvalue()
+
+
+def compressed_variants(data):
+    gzipped = io.BytesIO()
+    # a fixed mtime keeps the output reproducible
+    with gzip.GzipFile(fileobj=gzipped, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(data)
+    variants = {".gz": gzipped.getvalue()}
+    try:
+        import brotli
+
+        variants[".br"] = brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    return variants
+
+
+## Build
+
+
+class AssetBuilder(object):
+    """Writes every file of the static folder to the output folder under a
+    content hashed name, plus its plain name so relative references (like
+    the OpenLayers theme) still resolve, and records the mapping in
+    manifest.json."""
+
+    def __init__(self, source, output, image_widths=None, max_width=1920):
+        self.source = source
+        self.output = output
+        self.image_widths = image_widths or {}
+        self.max_width = max_width
+        self.manifest = {"files": {}, "webp": {}}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def sources(self):
+        output = os.path.abspath(self.output)
+        for directory, folders, files in os.walk(self.source):
+            if os.path.abspath(directory).startswith(output):
+                continue
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                yield os.path.relpath(path, self.source).replace(os.sep, "/"), path
+
+    def _write(self, name, data, compress=False):
+        path = os.path.join(self.output, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        if compress:
+            for suffix, variant in compressed_variants(data).items():
+                with open(path + suffix, "wb") as f:
+                    f.write(variant)
+
+    def build(self):
+        if os.path.isdir(self.output):
+            shutil.rmtree(self.output)
+        for name, path in self.sources():
+            with open(path, "rb") as f:
+                data = f.read()
+            self.bytes_in += len(data)
+            lower = name.lower()
+            webp = None
+            if lower.endswith(IMAGES):
+                width = self.image_widths.get(name, self.max_width)
+                data, webp = optimize_image(name, data, width)
+            else:
+                data = minify(lower, data)
+            self.bytes_out += len(data)
+
+            compress = lower.endswith(TEXT)
+            hashed = fingerprint(name, data)
+            self._write(name, data, compress)
+            self._write(hashed, data, compress)
+            self.manifest["files"][name] = hashed
+            if webp is not None:
+                hashed_webp = fingerprint(os.path.splitext(name)[0] + ".webp", webp)
+                self._write(hashed_webp, webp)
+                self.manifest["webp"][name] = hashed_webp
+
+        with open(os.path.join(self.output, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        return self.manifest
+
+
+## Serving
+
+
+class Assets(object):
+    """Points `url_for("static", ...)` at the built, fingerprinted files when
+    a manifest exists, and marks those files as cacheable forever."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.manifest = {"files": {}, "webp": {}}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ASSETS_OUTPUT", "dist")
+        app.config.setdefault("ASSETS_ENABLED", True)
+        app.config.setdefault("ASSETS_IMAGE_MAX_WIDTH", 1920)
+        app.config.setdefault("ASSETS_IMAGE_WIDTHS", {})
+        app.extensions["assets"] = self
+        self.app = app
+        self.load()
+        app.url_defaults(self._static_url)
+        app.after_request(self._cache_headers)
+        app.add_template_global(self.webp_url)
+
+    @property
+    def output(self):
+        return os.path.join(self.app.static_folder, self.app.config["ASSETS_OUTPUT"])
+
+    def load(self):
+        path = os.path.join(self.output, "manifest.json")
+        if self.app.config["ASSETS_ENABLED"] and os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"files": {}, "webp": {}}
+
+    def builder(self):
+        return AssetBuilder(
+            self.app.static_folder,
+            self.output,
+            image_widths=self.app.config["ASSETS_IMAGE_WIDTHS"],
+            max_width=self.app.config["ASSETS_IMAGE_MAX_WIDTH"],
+        )
+
+    def _static_url(self, endpoint, values):
+        if endpoint == "static":
+            hashed = self.manifest["files"].get(values.get("filename"))
+            if hashed is not None:
+                values["filename"] = self.app.config["ASSETS_OUTPUT"] + "/" + hashed
+
+    def webp_url(self, filename):
+        hashed = self.manifest["webp"].get(filename)
+        if hashed is None:
+            return None
+        # already a built file, so skip the rewrite above
+        return url_for(
+            "static", filename=self.app.config["ASSETS_OUTPUT"] + "/" + hashed
+        )
+
+    def _cache_headers(self, response):
+        if (
+            request.endpoint == "static"
+            and response.status_code in (200, 304)
+            and FINGERPRINTED.search(request.path)
+        ):
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.headers["Cache-Control"] += ", immutable"
+        return response
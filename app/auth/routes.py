@@ -1,7 +1,7 @@
 from flask import render_template, flash, redirect, url_for, request
 from werkzeug.urls import url_parse
 from flask_login import current_user, login_user, logout_user
-from app import db
+from app import db, passwords, login_attempts
 from app.auth import bp
 from app.auth.forms import (
     LoginForm,
@@ -10,6 +10,7 @@ from app.auth.forms import (
     ResetPasswordForm,
 )
 from app.models import User
+from app.passwords import HasherBusy
 from app.auth.email import send_password_reset_email
 
 
@@ -19,10 +20,23 @@ def login():
         return redirect(url_for("main.index"))
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data.lower()).first()
+        username = form.username.data.lower()
+        # refused before any hashing is done
+        if not login_attempts.allowed(request.remote_addr, username):
+            flash("Too many failed attempts, please try again in a few minutes")
+            return render_template("auth/login.html", title="Sign In", form=form), 429
+        user = User.query.filter_by(username=username).first()
         if user is None or not user.check_password(form.password.data):
+            login_attempts.failed(request.remote_addr, username)
             flash("Invalid username or password")
             return redirect(url_for("auth.login"))
+        login_attempts.succeeded(username)
+        if passwords.needs_rehash(user.password_hash):
+            try:
+                user.set_password(form.password.data)
+                db.session.commit()
+            except HasherBusy:
+                pass  # upgraded on a next login
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get("next")
         if not next_page or url_parse(next_page).netloc != "":
@@ -0,0 +1,158 @@
+## Imports
+
+# standard library
+import os
+import re
+import zlib
+import struct
+from time import time
+from uuid import uuid4
+from hashlib import md5
+from threading import Lock
+from colorsys import hls_to_rgb
+
+# sqlalchemy
+from sqlalchemy import event
+
+
+# requested sizes are rounded up to one of these, so few files are generated
+AVATAR_SIZES = (32, 64, 128, 256, 512)
+DIGEST = re.compile(r"^[0-9a-f]{32}$")
+# bump when the drawing changes, it is part of the etag
+IDENTICON_VERSION = 1
+BACKGROUND = (240, 240, 240)
+
+
+def avatar_size(size):
+    for bucket in AVATAR_SIZES:
+        if size <= bucket:
+            return bucket
+    return AVATAR_SIZES[-1]
+
+
+## Identicons
+
+
+def _png(width, height, rows):
+    def chunk(kind, data):
+        body = kind + data
+        return (
+            struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+        )
+
+    # every scanline starts with filter type 0
+    raw = b"".join(b"\x00" + row for row in rows)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+# a 5x5 mirrored pattern in one colour, both taken from the md5 hex digest
+def identicon_png(digest, size):
+    hue = int(digest[-7:], 16) / float(0xFFFFFFF)
+    color = tuple(int(c * 255) for c in hls_to_rgb(hue, 0.5, 0.55))
+    cells = [
+        [int(digest[row * 3 + min(col, 4 - col)], 16) % 2 == 0 for col in range(5)]
+        for row in range(5)
+    ]
+    cell = size // 6
+    margin = (size - 5 * cell) // 2
+    background = bytes(BACKGROUND)
+    foreground = bytes(color)
+
+    rows = []
+    blank = background * size
+    for y in range(size):
+        row = (y - margin) // cell
+        if y < margin or row >= 5:
+            rows.append(blank)
+            continue
+        line = [background * margin]
+        line.extend(foreground * cell if on else background * cell for on in cells[row])
+        line.append(background * (size - margin - 5 * cell))
+        rows.append(b"".join(line))
+    return _png(size, size, rows)
+
+
+class AvatarStore(object):
+    """Identicons generated on first use and kept on disk, one directory per
+    size bucket under `AVATAR_CACHE_DIR`.
+
+    Only the digests of users' emails get a file, anything else is drawn for
+    every request, so made up digests cannot fill the disk. The digests are
+    loaded again after a user is added or changed in this process, and for
+    an unknown one at most every `AVATAR_DIGEST_TTL` seconds.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._digests = frozenset()
+        self._loaded = None
+        self._stale = True
+        self._lock = Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "AVATAR_CACHE_DIR", os.path.join(app.instance_path, "avatars")
+        )
+        app.config.setdefault("AVATAR_DIGEST_TTL", 60)
+        app.extensions["avatars"] = self
+        self.app = app
+        if not self._listening:
+            from app.models import User
+
+            for name in ("after_insert", "after_update"):
+                event.listen(User, name, self.invalidate)
+            self._listening = True
+
+    def invalidate(self, *args):
+        self._stale = True
+
+    def _refresh(self):
+        from app import db
+        from app.models import User
+
+        self._digests = frozenset(
+            md5(email.lower().encode("utf-8")).hexdigest()
+            for email, in db.session.query(User.email)
+        )
+        self._loaded = time()
+        self._stale = False
+
+    # whether the digest is the one of a user's email
+    def known(self, digest):
+        if digest in self._digests:
+            return True
+        with self._lock:
+            if (
+                self._stale
+                or self._loaded is None
+                or time() - self._loaded >= self.app.config["AVATAR_DIGEST_TTL"]
+            ):
+                self._refresh()
+            return digest in self._digests
+
+    def etag(self, digest, size):
+        return "{}-{}-{}".format(digest, size, IDENTICON_VERSION)
+
+    # path of the png, generating it when it is not there yet; only for
+    # known digests
+    def path(self, digest, size):
+        directory = os.path.join(
+            self.app.config["AVATAR_CACHE_DIR"], str(size), digest[:2]
+        )
+        path = os.path.join(directory, "{}-{}.png".format(digest, IDENTICON_VERSION))
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            # written aside and renamed, so no reader sees half a file
+            temporary = "{}.{}.tmp".format(path, uuid4().hex)
+            with open(temporary, "wb") as f:
+                f.write(identicon_png(digest, size))
+            os.replace(temporary, path)
+        return path
@@ -0,0 +1,108 @@
+## Imports
+
+# standard library
+import os
+import re
+import sys
+import json
+import subprocess
+from time import perf_counter
+from contextlib import contextmanager
+
+
+# "import time:   self [us] | cumulative | <indent>package", see python -X importtime
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+class BootTimer(object):
+    """Wall time of every phase of `create_app`, kept in
+    `app.extensions["boot"]`."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, perf_counter() - started))
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+
+## Profiling, in a fresh interpreter so nothing is imported yet
+
+
+# run in the child, the app package is imported by then: time create_app and
+# the first request, print json
+def cold_start(path):
+    from app import create_app
+
+    started = perf_counter()
+    app = create_app()
+    created = perf_counter()
+    status = app.test_client().get(path).status_code
+    served = perf_counter()
+    print(
+        json.dumps(
+            {
+                "create_app": created - started,
+                "phases": app.extensions["boot"].phases,
+                "first_request": served - created,
+                "status": status,
+            }
+        )
+    )
+
+
+# (seconds importing the app package, [(module it imported, seconds)]) with
+# the slowest modules first
+def parse_import_times(lines):
+    total, imports = 0.0, []
+    depth = None
+    # children are printed before their parent, so read bottom up
+    for line in reversed(lines):
+        match = IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        seconds = int(match.group(2)) / 1e6
+        indent, name = len(match.group(3)), match.group(4)
+        if depth is None:
+            if name == "app":
+                total, depth = seconds, indent + 2
+        elif indent < depth:
+            break
+        elif indent == depth:
+            imports.append((name, seconds))
+    return total, sorted(imports, key=lambda item: item[1], reverse=True)
+
+
+def profile(path="/home"):
+    """Cold start timings of a new process: the imports of the app package,
+    the phases of `create_app` and the first request to `path`."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "from app.boot import cold_start; cold_start({!r})".format(path),
+        ],
+        cwd=root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    report = json.loads(process.stdout.strip().splitlines()[-1])
+    report["import"], report["imports"] = parse_import_times(
+        process.stderr.splitlines()
+    )
+    report["total"] = report["import"] + report["create_app"] + report["first_request"]
+    return report
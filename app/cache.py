@@ -0,0 +1,211 @@
+## Imports
+
+# standard library
+from threading import Lock
+from collections import OrderedDict
+
+# flask
+from flask import current_app
+from jinja2 import Markup
+from werkzeug.utils import import_string
+
+
+## Backends
+
+
+class CacheBackend(object):
+    """Storage for rendered fragments and their version counters.
+
+    Fragments may be evicted at any time. A counter may only be lost if it
+    comes back higher than it ever was, otherwise an older version of a
+    fragment would come back into play. A shared backend (e.g. redis) only
+    has to implement these methods.
+    """
+
+    @classmethod
+    def from_app(cls, app):
+        return cls()
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def info(self):
+        return {}
+
+
+class LRUBackend(CacheBackend):
+    """In-process backend evicting the least recently used fragments and
+    counters once together they exceed `max_bytes` characters, a counter
+    counting as its key. An evicted counter comes back above every evicted
+    value, so the fragments of its old versions stay unreachable; other
+    counters that were never set move up with it, which only costs misses.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        # fragments (str) and counters (int) in least recently used order
+        self._items = OrderedDict()
+        # the value of a counter that is not stored
+        self._floor = 0
+        self._lock = Lock()
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(max_bytes=app.config["FRAGMENT_CACHE_MAX_BYTES"])
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) if isinstance(value, int) else len(value)
+
+    def _pop(self, key):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= self._size(key, old)
+
+    # call with the lock held
+    def _add(self, key, value):
+        self._pop(key)
+        self._items[key] = value
+        self.size += self._size(key, value)
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self._items.popitem(last=False)
+            self.size -= self._size(evicted_key, evicted)
+            self.evictions += 1
+            if isinstance(evicted, int):
+                self._floor = max(self._floor, evicted + 1)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(value) > self.max_bytes:
+                self._pop(key)
+                return
+            self._add(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def counter(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                return self._floor
+            self._items.move_to_end(key)
+            return value
+
+    def incr(self, key):
+        with self._lock:
+            value = self._items.get(key, self._floor) + 1
+            self._add(key, value)
+            return value
+
+    def clear(self):
+        # the fragments only, see CacheBackend
+        with self._lock:
+            for key, value in list(self._items.items()):
+                if not isinstance(value, int):
+                    self._pop(key)
+
+    def info(self):
+        with self._lock:
+            counters = sum(isinstance(value, int) for value in self._items.values())
+            return {
+                "entries": len(self._items) - counters,
+                "counters": counters,
+                "size": self.size,
+                "max_size": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+## Fragment cache
+
+
+class FragmentCache(object):
+    """Caches the viewer independent part of `_event.html` per event.
+
+    Fragments are keyed by event id, the event's `updated_at` and a per event
+    version. `updated_at` lives in the database, so a change made by one
+    worker process is seen by all of them; routes also call `bump()` after
+    committing, which makes copies rendered concurrently in the same process
+    unreachable. Stale copies are left for the backend to evict.
+    """
+
+    template = "_event_body.html"
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("FRAGMENT_CACHE_ENABLED", True)
+        app.config.setdefault("FRAGMENT_CACHE_BACKEND", "app.cache.LRUBackend")
+        app.config.setdefault("FRAGMENT_CACHE_MAX_BYTES", 4 * 1024 * 1024)
+        backend = app.config["FRAGMENT_CACHE_BACKEND"]
+        if isinstance(backend, str):
+            backend = import_string(backend)
+        self.backend = backend.from_app(app)
+        app.extensions["fragment_cache"] = self
+        app.jinja_env.globals["event_fragment"] = self.event_fragment
+
+    def _version_key(self, event_id):
+        return "event:{}:version".format(event_id)
+
+    def key(self, event_id, updated_at=None):
+        version = self.backend.counter(self._version_key(event_id))
+        stamp = updated_at.isoformat() if updated_at is not None else ""
+        return "event:{}:{}:{}".format(event_id, stamp, version)
+
+    def bump(self, *event_ids):
+        for event_id in event_ids:
+            self.backend.incr(self._version_key(event_id))
+
+    def event_fragment(self, event):
+        template = current_app.jinja_env.get_template(self.template)
+        if not current_app.config["FRAGMENT_CACHE_ENABLED"]:
+            return Markup(template.render(event=event))
+        key = self.key(event.id, event.updated_at)
+        html = self.backend.get(key)
+        with self._lock:
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if html is None:
+            html = template.render(event=event)
+            self.backend.set(key, html)
+        return Markup(html)
+
+    def stats(self):
+        with self._lock:
+            stats = {"hits": self.hits, "misses": self.misses}
+        stats.update(self.backend.info())
+        return stats
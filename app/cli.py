@@ -0,0 +1,253 @@
+## Imports
+
+# flask
+import click
+
+# relative
+from . import db, mail_queue, assets, search_index
+
+
+# the summary of a mail merge, failing the command when messages were not sent
+def report_merge(report, dry_run):
+    click.echo(("[dry run] " if dry_run else "") + str(report))
+    for address in report.failed:
+        click.echo("not sent: {}".format(address), err=True)
+    if report.failed:
+        raise click.ClickException("{} message(s) not sent".format(len(report.failed)))
+
+
+def register(app):
+    @app.cli.group("mail-queue")
+    def mail_queue_group():
+        """Outgoing mail spool commands."""
+        pass
+
+    @mail_queue_group.command()
+    def status():
+        """Show the queue depth and the delivery counters."""
+        click.echo("queued: {}".format(mail_queue.depth()))
+        from app.models import OutgoingMail
+
+        failed = OutgoingMail.query.filter_by(status="failed").count()
+        click.echo("failed: {}".format(failed))
+
+    @mail_queue_group.command()
+    def drain():
+        """Send all due messages in the foreground."""
+        handled = mail_queue.drain()
+        click.echo("handled {} message(s)".format(handled))
+        for name, value in sorted(mail_queue.stats().items()):
+            click.echo("{}: {}".format(name, value))
+
+    @app.cli.group("mail-merge")
+    def mail_merge_group():
+        """Bulk mail to the members."""
+        pass
+
+    @mail_merge_group.command()
+    @click.option("--hours", default=24, help="Remind of sessions this far ahead.")
+    @click.option("--chunk-size", default=500, help="Users handled per query.")
+    @click.option("--dry-run", is_flag=True, help="Render but do not send.")
+    def reminders(hours, chunk_size, dry_run):
+        """Remind participants of the sessions they joined."""
+        from app.mailmerge import send_event_reminders
+
+        with app.test_request_context(base_url=app.config["BASE_URL"]):
+            report = send_event_reminders(hours, chunk_size, dry_run)
+        report_merge(report, dry_run)
+
+    @mail_merge_group.command()
+    @click.option("--days", default=7, help="Include sessions this far ahead.")
+    @click.option("--chunk-size", default=500, help="Users handled per query.")
+    @click.option("--dry-run", is_flag=True, help="Render but do not send.")
+    def digest(days, chunk_size, dry_run):
+        """Send everyone an overview of the upcoming sessions."""
+        from app.mailmerge import send_weekly_digest
+
+        with app.test_request_context(base_url=app.config["BASE_URL"]):
+            report = send_weekly_digest(days, chunk_size, dry_run)
+        report_merge(report, dry_run)
+
+    @app.cli.group("ratings")
+    def ratings_group():
+        """Team and player ratings."""
+        pass
+
+    @ratings_group.command()
+    def recompute():
+        """Rebuild the leaderboard from the full match history."""
+        from app.ratings import recompute_all
+
+        try:
+            matches, teams, players = recompute_all()
+        except RuntimeError as error:
+            raise click.ClickException(str(error))
+        click.echo(
+            "rated {} match(es): {} team(s), {} player(s)".format(
+                matches, teams, players
+            )
+        )
+
+    @app.cli.group("search")
+    def search_group():
+        """Full-text search index."""
+        pass
+
+    @search_group.command()
+    @click.option("--chunk-size", default=1000, help="Rows read per query.")
+    def reindex(chunk_size):
+        """Rebuild the search index from all events, series, locations and users."""
+        counts = search_index.reindex(chunk_size)
+        click.echo(
+            "indexed {} with {}".format(
+                ", ".join(
+                    "{} {}(s)".format(count, kind)
+                    for kind, count in sorted(counts.items())
+                ),
+                search_index.backend(db.session.connection()),
+            )
+        )
+
+    @app.cli.command("import-matches")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--chunk-size", default=1000, help="Rows per transaction.")
+    @click.option("--checkpoint", help="Checkpoint file, default PATH.checkpoint.")
+    @click.option("--resume", is_flag=True, help="Continue after the checkpoint.")
+    @click.option("--validate-only", is_flag=True, help="Check the file, write nothing.")
+    def import_matches(path, chunk_size, checkpoint, resume, validate_only):
+        """Import historical matches from a csv or json lines file."""
+        from app.importer import (
+            MatchImporter,
+            RecordError,
+            ConcurrentImport,
+            CheckpointError,
+        )
+
+        importer = MatchImporter(path, chunk_size=chunk_size, checkpoint=checkpoint)
+        try:
+            ok = importer.validate() if validate_only else importer.run(resume=resume)
+        except (RecordError, ConcurrentImport, CheckpointError) as error:
+            raise click.ClickException(str(error))
+        for line, message in importer.errors[:50]:
+            click.echo("line {}: {}".format(line, message), err=True)
+        click.echo(
+            "{} {} row(s), {} new team(s), {:.0f} rows/s".format(
+                "validated" if validate_only else "imported",
+                importer.rows,
+                importer.created_teams,
+                importer.rate,
+            )
+        )
+        if not ok:
+            raise click.ClickException(
+                "{} invalid row(s){}".format(
+                    len(importer.errors),
+                    "" if validate_only else ", run again with --resume after fixing",
+                )
+            )
+
+    @app.cli.group("assets")
+    def assets_group():
+        """Static file build commands."""
+        pass
+
+    @assets_group.command()
+    @click.option(
+        "--allow-missing",
+        is_flag=True,
+        help="Build without the steps whose library is not installed.",
+    )
+    def build(allow_missing):
+        """Minify, resize, fingerprint and precompress the static files."""
+        from app.assets import missing_steps
+
+        missing = missing_steps()
+        if missing and not allow_missing:
+            raise click.ClickException(
+                "run pip install {} or pass --allow-missing".format(
+                    " ".join(sorted(set(missing.values())))
+                )
+            )
+        for step, package in sorted(missing.items()):
+            click.secho(
+                "warning: skipping {}, {} is not installed".format(step, package),
+                fg="yellow",
+                err=True,
+            )
+        builder = assets.builder()
+        manifest = builder.build()
+        assets.load()
+        click.echo(
+            "built {} file(s) ({} webp) into {}: {:.1f} MB -> {:.1f} MB".format(
+                len(manifest["files"]),
+                len(manifest["webp"]),
+                builder.output,
+                builder.bytes_in / 1e6,
+                builder.bytes_out / 1e6,
+            )
+        )
+
+    @app.cli.command("seed")
+    @click.option("--users", default=1000)
+    @click.option("--locations", default=50)
+    @click.option("--events", default=5000)
+    @click.option("--participants", default=6, help="Mean players per event.")
+    @click.option("--series", default=20, help="Recurring events.")
+    @click.option("--teams", default=200)
+    @click.option("--matches", default=2000)
+    @click.option("--days", default=180, help="Events this many days around today.")
+    @click.option("--password", default="password", help="Of every user.")
+    @click.option("--random-seed", default=1)
+    def seed(**options):
+        """Fill an empty SQLite database with generated data."""
+        from flask_migrate import upgrade
+        from app.seed import Seeder
+
+        # never by accident in production
+        if db.engine.dialect.name != "sqlite":
+            raise click.ClickException("only seeds a local SQLite database")
+        upgrade()
+        seeder = Seeder(**options)
+        if not seeder.is_empty():
+            raise click.ClickException("the database already has users")
+        counts = seeder.run()
+        # the rows were written with core statements, the flushes missed them
+        search_index.reindex()
+        for table, count in sorted(counts.items()):
+            click.echo("{}: {}".format(table, count))
+        click.echo("seeded in {:.1f}s".format(seeder.seconds))
+
+    @app.cli.command("boot-profile")
+    @click.option("--path", default="/home", help="Page of the first request.")
+    @click.option("--target", type=int, help="Milliseconds, default BOOT_TARGET_MS.")
+    @click.option("--top", default=8, help="Slowest imports shown.")
+    def boot_profile(path, target, top):
+        """Time a cold start: imports, create_app and the first request."""
+        from app.boot import profile
+
+        target = target or app.config["BOOT_TARGET_MS"]
+        try:
+            report = profile(path)
+        except RuntimeError as e:
+            raise click.ClickException("the app does not start: {}".format(e))
+
+        def line(name, seconds, indent=0):
+            click.echo("{:<40}{:>8.0f} ms".format(" " * indent + name, seconds * 1000))
+
+        line("import app", report["import"])
+        for name, seconds in report["imports"][:top]:
+            line(name, seconds, 2)
+        line("create_app", report["create_app"])
+        for name, seconds in report["phases"]:
+            line(name, seconds, 2)
+        line(
+            "first request {} ({})".format(path, report["status"]),
+            report["first_request"],
+        )
+        line("total", report["total"])
+        if report["total"] * 1000 > target:
+            raise click.ClickException(
+                "cold start took {:.0f} ms, over the {} ms target".format(
+                    report["total"] * 1000, target
+                )
+            )
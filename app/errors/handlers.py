@@ -1,6 +1,7 @@
 from flask import render_template
 from app import db
 from app.errors import bp
+from app.passwords import HasherBusy
 
 @bp.app_errorhandler(404)
 def not_found_error(error):
@@ -9,4 +10,8 @@ def not_found_error(error):
 @bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
-    return render_template('errors/500.html'), 500
\ No newline at end of file
+    return render_template('errors/500.html'), 500
+
+@bp.app_errorhandler(HasherBusy)
+def busy_error(error):
+    return render_template('errors/503.html'), 503, {'Retry-After': '5'}
@@ -0,0 +1,81 @@
+## Imports
+
+# standard library
+from math import radians, degrees, sin, cos, asin, sqrt
+
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+# sorts after every geohash character, closes prefix range scans
+GEOHASH_UPPER = "~"
+
+
+## Geohash
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        interval, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(geohash)
+
+
+# width and height in degrees of a geohash cell
+def cell_size(precision):
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 360.0 / 2 ** lon_bits, 180.0 / 2 ** lat_bits
+
+
+# geohash prefixes of the cells covering a circle; a bounding box no larger
+# than one cell touches at most four cells, all of which contain a corner
+def covering_prefixes(latitude, longitude, radius_km):
+    dlat = degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = dlat / max(cos(radians(latitude)), 1e-6)
+    precision = 0
+    while precision < GEOHASH_PRECISION:
+        width, height = cell_size(precision + 1)
+        if width < 2 * dlon or height < 2 * dlat:
+            break
+        precision += 1
+    if precision == 0:
+        return None
+    corners = [
+        (min(max(latitude + y, -90.0), 90.0), ((longitude + x + 180.0) % 360.0) - 180.0)
+        for y in (-dlat, dlat)
+        for x in (-dlon, dlon)
+    ]
+    return sorted({geohash_encode(lat, lon, precision) for lat, lon in corners})
+
+
+# geohash precision whose cells are about a quarter of a 256px map tile wide
+# at the given web mercator zoom level
+def precision_for_zoom(zoom):
+    target = 360.0 / 2 ** zoom / 4
+    precision = 1
+    while precision < GEOHASH_PRECISION and cell_size(precision + 1)[0] >= target:
+        precision += 1
+    return precision
+
+
+## Distance
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
@@ -0,0 +1,164 @@
+## Imports
+
+# standard library
+from datetime import timedelta
+from urllib.parse import urlparse
+
+# flask
+import jwt  # jason web token
+from flask import current_app, url_for
+
+
+ICAL_FORMAT = "%Y%m%dT%H%M%S"
+SCOPES = ("all", "user", "location")
+
+
+## Feed tokens: signed, without expiry, so calendar apps can poll without a
+## session; a new SECRET_KEY revokes them all
+
+
+def feed_token(scope, id=None):
+    return jwt.encode(
+        {"calendar": [scope, id]}, current_app.config["SECRET_KEY"], algorithm="HS256"
+    ).decode("utf-8")
+
+
+# (scope, id) of a token, None when it was not signed by us
+def read_feed_token(token):
+    try:
+        scope, id = jwt.decode(
+            token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
+        )["calendar"]
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return None
+    if scope not in SCOPES:
+        return None
+    return scope, id
+
+
+def feed_url(scope, id=None):
+    return url_for("main.calendar", token=feed_token(scope, id), _external=True)
+
+
+## iCalendar text, RFC 5545
+
+
+def escape(text):
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+# lines are folded at 75 octets, continuation lines start with a space
+def fold(line):
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts, start, limit = [], 0, 75
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # never split a multi-byte character
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode("utf-8"))
+        start, limit = end, 74
+    return "\r\n ".join(parts) + "\r\n"
+
+
+# event times are local, so they are written as floating times
+def stamp(when):
+    return when.strftime(ICAL_FORMAT)
+
+
+def component(name, properties):
+    lines = ["BEGIN:" + name]
+    lines.extend(
+        "{}:{}".format(key, value) for key, value in properties if value is not None
+    )
+    lines.append("END:" + name)
+    return "".join(fold(line) for line in lines)
+
+
+def _session(uid, start, updated_at, location, creator, info, url):
+    minutes = current_app.config["ICAL_EVENT_MINUTES"]
+    domain = urlparse(current_app.config["BASE_URL"]).netloc
+    description = "Added by {}".format(creator.username)
+    if info:
+        description += "\n" + info
+    return [
+        ("UID", "{}@{}".format(uid, domain)),
+        ("DTSTAMP", (updated_at or start).strftime(ICAL_FORMAT) + "Z"),
+        ("DTSTART", stamp(start)),
+        ("DTEND", stamp(start + timedelta(minutes=minutes))),
+        ("SUMMARY", escape("Spikeball at {}".format(location.name))),
+        ("LOCATION", escape(location.name)),
+        ("DESCRIPTION", escape(description)),
+        ("URL", url),
+    ]
+
+
+def event_component(event):
+    url = current_app.config["BASE_URL"] + url_for(
+        "main.event_detail", event_id=event.id
+    )
+    return component(
+        "VEVENT",
+        _session(
+            "event-{}".format(event.id),
+            event.datetime,
+            event.updated_at,
+            event.location,
+            event.creator,
+            event.info,
+            url,
+        ),
+    )
+
+
+# the series as one recurring event from its first date in the feed on; the
+# dates that got an event row of their own, or were cancelled, are left out
+# with EXDATE
+def series_component(series, first, exdates=()):
+    if series.interval_days % 7 == 0:
+        rule = "FREQ=WEEKLY;INTERVAL={}".format(series.interval_days // 7)
+    else:
+        rule = "FREQ=DAILY;INTERVAL={}".format(series.interval_days)
+    if series.until is not None:
+        rule += ";UNTIL=" + stamp(series.until)
+    properties = _session(
+        "series-{}".format(series.id),
+        first,
+        series.updated_at,
+        series.location,
+        series.creator,
+        series.info,
+        current_app.config["BASE_URL"] + url_for("main.index"),
+    )
+    properties.append(("RRULE", rule))
+    if exdates:
+        dates = ",".join(stamp(when) for when in sorted(exdates))
+        properties.append(("EXDATE", dates))
+    return component("VEVENT", properties)
+
+
+# the feed as chunks of text, for a streamed response: the components are
+# rendered while the rows come in
+def calendar(name, components):
+    yield "".join(
+        fold(line)
+        for line in (
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            "PRODID:-//Spikeball Gent//Events//EN",
+            "CALSCALE:GREGORIAN",
+            "X-WR-CALNAME:" + escape(name),
+            "X-WR-TIMEZONE:" + current_app.config["ICAL_TIMEZONE"],
+        )
+    )
+    for text in components:
+        yield text
+    yield "END:VCALENDAR\r\n"
@@ -0,0 +1,297 @@
+## Imports
+
+# standard library
+import os
+import csv
+import json
+from time import time
+from datetime import datetime
+from itertools import islice
+
+# sqlalchemy
+from sqlalchemy import func
+
+# relative
+from app import db
+from app.models import User, Team, Match, team_player, match_team
+from app.ratings import apply_matches, recompute_all
+
+
+FIELDS = [
+    "date",
+    "team1",
+    "team1_player1",
+    "team1_player2",
+    "team2",
+    "team2_player1",
+    "team2_player2",
+    "score1",
+    "score2",
+]
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+
+
+class RecordError(ValueError):
+    pass
+
+
+# the chunk was rolled back, the ones before it are in the checkpoint
+class ConcurrentImport(RuntimeError):
+    pass
+
+
+# a checkpoint that does not belong to the file being imported
+class CheckpointError(ValueError):
+    pass
+
+
+## Reading
+
+
+# (line number, dict) for every record of a csv or json lines file
+def read_records(path):
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f)
+            missing = set(FIELDS) - set(reader.fieldnames or [])
+            if missing:
+                raise RecordError("missing column(s): " + ", ".join(sorted(missing)))
+            for record in reader:
+                yield reader.line_num, record
+    else:
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as error:
+                        yield number, RecordError("invalid json: {}".format(error))
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format)
+        except ValueError:
+            pass
+    raise RecordError("invalid date {!r}".format(value))
+
+
+class MatchImporter(object):
+    """Imports matches from a file in chunked transactions.
+
+    Usernames and team names are resolved through dictionaries built once
+    at the start; teams that do not exist yet are created on the fly. After
+    every committed chunk the number of the last imported line is written to
+    the checkpoint file, so an interrupted import can be resumed.
+    """
+
+    def __init__(self, path, chunk_size=1000, checkpoint=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint or path + ".checkpoint"
+        self.users = {
+            username: id for id, username in db.session.query(User.id, User.username)
+        }
+        self.teams = {}
+        self.rosters = {}
+        for id, teamname in db.session.query(Team.id, Team.teamname).order_by(Team.id):
+            self.teams.setdefault(teamname, id)
+        for team_id, player_id in db.session.query(
+            team_player.c.team_id, team_player.c.player_id
+        ):
+            self.rosters.setdefault(team_id, set()).add(player_id)
+        self.rows = 0
+        self.created_teams = 0
+        self.errors = []
+        self.started = None
+        # ratings are applied in file order, history older than what is
+        # already rated needs a full recompute at the end
+        self.latest = db.session.query(func.max(Match.date)).scalar()
+        self.out_of_order = False
+
+    ## Validation
+
+    def _player(self, record, field):
+        username = (record.get(field) or "").strip().lower()
+        if username not in self.users:
+            raise RecordError("unknown user {!r} in {}".format(username, field))
+        return self.users[username]
+
+    def _team(self, record, side, pending):
+        name = (record.get(side) or "").strip().lower()
+        if not name:
+            raise RecordError("no name for " + side)
+        players = {
+            self._player(record, side + "_player1"),
+            self._player(record, side + "_player2"),
+        }
+        if len(players) != 2:
+            raise RecordError("{} needs two different players".format(side))
+        team_id = self.teams.get(name)
+        roster = self.rosters.get(team_id) if team_id else pending.get(name)
+        if roster is not None and roster != players:
+            raise RecordError("team {!r} has other players".format(name))
+        if team_id is None:
+            pending[name] = players
+        return name
+
+    def parse(self, record, pending):
+        if isinstance(record, Exception):
+            raise record
+        team1 = self._team(record, "team1", pending)
+        team2 = self._team(record, "team2", pending)
+        if team1 == team2:
+            raise RecordError("a team can not play itself")
+        try:
+            score1, score2 = int(record["score1"]), int(record["score2"])
+        except (KeyError, TypeError, ValueError):
+            raise RecordError("invalid score")
+        return {
+            "date": parse_date(str(record.get("date") or "")),
+            "team1": team1,
+            "team2": team2,
+            "score1": score1,
+            "score2": score2,
+        }
+
+    ## Importing
+
+    def _resume_from(self):
+        if not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as f:
+            checkpoint = json.load(f)
+        if checkpoint["file"] != os.path.abspath(self.path):
+            raise CheckpointError(
+                "{} is the checkpoint of {}".format(self.checkpoint, checkpoint["file"])
+            )
+        # the chunks already imported may still need the recompute at the end
+        self.out_of_order = checkpoint.get("out_of_order", False)
+        return checkpoint["line"]
+
+    def _save_checkpoint(self, line):
+        with open(self.checkpoint + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "file": os.path.abspath(self.path),
+                    "line": line,
+                    "out_of_order": self.out_of_order,
+                },
+                f,
+            )
+        os.replace(self.checkpoint + ".tmp", self.checkpoint)
+
+    def _chunks(self, skip):
+        records = ((n, r) for n, r in read_records(self.path) if n > skip)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def validate(self):
+        self.started = time()
+        pending = {}
+        for chunk in self._chunks(0):
+            for line, record in chunk:
+                try:
+                    self.parse(record, pending)
+                    self.rows += 1
+                except RecordError as error:
+                    self.errors.append((line, str(error)))
+        self.created_teams = len(pending)
+        return not self.errors
+
+    def run(self, resume=False):
+        self.started = time()
+        skip = self._resume_from() if resume else 0
+        for chunk in self._chunks(skip):
+            pending, matches = {}, []
+            for line, record in chunk:
+                try:
+                    matches.append(self.parse(record, pending))
+                except RecordError as error:
+                    self.errors.append((line, str(error)))
+            if self.errors:
+                # nothing of this chunk is written, fix the file and resume
+                return False
+            with db.engine.begin() as connection:
+                self._create_teams(connection, pending)
+                self._insert_matches(connection, matches)
+            self.rows += len(matches)
+            self._save_checkpoint(chunk[-1][0])
+        if self.out_of_order:
+            recompute_all()
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        return True
+
+    def _create_teams(self, connection, pending):
+        for name, players in pending.items():
+            result = connection.execute(Team.__table__.insert().values(teamname=name))
+            team_id = result.inserted_primary_key[0]
+            self.teams[name] = team_id
+            self.rosters[team_id] = players
+        if pending:
+            connection.execute(
+                team_player.insert(),
+                [
+                    {"team_id": self.teams[name], "player_id": player_id}
+                    for name, players in pending.items()
+                    for player_id in players
+                ],
+            )
+        self.created_teams += len(pending)
+
+    def _insert_matches(self, connection, matches):
+        table = Match.__table__
+        matches.sort(key=lambda m: m["date"])
+        if self.latest is not None and matches[0]["date"] < self.latest:
+            self.out_of_order = True
+        self.latest = max(self.latest or matches[-1]["date"], matches[-1]["date"])
+        # ids are handed out in insert order; collect them afterwards to link
+        # the teams, refusing the chunk if anybody else inserted meanwhile
+        last_id = connection.execute(db.select([func.max(table.c.id)])).scalar() or 0
+        connection.execute(
+            table.insert(),
+            [
+                {
+                    "date": m["date"],
+                    "team1_id": self.teams[m["team1"]],
+                    "team2_id": self.teams[m["team2"]],
+                    "score1": m["score1"],
+                    "score2": m["score2"],
+                }
+                for m in matches
+            ],
+        )
+        ids = [
+            row[0]
+            for row in connection.execute(
+                db.select([table.c.id]).where(table.c.id > last_id).order_by(table.c.id)
+            )
+        ]
+        if len(ids) != len(matches):
+            raise ConcurrentImport(
+                "matches were added concurrently, run again with --resume"
+            )
+        connection.execute(
+            match_team.insert(),
+            [
+                {"match_id": match_id, "team_id": self.teams[m[side]]}
+                for match_id, m in zip(ids, matches)
+                for side in ("team1", "team2")
+            ],
+        )
+        apply_matches(
+            connection,
+            [
+                (self.teams[m["team1"]], self.teams[m["team2"]], m["score1"], m["score2"])
+                for m in matches
+            ],
+        )
+
+    @property
+    def rate(self):
+        return self.rows / max(time() - self.started, 1e-9)
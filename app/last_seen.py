@@ -0,0 +1,130 @@
+## Imports
+
+# standard library
+import atexit
+from time import time
+from datetime import datetime
+from threading import Thread, Condition, Lock
+
+# sqlalchemy
+from sqlalchemy import bindparam
+
+# relative
+from app.per_process import PerProcess
+
+
+class LastSeenTracker(object):
+    """Write-behind buffer for `User.last_seen`.
+
+    Requests only record a touch in memory; touches are coalesced per user and
+    written with one bulk UPDATE once `LAST_SEEN_FLUSH_SIZE` users are pending
+    or the oldest pending touch is `LAST_SEEN_FLUSH_INTERVAL` seconds old,
+    by a thread that waits for that, so the interval is the upper bound on
+    how stale `last_seen` can be also when no more requests come in.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = {}
+        self._lock = Lock()
+        self._due = Condition(self._lock)
+        self._oldest = None
+        # the thread waiting for the interval to flush what is still pending
+        self._start = PerProcess(self._start_flusher)
+        self._exit_hook = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LAST_SEEN_FLUSH_INTERVAL", 60)
+        app.config.setdefault("LAST_SEEN_FLUSH_SIZE", 100)
+        app.extensions["last_seen"] = self
+        with self._due:
+            # touches of an earlier app are for its database
+            self._pending = {}
+            self._oldest = None
+            self.app = app
+            self._due.notify()
+        if not self._exit_hook:
+            atexit.register(self._flush_at_exit)
+            self._exit_hook = True
+
+    def touch(self, user_id, when=None):
+        if when is None:
+            when = datetime.utcnow()
+        config = self.app.config
+        with self._lock:
+            self._pending[user_id] = when
+            if self._oldest is None:
+                self._oldest = time()
+                self._due.notify()
+            due = (
+                len(self._pending) >= config["LAST_SEEN_FLUSH_SIZE"]
+                or time() - self._oldest >= config["LAST_SEEN_FLUSH_INTERVAL"]
+            )
+        if due:
+            self.flush()
+        self._start()
+
+    def _start_flusher(self):
+        Thread(target=self._flush_when_due, name="last-seen", daemon=True).start()
+
+    def _flush_when_due(self):
+        while True:
+            with self._due:
+                if self._oldest is None:
+                    self._due.wait()
+                    continue
+                wait = (
+                    self._oldest + self.app.config["LAST_SEEN_FLUSH_INTERVAL"] - time()
+                )
+                if wait > 0:
+                    self._due.wait(wait)
+                    continue
+            with self.app.app_context():
+                self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+        if not pending:
+            return 0
+
+        # imported here to avoid a circular import with app/__init__.py
+        from app import db
+        from app.models import User
+
+        table = User.__table__
+        statement = (
+            table.update()
+            .where(table.c.id == bindparam("_id"))
+            # set to itself, or onupdate would invalidate every page validator
+            .values(last_seen=bindparam("_last_seen"), updated_at=table.c.updated_at)
+        )
+        rows = [
+            {"_id": user_id, "_last_seen": when} for user_id, when in pending.items()
+        ]
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, rows)
+        except Exception:
+            self.app.logger.exception("Could not flush last_seen updates")
+            # keep the touches for the next attempt unless newer ones arrived
+            with self._lock:
+                for user_id, when in pending.items():
+                    self._pending.setdefault(user_id, when)
+                if self._oldest is None:
+                    self._oldest = time()
+            return 0
+        return len(rows)
+
+    def _flush_at_exit(self):
+        if self.app is None or not self._pending:
+            return
+        with self.app.app_context():
+            self.flush()
@@ -0,0 +1,317 @@
+## Imports
+
+# standard library
+import os
+import json
+import socket
+import logging
+from time import time, sleep
+from uuid import uuid4
+from threading import Thread, Condition, Lock
+from collections import deque
+
+# flask
+from werkzeug.utils import import_string
+
+# relative
+from app.per_process import PerProcess
+
+
+## Fan-out backends
+
+
+class FanoutBackend(object):
+    """Carries every published message to the broker of each worker process.
+
+    `publish` may be called from any process; `start` is called once in a
+    process that has subscribers, with the function that hands a message to
+    them. A shared backend (e.g. redis pub/sub) only has to implement these
+    methods.
+    """
+
+    @classmethod
+    def from_app(cls, app):
+        return cls()
+
+    def start(self, deliver):
+        raise NotImplementedError
+
+    def publish(self, message):
+        raise NotImplementedError
+
+    def info(self):
+        return {}
+
+
+class LocalBackend(FanoutBackend):
+    """Only this process, enough for a single worker."""
+
+    def __init__(self):
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, message):
+        if self._deliver is not None:
+            self._deliver(message)
+
+
+class SocketBackend(FanoutBackend):
+    """The workers of one machine: every process with subscribers binds a
+    unix datagram socket named after its pid in `LIVE_DIR`, a publish is
+    sent to all of them. Sockets of processes that are gone are removed by
+    the next publish."""
+
+    def __init__(self, directory, logger=None):
+        self.directory = directory
+        self.logger = logger or logging.getLogger(__name__)
+        self.sent = 0
+        self.stale = 0
+        self.lost = 0
+        self._socket = None
+        self._lock = Lock()
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config["LIVE_DIR"], app.logger)
+
+    def start(self, deliver):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "{}.sock".format(os.getpid()))
+        if os.path.exists(path):
+            os.unlink(path)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+
+        # for the life of the worker, whatever one datagram does
+        def receive():
+            while True:
+                try:
+                    deliver(receiver.recv(65536).decode("utf-8"))
+                except Exception:
+                    self.logger.exception("Live update receiver failed")
+                    sleep(1)
+
+        Thread(target=receive, name="live-receiver", daemon=True).start()
+
+    def publish(self, message):
+        data = message.encode("utf-8")
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                # a worker that is behind must not hold up the request
+                self._socket.setblocking(False)
+            for name in names:
+                if not name.endswith(".sock"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    self._socket.sendto(data, path)
+                    self.sent += 1
+                except (ConnectionRefusedError, FileNotFoundError):
+                    self.stale += 1
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                except BlockingIOError:
+                    self.lost += 1
+
+    def info(self):
+        with self._lock:
+            return {"sent": self.sent, "stale": self.stale, "lost": self.lost}
+
+
+## Broker
+
+
+# the id of a message, from its first line
+def message_id(message):
+    return message.split("\n", 1)[0][len("id: ") :]
+
+
+class Subscriber(object):
+    """The messages waiting for one client, at most `size`; a client that
+    falls further behind loses the oldest ones and is told to reload."""
+
+    def __init__(self, size):
+        self.size = size
+        self.messages = deque()
+        self.overflowed = False
+        self._ready = Condition()
+
+    # False when an older message was dropped to make room
+    def put(self, message):
+        with self._ready:
+            dropped = len(self.messages) >= self.size
+            if dropped:
+                self.messages.popleft()
+                self.overflowed = True
+            self.messages.append(message)
+            self._ready.notify()
+        return not dropped
+
+    def reset(self):
+        with self._ready:
+            self.overflowed = True
+            self._ready.notify()
+
+    # (messages, overflowed) after waiting at most timeout seconds for some
+    def get(self, timeout):
+        with self._ready:
+            if not self.messages and not self.overflowed:
+                self._ready.wait(timeout)
+            messages, self.messages = list(self.messages), deque()
+            overflowed, self.overflowed = self.overflowed, False
+        return messages, overflowed
+
+
+class LiveBroker(object):
+    """Pushes changes to events to the open pages as server-sent events.
+
+    A publish is encoded once and handed to the bounded buffer of every
+    subscriber of every worker (through `LIVE_BACKEND`), nobody queries the
+    database for it. Messages carry an id and the last `LIVE_REPLAY` of them
+    are kept, so a client that reconnects with the id it saw last gets what
+    it missed, or a reset when that is too long ago. Each stream sends a
+    heartbeat comment every `LIVE_HEARTBEAT` seconds and ends after
+    `LIVE_MAX_SECONDS`, after which the browser reconnects; a stream keeps a
+    server thread busy, so at most `LIVE_MAX_SUBSCRIBERS` are open per
+    process.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.replayed = 0
+        self._subscribers = set()
+        self._recent = deque()
+        self._start_backend = PerProcess(lambda: self.backend.start(self._deliver))
+        self._origin = None
+        self._sequence = 0
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LIVE_BACKEND", "app.live.LocalBackend")
+        app.config.setdefault("LIVE_DIR", "/tmp/spikeball-live")
+        app.config.setdefault("LIVE_BUFFER", 100)
+        app.config.setdefault("LIVE_REPLAY", 200)
+        app.config.setdefault("LIVE_HEARTBEAT", 15)
+        app.config.setdefault("LIVE_MAX_SECONDS", 300)
+        app.config.setdefault("LIVE_MAX_SUBSCRIBERS", 16)
+        backend = app.config["LIVE_BACKEND"]
+        if isinstance(backend, str):
+            backend = import_string(backend)
+        self.backend = backend.from_app(app)
+        self._start_backend.reset()
+        self.buffer = app.config["LIVE_BUFFER"]
+        self._recent = deque(maxlen=app.config["LIVE_REPLAY"])
+        self.heartbeat = app.config["LIVE_HEARTBEAT"]
+        self.max_seconds = app.config["LIVE_MAX_SECONDS"]
+        self.max_subscribers = app.config["LIVE_MAX_SUBSCRIBERS"]
+        app.extensions["live"] = self
+        # the pages pass it to their first connection, see static/live.js
+        app.add_template_global(self.last_id, "live_last_id")
+        # from the first request on, so this worker knows the recent ids
+        app.before_first_request(self.start)
+
+    def start(self):
+        self._start_backend()
+
+    def publish(self, kind, **data):
+        with self._lock:
+            # unique over the workers and their restarts
+            if self._origin is None or self._origin[0] != os.getpid():
+                self._origin = (os.getpid(), uuid4().hex[:8])
+                self._sequence = 0
+            self._sequence += 1
+            id = "{}-{}".format(self._origin[1], self._sequence)
+            self.published += 1
+        message = "id: {}\nevent: {}\ndata: {}\n\n".format(
+            id, kind, json.dumps(data, separators=(",", ":"))
+        )
+        self.backend.publish(message)
+
+    def _deliver(self, message):
+        # one lock for the replay and the subscribers, so a client that
+        # subscribes meanwhile gets the message exactly once
+        with self._lock:
+            self._recent.append(message)
+            subscribers = list(self._subscribers)
+        dropped = sum(1 for subscriber in subscribers if not subscriber.put(message))
+        with self._lock:
+            self.delivered += len(subscribers)
+            self.dropped += dropped
+
+    def last_id(self):
+        with self._lock:
+            return message_id(self._recent[-1]) if self._recent else ""
+
+    # a Subscriber holding what came after last_id, None when this process
+    # has no room for another stream
+    def subscribe(self, last_id=None):
+        self.start()
+        subscriber = Subscriber(self.buffer)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self._subscribers.add(subscriber)
+            if last_id:
+                ids = [message_id(message) for message in self._recent]
+                if last_id in ids:
+                    missed = list(self._recent)[ids.index(last_id) + 1 :]
+                    self.replayed += len(missed)
+                    for message in missed:
+                        subscriber.put(message)
+                else:
+                    subscriber.reset()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    # the body of one event stream
+    def stream(self, subscriber):
+        deadline = time() + self.max_seconds
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                left = deadline - time()
+                if left <= 0:
+                    break
+                messages, overflowed = subscriber.get(min(self.heartbeat, left))
+                if overflowed:
+                    # the id lets the client carry on from here after reloading
+                    last = message_id(messages[-1]) if messages else self.last_id()
+                    yield "id: {}\nevent: reset\ndata: {{}}\n\n".format(last)
+                elif messages:
+                    yield "".join(messages)
+                else:
+                    yield ": heartbeat\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "replayed": self.replayed,
+                "rejected": self.rejected,
+            }
+        stats.update(self.backend.info())
+        return stats
@@ -0,0 +1,68 @@
+## Imports
+
+# standard library
+from time import time
+from bisect import bisect_left
+from threading import Lock
+
+# sqlalchemy
+from sqlalchemy import event
+
+
+class LocationIndex(object):
+    """Sorted in-memory copy of the location names for prefix search.
+
+    The index is rebuilt lazily on the next search after a location is
+    inserted, renamed or deleted in this process, and at least every
+    `LOCATION_INDEX_TTL` seconds to pick up changes made by other workers.
+    """
+
+    def __init__(self, app=None):
+        self._keys = []
+        self._names = []
+        self._built = None
+        self._stale = True
+        self._lock = Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LOCATION_INDEX_TTL", 300)
+        app.config.setdefault("LOCATION_SEARCH_LIMIT", 10)
+        app.extensions["location_index"] = self
+        self.ttl = app.config["LOCATION_INDEX_TTL"]
+        if not self._listening:
+            from app.models import Location
+
+            for name in ("after_insert", "after_update", "after_delete"):
+                event.listen(Location, name, self.invalidate)
+            self._listening = True
+
+    def invalidate(self, *args):
+        self._stale = True
+
+    def _refresh(self):
+        from app import db
+        from app.models import Location
+
+        rows = db.session.query(Location.name).all()
+        names = sorted({name for name, in rows}, key=str.lower)
+        self._keys = [name.lower() for name in names]
+        self._names = names
+        self._built = time()
+        self._stale = False
+
+    def search(self, prefix, limit=10):
+        prefix = prefix.strip().lower()
+        with self._lock:
+            if self._stale or time() - self._built >= self.ttl:
+                self._refresh()
+            keys, names = self._keys, self._names
+        start = bisect_left(keys, prefix)
+        matches = []
+        for i in range(start, min(start + limit, len(keys))):
+            if not keys[i].startswith(prefix):
+                break
+            matches.append(names[i])
+        return matches
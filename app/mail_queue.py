@@ -0,0 +1,336 @@
+## Imports
+
+# standard library
+import json
+import atexit
+import smtplib
+from time import time
+from uuid import uuid4
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Thread, Condition, Lock
+
+# flask
+from flask_mail import Message
+
+# sqlalchemy
+from sqlalchemy import and_, or_, bindparam, func
+
+# relative
+from app.per_process import PerProcess
+
+
+# errors after which the smtp connection can not be used for the rest of a
+# batch; every SMTPException is an OSError too, the others are about one
+# message and are handled per row
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)
+
+
+# whether the connection is gone, as opposed to one message being refused
+def connection_lost(error):
+    return isinstance(error, CONNECTION_ERRORS) or (
+        isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+    )
+
+
+# whether the server refused a message for good (5xx), retrying won't help
+def permanent(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, message in error.recipients.values()]
+        return bool(codes) and all(code >= 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class MailQueue(object):
+    """Durable outbound mail.
+
+    `enqueue()` only inserts the message in the `outgoing_mail` spool table.
+    A fixed pool of `MAIL_QUEUE_WORKERS` threads, started by the first request
+    or enqueue of a worker process, claims batches of pending messages and
+    sends each batch over a single smtp connection. Failed messages are
+    retried with exponential backoff until `MAIL_QUEUE_MAX_ATTEMPTS` is
+    reached; one the server rejects for good (5xx) fails at once. Messages
+    claimed by a worker that died are picked up again after
+    `MAIL_QUEUE_CLAIM_TIMEOUT` seconds.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._threads = []
+        self._stopping = False
+        self._wakeup = Condition()
+        self._start_workers = PerProcess(self._new_workers)
+        self._stats_lock = Lock()
+        self._latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MAIL_QUEUE_WORKERS", 2)
+        app.config.setdefault("MAIL_QUEUE_BATCH_SIZE", 20)
+        app.config.setdefault("MAIL_QUEUE_MAX_ATTEMPTS", 5)
+        app.config.setdefault("MAIL_QUEUE_RETRY_DELAY", 30)
+        app.config.setdefault("MAIL_QUEUE_POLL_INTERVAL", 30)
+        app.config.setdefault("MAIL_QUEUE_CLAIM_TIMEOUT", 600)
+        app.extensions["mail_queue"] = self
+        self.app = app
+        # mail left from before a restart goes out without waiting for new mail
+        app.before_first_request(self.start)
+
+    ## Producer side
+
+    def enqueue(self, message):
+        from app import db
+        from app.models import OutgoingMail
+
+        with db.engine.begin() as connection:
+            connection.execute(
+                OutgoingMail.__table__.insert().values(
+                    subject=message.subject,
+                    sender=self._address(message.sender),
+                    recipients=json.dumps(
+                        [self._address(r) for r in message.recipients]
+                    ),
+                    body=message.body,
+                    html=message.html,
+                    status="pending",
+                    attempts=0,
+                    next_attempt_at=datetime.utcnow(),
+                    created_at=datetime.utcnow(),
+                )
+            )
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _address(self, address):
+        # flask-mail accepts (name, address) tuples
+        if isinstance(address, (tuple, list)):
+            return "{} <{}>".format(*address)
+        return address
+
+    ## Workers
+
+    def start(self):
+        # with no workers the spool is only sent by `flask mail-queue drain`
+        if self.app.config["MAIL_QUEUE_WORKERS"] > 0:
+            self._start_workers()
+
+    def _new_workers(self):
+        self._stopping = False
+        self._threads = [
+            Thread(target=self._work, name="mail-queue-{}".format(i), daemon=True)
+            for i in range(self.app.config["MAIL_QUEUE_WORKERS"])
+        ]
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._start_workers.reset()
+
+    def _work(self):
+        while not self._stopping:
+            try:
+                with self.app.app_context():
+                    sent = self.process_batch()
+            except Exception:
+                self.app.logger.exception("Mail queue worker failed")
+                sent = 0
+            if not sent and not self._stopping:
+                with self._wakeup:
+                    self._wakeup.wait(self.app.config["MAIL_QUEUE_POLL_INTERVAL"])
+
+    # send everything that is due in the calling thread, e.g. from a cli
+    # command or a test; returns the number of messages handled
+    def drain(self):
+        handled = 0
+        with self.app.app_context():
+            while True:
+                count = self.process_batch()
+                if not count:
+                    return handled
+                handled += count
+
+    def process_batch(self):
+        batch = self._claim()
+        if batch:
+            self._send(batch)
+        return len(batch)
+
+    def _claim(self):
+        from app import db
+        from app.models import OutgoingMail
+
+        table = OutgoingMail.__table__
+        config = self.app.config
+        now = datetime.utcnow()
+        token = uuid4().hex
+        due = or_(
+            and_(table.c.status == "pending", table.c.next_attempt_at <= now),
+            and_(
+                table.c.status == "sending",
+                table.c.claimed_at
+                < now - timedelta(seconds=config["MAIL_QUEUE_CLAIM_TIMEOUT"]),
+            ),
+        )
+        with db.engine.begin() as connection:
+            ids = [
+                row[0]
+                for row in connection.execute(
+                    db.select([table.c.id])
+                    .where(due)
+                    .order_by(table.c.id)
+                    .limit(config["MAIL_QUEUE_BATCH_SIZE"])
+                )
+            ]
+            if not ids:
+                return []
+            # the status check makes sure two workers never claim the same row
+            connection.execute(
+                table.update()
+                .where(and_(table.c.id.in_(ids), due))
+                .values(status="sending", claimed_by=token, claimed_at=now)
+            )
+            return connection.execute(
+                db.select([table]).where(table.c.claimed_by == token)
+            ).fetchall()
+
+    def _send(self, batch):
+        from app import mail
+
+        results = []
+        started = time()
+        try:
+            with mail.connect() as connection:
+                for i, row in enumerate(batch):
+                    try:
+                        connection.send(self._message(row))
+                    except CONNECTION_ERRORS as error:
+                        results.extend(self._retry(r, error) for r in batch[i:])
+                        break
+                    except smtplib.SMTPException as error:
+                        # the server said no to this message, go on with the next
+                        results.append(self._retry(row, error, permanent(error)))
+                    except OSError as error:
+                        # the socket is gone
+                        results.extend(self._retry(r, error) for r in batch[i:])
+                        break
+                    except Exception as error:
+                        results.append(self._retry(row, error))
+                    else:
+                        results.append(self._sent(row))
+        except (smtplib.SMTPException, OSError) as error:
+            # connecting or logging in failed, or closing did
+            done = {result["_id"] for result in results}
+            results.extend(self._retry(r, error) for r in batch if r.id not in done)
+        self._store(results)
+        self.app.logger.debug(
+            "Mail queue sent a batch of %d in %.3fs", len(batch), time() - started
+        )
+
+    def _message(self, row):
+        message = Message(
+            row.subject, sender=row.sender, recipients=json.loads(row.recipients)
+        )
+        message.body = row.body
+        message.html = row.html
+        return message
+
+    def _sent(self, row):
+        now = datetime.utcnow()
+        with self._stats_lock:
+            self.sent += 1
+            if row.created_at is not None:
+                self._latencies.append((now - row.created_at).total_seconds())
+        return {
+            "_id": row.id,
+            "status": "sent",
+            "attempts": row.attempts + 1,
+            "next_attempt_at": row.next_attempt_at,
+            "sent_at": now,
+            "last_error": None,
+        }
+
+    def _retry(self, row, error, permanent=False):
+        config = self.app.config
+        attempts = row.attempts + 1
+        if permanent or attempts >= config["MAIL_QUEUE_MAX_ATTEMPTS"]:
+            status = "failed"
+            with self._stats_lock:
+                self.failed += 1
+            self.app.logger.error("Giving up on mail %d: %s", row.id, error)
+        else:
+            status = "pending"
+            with self._stats_lock:
+                self.retried += 1
+        delay = config["MAIL_QUEUE_RETRY_DELAY"] * 2 ** (attempts - 1)
+        return {
+            "_id": row.id,
+            "status": status,
+            "attempts": attempts,
+            "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+            "sent_at": None,
+            "last_error": str(error)[:255],
+        }
+
+    def _store(self, results):
+        from app import db
+        from app.models import OutgoingMail
+
+        if not results:
+            return
+        table = OutgoingMail.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                table.update()
+                .where(table.c.id == bindparam("_id"))
+                .values(
+                    status=bindparam("status"),
+                    attempts=bindparam("attempts"),
+                    next_attempt_at=bindparam("next_attempt_at"),
+                    sent_at=bindparam("sent_at"),
+                    last_error=bindparam("last_error"),
+                    claimed_by=None,
+                    claimed_at=None,
+                ),
+                results,
+            )
+
+    ## Metrics
+
+    def depth(self):
+        from app import db
+        from app.models import OutgoingMail
+
+        return (
+            db.session.query(func.count(OutgoingMail.id))
+            .filter(OutgoingMail.status.in_(["pending", "sending"]))
+            .scalar()
+        )
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "workers": len(self._threads),
+            }
+        if latencies:
+            stats["latency_p50"] = latencies[len(latencies) // 2]
+            stats["latency_p95"] = latencies[int(len(latencies) * 0.95)]
+            stats["latency_max"] = latencies[-1]
+        return stats
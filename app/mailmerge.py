@@ -0,0 +1,221 @@
+## Imports
+
+# standard library
+import smtplib
+from time import time
+from datetime import datetime, timedelta
+from collections import defaultdict
+
+# flask
+from flask import current_app
+from flask_mail import Message
+from jinja2 import Markup
+
+# sqlalchemy
+from sqlalchemy.orm import joinedload
+
+# relative
+from app import db, mail
+from app.models import User, Event, participants
+from app.mail_queue import connection_lost
+
+
+## Streaming
+
+
+# users in primary key order, chunk_size at a time (keyset, so every chunk
+# costs the same); optionally restricted by extra criteria
+def user_chunks(chunk_size, *criteria):
+    last_id = 0
+    while True:
+        chunk = (
+            User.query.filter(User.id > last_id, *criteria)
+            .order_by(User.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+# the events joined by each of the users between start and end, in one query
+def joined_events(user_ids, start, end):
+    rows = (
+        db.session.query(participants.c.participant_id, Event)
+        .join(Event, Event.id == participants.c.event_id)
+        .options(joinedload(Event.location), joinedload(Event.creator))
+        .filter(participants.c.participant_id.in_(user_ids))
+        .filter(Event.datetime >= start, Event.datetime < end)
+        .order_by(Event.datetime)
+        .all()
+    )
+    events = defaultdict(list)
+    for user_id, event in rows:
+        events[user_id].append(event)
+    return events
+
+
+## Jobs
+
+
+class MergeReport(object):
+    def __init__(self):
+        self.started = time()
+        self.users = 0
+        self.messages = 0
+        self.chunks = 0
+        # addresses that did not get their message
+        self.failed = []
+
+    @property
+    def elapsed(self):
+        return time() - self.started
+
+    def __str__(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return (
+            "{} message(s) for {} user(s) in {} chunk(s), {} failed, {:.2f}s: "
+            "{:.1f} messages/s, {:.1f} users/s".format(
+                self.messages,
+                self.users,
+                self.chunks,
+                len(self.failed),
+                elapsed,
+                self.messages / elapsed,
+                self.users / elapsed,
+            )
+        )
+
+
+class MailMerge(object):
+    """Renders one message per user from precompiled templates and sends them
+    over a single smtp connection, or only counts them on a dry run. A
+    message the server refuses is counted in `report.failed` and the merge
+    goes on; after a lost connection it connects again and retries the
+    message once."""
+
+    def __init__(self, subject, template, chunk_size=500, dry_run=False):
+        env = current_app.jinja_env
+        self.subject = subject
+        self.text_template = env.get_template(template + ".txt")
+        self.html_template = env.get_template(template + ".html")
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.sender = current_app.config["ADMINS"][0]
+        self.report = MergeReport()
+        self._connection = None
+
+    def message(self, user, **context):
+        message = Message(self.subject, sender=self.sender, recipients=[user.email])
+        message.body = self.text_template.render(user=user, **context)
+        message.html = self.html_template.render(user=user, **context)
+        return message
+
+    def run(self, chunks, contexts):
+        # chunks yields lists of users, contexts maps such a list to
+        # (user, template context) pairs of the users that get a message
+        try:
+            for users in chunks:
+                self.report.chunks += 1
+                self.report.users += len(users)
+                for user, context in contexts(users):
+                    message = self.message(user, **context)
+                    if self.dry_run or self._send(message):
+                        self.report.messages += 1
+                    else:
+                        self.report.failed.append(user.email)
+                # the chunk is done, let its objects go
+                db.session.expunge_all()
+        finally:
+            self._disconnect()
+        return self.report
+
+    # whether the message was sent
+    def _send(self, message):
+        for attempt in (1, 2):
+            try:
+                if self._connection is None:
+                    self._connection = mail.connect().__enter__()
+                self._connection.send(message)
+                return True
+            except (smtplib.SMTPException, OSError) as error:
+                failure = error
+                if self._connection is not None and not connection_lost(error):
+                    # refused, the connection is still fine for the next one
+                    break
+                self._disconnect()
+        current_app.logger.warning(
+            "Mail merge could not send to %s: %s", ", ".join(message.recipients), failure
+        )
+        return False
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+def send_event_reminders(hours=24, chunk_size=500, dry_run=False, now=None):
+    start = now or datetime.now()
+    end = start + timedelta(hours=hours)
+    merge = MailMerge(
+        "[Spikeball Gent] reminder: your upcoming sessions",
+        "email/event_reminder",
+        chunk_size=chunk_size,
+        dry_run=dry_run,
+    )
+    # only users that joined something in the window
+    joined = (
+        db.session.query(participants.c.participant_id)
+        .join(Event, Event.id == participants.c.event_id)
+        .filter(Event.datetime >= start, Event.datetime < end)
+    )
+
+    def contexts(users):
+        events = joined_events([user.id for user in users], start, end)
+        for user in users:
+            if events[user.id]:
+                yield user, {"events": events[user.id]}
+
+    return merge.run(user_chunks(chunk_size, User.id.in_(joined)), contexts)
+
+
+def send_weekly_digest(days=7, chunk_size=500, dry_run=False, now=None):
+    start = now or datetime.now()
+    end = start + timedelta(days=days)
+    merge = MailMerge(
+        "[Spikeball Gent] sessions this week",
+        "email/weekly_digest",
+        chunk_size=chunk_size,
+        dry_run=dry_run,
+    )
+    upcoming = (
+        Event.query.options(joinedload(Event.location), joinedload(Event.creator))
+        .filter(Event.datetime >= start, Event.datetime < end)
+        .order_by(Event.datetime)
+        .all()
+    )
+    if not upcoming:
+        return merge.report
+    # the same for everyone, so rendered once
+    env = current_app.jinja_env
+    overview = env.get_template("email/_digest_overview.txt").render(events=upcoming)
+    overview_html = Markup(
+        env.get_template("email/_digest_overview.html").render(events=upcoming)
+    )
+
+    def contexts(users):
+        events = joined_events([user.id for user in users], start, end)
+        for user in users:
+            yield user, {
+                "joined": events[user.id],
+                "overview": overview,
+                "overview_html": overview_html,
+            }
+
+    return merge.run(user_chunks(chunk_size, User.email.isnot(None)), contexts)
@@ -0,0 +1,66 @@
+## Imports
+
+# standard library
+from hashlib import md5
+from functools import wraps
+
+# flask
+from flask import request, session, make_response, current_app
+from flask_login import current_user
+
+# sqlalchemy
+from sqlalchemy import func
+
+# relative
+from app import db
+from app.models import Event, Location, User, Series
+from app.main.feed import start_of_today
+
+
+# the newest change to anything an event page shows: one SELECT of indexed
+# max() lookups; extra columns add what a particular page shows on top
+def last_modified(*extra):
+    columns = [
+        Event.updated_at,
+        Series.updated_at,
+        Location.updated_at,
+        User.updated_at,
+    ] + list(extra)
+    row = db.session.query(
+        *[db.session.query(func.max(column)).as_scalar() for column in columns]
+    ).one()
+    stamps = [stamp for stamp in row if stamp is not None]
+    return max(stamps) if stamps else None
+
+
+# answer GETs with 304 Not Modified, before the view runs, when the client's
+# copy was rendered from the same data for the same viewer on the same day
+def conditional(*extra):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+            modified = last_modified(*extra)
+            etag = md5(
+                "{}|{}|{}".format(
+                    modified, current_user.get_id(), start_of_today().date()
+                ).encode("utf-8")
+            ).hexdigest()
+            # pending flash messages are only shown on a freshly rendered page
+            if "_flashes" not in session and request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if modified is not None:
+                    response.last_modified = modified
+                # per viewer, and always checked with the server first
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,388 @@
+## Imports
+
+# standard library
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# flask
+from flask import g, current_app
+from flask_login import current_user
+
+# sqlalchemy
+from sqlalchemy import func, or_, and_, select, union_all
+from sqlalchemy.orm import joinedload
+
+# relative
+from app import db
+from app.geo import covering_prefixes, haversine_km, GEOHASH_UPPER
+from app.models import Event, Location, Series, Occurrence, participants, series_skip
+
+
+# the buckets shown on the index page, each sorted for display; later and
+# past are first pages, continued from their cursors
+EventFeed = namedtuple(
+    "EventFeed", ["today", "this_week", "later", "past", "later_cursor", "past_cursor"]
+)
+
+
+# eager load everything `_event.html` touches, so rendering a list of events
+# costs a fixed number of queries instead of one per row; it shows
+# participant_count, not the participants
+def with_event_details(query):
+    return query.options(joinedload(Event.creator), joinedload(Event.location))
+
+
+# ids of the events the current user joined, for the join / leave buttons of
+# a listing: one query per request however many events are shown
+def joined_event_ids():
+    if "joined_event_ids" not in g:
+        g.joined_event_ids = set()
+        if current_user.is_authenticated:
+            g.joined_event_ids = {
+                event_id
+                for event_id, in db.session.query(participants.c.event_id).filter(
+                    participants.c.participant_id == current_user.id
+                )
+            }
+    return g.joined_event_ids
+
+
+def start_of_today():
+    return datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+## Keyset pagination
+
+
+CURSOR_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_cursor(event):
+    key = json.dumps([event.datetime.strftime(CURSOR_FORMAT), event.cursor_id])
+    return urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+# (datetime, id) of a cursor, ValueError when it was tampered with
+def decode_cursor(cursor):
+    try:
+        value, id = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.strptime(value, CURSOR_FORMAT), int(id)
+    except (TypeError, ValueError):
+        raise ValueError("invalid cursor")
+
+
+# one page of the query in (datetime, id) order, seeking past the cursor so
+# every page is an index range scan; returns the events and the next cursor
+def event_page(query, cursor=None, per_page=25, descending=False):
+    if cursor is not None:
+        after, id = decode_cursor(cursor)
+        # the plain bound on datetime gives the planner its range scan
+        if descending:
+            query = query.filter(
+                Event.datetime <= after,
+                or_(Event.datetime < after, and_(Event.datetime == after, Event.id < id)),
+            )
+        else:
+            query = query.filter(
+                Event.datetime >= after,
+                or_(Event.datetime > after, and_(Event.datetime == after, Event.id > id)),
+            )
+    if descending:
+        query = query.order_by(Event.datetime.desc(), Event.id.desc())
+    else:
+        query = query.order_by(Event.datetime, Event.id)
+    events = with_event_details(query).limit(per_page + 1).all()
+    if len(events) > per_page:
+        return events[:per_page], encode_cursor(events[per_page - 1])
+    return events, None
+
+
+## Recurring events
+
+
+# {(series id, occurrence)} of the dates that have an Event row or were
+# cancelled, in one query
+def taken_occurrences(ids, start, end=None):
+    rows = db.session.query(Event.series_id, Event.occurrence).filter(
+        Event.series_id.in_(ids), Event.occurrence >= start
+    )
+    skipped = db.session.query(
+        series_skip.c.series_id, series_skip.c.occurrence
+    ).filter(series_skip.c.series_id.in_(ids), series_skip.c.occurrence >= start)
+    if end is not None:
+        rows = rows.filter(Event.occurrence < end)
+        skipped = skipped.filter(series_skip.c.occurrence < end)
+    return set(rows.union_all(skipped))
+
+
+# the series still running and their taken dates up to the horizon, in one
+# query per request however many sections a page lists: a series comes back
+# once per taken date, or once with None
+def running_series():
+    if "running_series" not in g:
+        since = start_of_today() - timedelta(days=1)
+        horizon = series_horizon()
+        running = or_(Series.until.is_(None), Series.until >= since)
+        # by series id first, so both go through their (series_id,
+        # occurrence) index instead of scanning every event
+        ids = select([Series.id]).where(running)
+        taken = union_all(
+            select([Event.series_id, Event.occurrence]).where(
+                and_(
+                    Event.series_id.in_(ids),
+                    Event.occurrence >= since,
+                    Event.occurrence < horizon,
+                )
+            ),
+            select([series_skip.c.series_id, series_skip.c.occurrence]).where(
+                and_(
+                    series_skip.c.series_id.in_(ids),
+                    series_skip.c.occurrence >= since,
+                    series_skip.c.occurrence < horizon,
+                )
+            ),
+        ).alias("taken")
+        rows = (
+            db.session.query(Series, taken.c.occurrence)
+            .outerjoin(taken, taken.c.series_id == Series.id)
+            .options(joinedload(Series.creator), joinedload(Series.location))
+            .filter(running)
+            .order_by(Series.id)
+        )
+        series, dates = [], set()
+        for s, occurrence in rows:
+            if not series or series[-1] is not s:
+                series.append(s)
+            if occurrence is not None:
+                dates.add((s.id, occurrence))
+        g.running_series = series, dates
+    return g.running_series
+
+
+# the series that can have occurrences in [start, end) and their taken dates
+# in it; windows of the past are rare and queried as they come
+def series_between(start, end):
+    if start < start_of_today() - timedelta(days=1):
+        series = (
+            Series.query.options(
+                joinedload(Series.creator), joinedload(Series.location)
+            )
+            .filter(
+                Series.start < end,
+                or_(Series.until.is_(None), Series.until >= start),
+            )
+            .all()
+        )
+        if not series:
+            return [], set()
+        return series, taken_occurrences([s.id for s in series], start, end)
+    running, taken = running_series()
+    series = [
+        s for s in running if s.start < end and (s.until is None or s.until >= start)
+    ]
+    return series, taken
+
+
+# the occurrences without an Event row of every series in [start, end), in
+# (datetime, cursor_id) order: arithmetic per series on what series_between
+# loaded
+def occurrences_between(start, end, user=None):
+    series, taken = series_between(start, end)
+    if user is not None:
+        series = [s for s in series if s.user_id == user.id]
+    if not series:
+        return []
+    occurrences = [
+        Occurrence(s, when)
+        for s in series
+        for when in s.occurrences(start, end)
+        if (s.id, when) not in taken
+    ]
+    occurrences.sort(key=lambda occurrence: (occurrence.datetime, occurrence.cursor_id))
+    return occurrences
+
+
+# occurrences are shown this far ahead, an open ended series would fill
+# every page after the last event otherwise
+def series_horizon(today=None):
+    days = current_app.config["SERIES_HORIZON_DAYS"]
+    return (today or start_of_today()) + timedelta(days=days)
+
+
+# an ascending page of event_page merged with the occurrences in the same
+# stretch of time: from the cursor (or start) up to the last event on the
+# page, or the horizon when that was the last page of events
+def with_occurrences(page, start, cursor, per_page, today=None, user=None):
+    events, next_cursor = page
+    after = None
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        start = after[0]
+    end = series_horizon(today)
+    if next_cursor is not None:
+        end = min(end, events[-1].datetime + timedelta(microseconds=1))
+    occurrences = [
+        occurrence
+        for occurrence in occurrences_between(start, end, user)
+        if after is None or (occurrence.datetime, occurrence.cursor_id) > after
+    ]
+    if not occurrences:
+        return page
+    merged = sorted(events + occurrences, key=lambda e: (e.datetime, e.cursor_id))
+    if len(merged) > per_page:
+        return merged[:per_page], encode_cursor(merged[per_page - 1])
+    return merged, next_cursor
+
+
+## Index page sections
+
+
+def later_events(today=None, cursor=None, per_page=25):
+    next_week = (today or start_of_today()) + timedelta(days=7)
+    page = event_page(Event.query.filter(Event.datetime >= next_week), cursor, per_page)
+    return with_occurrences(page, next_week, cursor, per_page, today)
+
+
+def past_events(today=None, cursor=None, per_page=25):
+    today = today or start_of_today()
+    return event_page(
+        Event.query.filter(Event.datetime < today), cursor, per_page, descending=True
+    )
+
+
+def user_events(user, since, cursor=None, per_page=25):
+    page = event_page(
+        Event.query.filter(Event.user_id == user.id, Event.datetime >= since),
+        cursor,
+        per_page,
+    )
+    return with_occurrences(page, since, cursor, per_page, user=user)
+
+
+# the coming week in full, the first pages of later and past events
+def event_feed(today=None, per_page=25, past_limit=5):
+    if today is None:
+        today = start_of_today()
+    tomorrow = today + timedelta(days=1)
+    next_week = today + timedelta(days=7)
+
+    week = (
+        with_event_details(Event.query)
+        .filter(Event.datetime >= today, Event.datetime < next_week)
+        .order_by(Event.datetime, Event.id)
+        .all()
+    )
+    occurrences = occurrences_between(today, next_week)
+    if occurrences:
+        week = sorted(week + occurrences, key=lambda e: (e.datetime, e.cursor_id))
+    later, later_cursor = later_events(today, per_page=per_page)
+    past, past_cursor = past_events(today, per_page=past_limit)
+    return EventFeed(
+        today=[event for event in week if event.datetime < tomorrow],
+        this_week=[event for event in week if event.datetime >= tomorrow],
+        later=later,
+        past=past,
+        later_cursor=later_cursor,
+        past_cursor=past_cursor,
+    )
+
+
+# upcoming events within radius_km of a point, nearest first: an index range
+# scan over the geohash cells covering the circle, refined by exact distance
+def events_near(latitude, longitude, radius_km, start=None, end=None):
+    if start is None:
+        start = datetime.now()
+    query = (
+        with_event_details(Event.query)
+        .join(Event.location)
+        .filter(Location.geohash.isnot(None))
+        .filter(Event.datetime >= start)
+    )
+    if end is not None:
+        query = query.filter(Event.datetime < end)
+    prefixes = covering_prefixes(latitude, longitude, radius_km)
+    if prefixes is not None:
+        query = query.filter(
+            or_(
+                *[
+                    and_(Location.geohash >= p, Location.geohash < p + GEOHASH_UPPER)
+                    for p in prefixes
+                ]
+            )
+        )
+    nearby = []
+    for event in query:
+        distance = haversine_km(
+            latitude, longitude, event.location.latitude, event.location.longitude
+        )
+        if distance <= radius_km:
+            nearby.append((distance, event))
+    nearby.sort(key=lambda pair: (pair[0], pair[1].datetime))
+    return nearby
+
+
+# events between start and end grouped per geohash cell of the given
+# precision, aggregated in the database: one row per map marker
+def event_clusters(start, end, precision):
+    cell = func.substr(Location.geohash, 1, precision)
+    return (
+        db.session.query(
+            cell,
+            func.count(Event.id),
+            func.avg(Location.latitude),
+            func.avg(Location.longitude),
+            func.min(Event.id),
+            func.min(Location.name),
+        )
+        .join(Event.location)
+        .filter(Location.geohash.isnot(None))
+        .filter(Event.datetime >= start)
+        .filter(Event.datetime < end)
+        .group_by(cell)
+        .all()
+    )
+
+
+## Calendar feeds, see app/ical.py
+
+
+# the events of a feed since a date, read in chunks so a long feed is
+# streamed without holding every row
+def calendar_events(scope, id, since, chunk_size=500):
+    query = with_event_details(Event.query).filter(Event.datetime >= since)
+    if scope == "user":
+        query = query.join(participants, participants.c.event_id == Event.id).filter(
+            participants.c.participant_id == id
+        )
+    elif scope == "location":
+        query = query.filter(Event.location_id == id)
+    return query.order_by(Event.datetime, Event.id).yield_per(chunk_size)
+
+
+# [(series, first date since, dates to leave out)] of a feed; members only
+# join the dates that got an event row, so a user's feed has none
+def calendar_series(scope, id, since):
+    if scope == "user":
+        return []
+    query = Series.query.options(
+        joinedload(Series.creator), joinedload(Series.location)
+    ).filter(or_(Series.until.is_(None), Series.until >= since))
+    if scope == "location":
+        query = query.filter(Series.location_id == id)
+    series = query.order_by(Series.id).all()
+    if not series:
+        return []
+    taken = taken_occurrences([s.id for s in series], since)
+    exdates = {}
+    for series_id, when in taken:
+        exdates.setdefault(series_id, []).append(when)
+    feed = []
+    for s in series:
+        # the rule starts in the feed's window like the events do, so the
+        # dates taken before it need no EXDATE
+        first = next(s.occurrences(since, datetime.max), None)
+        if first is not None:
+            feed.append((s, first, exdates.get(s.id, [])))
+    return feed
@@ -1,8 +1,22 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, TextAreaField, TextField, DecimalField
+from wtforms import (
+    StringField,
+    SubmitField,
+    TextAreaField,
+    TextField,
+    DecimalField,
+    IntegerField,
+    SelectField,
+)
 from wtforms.fields.html5 import DateField
 from wtforms_components import TimeField
-from wtforms.validators import DataRequired, ValidationError, Length
+from wtforms.validators import (
+    DataRequired,
+    ValidationError,
+    Length,
+    Optional,
+    NumberRange,
+)
 from app.models import User
 
 
@@ -27,8 +41,22 @@ class CreateEventForm(FlaskForm):
     date = DateField("When?", validators=[DataRequired()])
     time = TimeField("What time?", validators=[DataRequired()])
     info = TextAreaField("Extra info")
+    capacity = IntegerField(
+        "Max. players", validators=[Optional(), NumberRange(min=2, max=100)]
+    )
+    repeat = SelectField(
+        "Repeat",
+        choices=[(0, "Once"), (7, "Every week"), (14, "Every two weeks")],
+        coerce=int,
+        default=0,
+    )
+    until = DateField("Repeat until", validators=[Optional()])
     submit = SubmitField("Submit")
 
+    def validate_until(self, until):
+        if until.data is not None and self.date.data and until.data < self.date.data:
+            raise ValidationError("Please pick a date after the first one.")
+
 
 class AddCoordinatesForm(FlaskForm):
     latitude = DecimalField("Latitude")
@@ -1,17 +1,67 @@
 from datetime import datetime, timedelta
-from flask import render_template, flash, redirect, url_for, request, current_app
+from flask import (
+    render_template,
+    flash,
+    redirect,
+    url_for,
+    request,
+    current_app,
+    jsonify,
+    abort,
+    send_file,
+    stream_with_context,
+)
 from flask_login import current_user, login_required
-from app import db
+from app import (
+    db,
+    last_seen,
+    fragment_cache,
+    location_index,
+    search_index,
+    avatars,
+    live,
+    ical,
+)
+from app.avatars import AVATAR_SIZES, DIGEST, identicon_png
 from app.main.forms import EditProfileForm, CreateEventForm, AddCoordinatesForm
-from app.models import User, Event, Location
+from app.models import (
+    User,
+    Event,
+    EventFull,
+    Location,
+    Rating,
+    Series,
+    Occurrence,
+    participants,
+)
 from app.main import bp
+from app.main.feed import (
+    event_feed,
+    later_events,
+    past_events,
+    user_events,
+    with_event_details,
+    start_of_today,
+    events_near,
+    event_clusters,
+    joined_event_ids,
+    calendar_events,
+    calendar_series,
+)
+from app.main.conditional import conditional
+from app.geo import precision_for_zoom
+from app.ratings import leaderboard as ranking, player_rating, TEAM, PLAYER
+from app.stats import player_record
 
 
 @bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        last_seen.touch(current_user.id)
+
+
+bp.add_app_template_global(joined_event_ids)
+bp.add_app_template_global(ical.feed_url)
 
 
 @bp.route("/")
@@ -23,52 +73,117 @@ def home():
 
 @bp.route("/index", methods=["GET", "POST"])
 @login_required
+@conditional()
 def index():
-    today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
-    events_today = (
-        Event.query.filter(Event.datetime >= today)
-        .filter(Event.datetime < today + timedelta(days=1))
-        .order_by(Event.datetime)
-        .all()
-    )
-    events_this_week = (
-        Event.query.filter(Event.datetime >= today + timedelta(days=1))
-        .filter(Event.datetime < today + timedelta(days=7))
-        .order_by(Event.datetime)
-        .all()
-    )
-    events_later = (
-        Event.query.filter(Event.datetime >= today + timedelta(days=7))
-        .order_by(Event.datetime)
-        .all()
-    )
-    events_past = (
-        Event.query.filter(Event.datetime < today)
-        .order_by(Event.datetime.desc())
-        .limit(5)
-        .all()
-    )
+    feed = event_feed(per_page=current_app.config["POSTS_PER_PAGE"])
     return render_template(
         "index.html",
         title="Home Page",
-        events_today=events_today,
-        events_this_week=events_this_week,
-        events_later=events_later,
-        events_past=events_past,
+        events_today=feed.today,
+        events_this_week=feed.this_week,
+        events_later=feed.later,
+        events_past=feed.past,
+        later_cursor=feed.later_cursor,
+        past_cursor=feed.past_cursor,
+    )
+
+
+# the next page of an event list as rendered rows, for infinite scrolling
+@bp.route("/events/more")
+@login_required
+def more_events():
+    section = request.args.get("section")
+    cursor = request.args.get("cursor")
+    per_page = current_app.config["POSTS_PER_PAGE"]
+    template = "_event.html"
+    try:
+        if section == "later":
+            events, next_cursor = later_events(cursor=cursor, per_page=per_page)
+        elif section == "past":
+            events, next_cursor = past_events(cursor=cursor, per_page=per_page)
+            template = "_event_past.html"
+        elif section == "user":
+            user = User.query.filter_by(
+                username=request.args.get("username", "").lower()
+            ).first_or_404()
+            events, next_cursor = user_events(
+                user, upcoming_since(), cursor=cursor, per_page=per_page
+            )
+        else:
+            return jsonify(error="unknown section"), 400
+    except ValueError:
+        return jsonify(error="invalid cursor"), 400
+    return jsonify(
+        events=[render_template(template, event=event) for event in events],
+        next=next_cursor,
     )
 
 
 @bp.route("/user/<username>")
 @login_required
+# shows last_seen, which changes without updated_at
+@conditional(Rating.updated_at, User.last_seen)
 def user(username):
     user = User.query.filter_by(username=username.lower()).first_or_404()
-    events = (
-        Event.query.filter_by(user_id=user.id)
-        .filter(Event.datetime >= datetime.today() - timedelta(days=1))
-        .order_by(Event.datetime)
-        .all()
+    events, cursor = user_events(
+        user, upcoming_since(), per_page=current_app.config["POSTS_PER_PAGE"]
+    )
+    rating = player_rating(user)
+    record = player_record(user.id)
+    return render_template(
+        "user.html",
+        user=user,
+        events=events,
+        cursor=cursor,
+        rating=rating,
+        record=record,
+    )
+
+
+def upcoming_since():
+    return datetime.today() - timedelta(days=1)
+
+
+# the url changes with the email, so the image can be cached forever
+@bp.route("/avatar/<digest>/<int:size>.png")
+def avatar(digest, size):
+    if not DIGEST.match(digest) or size not in AVATAR_SIZES:
+        abort(404)
+    etag = avatars.etag(digest, size)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    elif avatars.known(digest):
+        response = send_file(
+            avatars.path(digest, size), mimetype="image/png", add_etags=False
+        )
+    else:
+        # nobody's email, not worth a file
+        response = current_app.response_class(
+            identicon_png(digest, size), mimetype="image/png"
+        )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+def user_event_ids(user):
+    created = db.session.query(Event.id).filter(Event.user_id == user.id)
+    joined = db.session.query(participants.c.event_id).filter(
+        participants.c.participant_id == user.id
+    )
+    return {event_id for event_id, in created.union(joined)}
+
+
+@bp.route("/leaderboard")
+@login_required
+def leaderboard():
+    limit = current_app.config["LEADERBOARD_SIZE"]
+    return render_template(
+        "leaderboard.html",
+        title="Leaderboard",
+        teams=ranking(TEAM, limit),
+        players=ranking(PLAYER, limit),
     )
-    return render_template("user.html", user=user, events=events)
 
 
 @bp.route("/edit_profile", methods=["GET", "POST"])
@@ -76,9 +191,23 @@ def user(username):
 def edit_profile():
     form = EditProfileForm(current_user.username)
     if form.validate_on_submit():
+        renamed = form.username.data.lower() != current_user.username
         current_user.username = form.username.data.lower()
         current_user.about_me = form.about_me.data
+        if renamed:
+            # the username is part of the cached fragments of these events,
+            # and of the occurrences of the user's series
+            event_ids = user_event_ids(current_user)
+            if event_ids:
+                Event.query.filter(Event.id.in_(event_ids)).update(
+                    {Event.updated_at: datetime.utcnow()}, synchronize_session=False
+                )
+            Series.query.filter(Series.user_id == current_user.id).update(
+                {Series.updated_at: datetime.utcnow()}, synchronize_session=False
+            )
         db.session.commit()
+        if renamed:
+            fragment_cache.bump(*event_ids)
         flash("Your changes have been saved")
         return redirect(url_for("main.edit_profile"))
     elif request.method == "GET":
@@ -91,88 +220,206 @@ def edit_profile():
 @login_required
 def create_event():
     form = CreateEventForm()
-    locations = Location.query.all()
     if form.validate_on_submit():
         date_time = datetime.combine(form.date.data, form.time.data)
-        location_id, new_location = None, None
-        for location in locations:
-            if form.location.data == location.name:
-                location_id = location.id
-        if not location_id:
-            new_location = Location(name=form.location.data)
-            db.session.add(new_location)
-            db.session.flush()
-            location_id = new_location.id
-        event = Event(
-            user_id=current_user.id,
-            location_id=location_id,
-            datetime=date_time,
-            info=form.info.data,
-        )
-        event.add_participant(current_user)
-        db.session.add(event)
-        db.session.commit()
-        flash(
-            "Your event is now added! {} at {}".format(
-                event.datetime.strftime("%A %d %B, %H:%M"), event.location.name
+        location, created = Location.get_or_create(form.location.data)
+        if form.repeat.data:
+            # no rows for the occurrences, they are listed from the series
+            until = form.until.data
+            if until is not None:
+                until = datetime.combine(until, form.time.data)
+            series = Series(
+                user_id=current_user.id,
+                location_id=location.id,
+                start=date_time,
+                interval_days=form.repeat.data,
+                until=until,
+                info=form.info.data,
+                capacity=form.capacity.data,
             )
-        )
-        if new_location:
-            return redirect(url_for("main.add_location", location_id=new_location.id))
+            db.session.add(series)
+            db.session.commit()
+            live.publish("created", series=series.id)
+            flash(
+                "Your event is now added! Every {} days from {} at {}".format(
+                    series.interval_days,
+                    series.start.strftime("%A %d %B, %H:%M"),
+                    location.name,
+                )
+            )
+        else:
+            event = Event(
+                user_id=current_user.id,
+                location_id=location.id,
+                datetime=date_time,
+                info=form.info.data,
+                capacity=form.capacity.data,
+            )
+            event.participants.append(current_user)
+            db.session.add(event)
+            db.session.commit()
+            fragment_cache.bump(event.id)
+            live.publish("created", event=event.id)
+            flash(
+                "Your event is now added! {} at {}".format(
+                    event.datetime.strftime("%A %d %B, %H:%M"), event.location.name
+                )
+            )
+        if created:
+            # inserted with a core statement, so the mapper events did not fire
+            location_index.invalidate()
+            return redirect(url_for("main.add_location", location_id=location.id))
         return redirect(url_for("main.index"))
+    return render_template("create_event.html", title="Create Event", form=form)
+
+
+@bp.route("/search")
+@login_required
+def search():
+    query = request.args.get("q", "")
+    page = request.args.get("page", 1, type=int)
+    hits, has_next = search_index.search(
+        query, page, current_app.config["SEARCH_PER_PAGE"]
+    )
     return render_template(
-        "create_event.html", title="Create Event", form=form, locations=locations
+        "search.html",
+        title="Search",
+        query=query,
+        page=page,
+        results=search_index.load(hits),
+        has_next=has_next,
+    )
+
+
+@bp.route("/locations/search")
+@login_required
+def search_locations():
+    limit = min(
+        request.args.get("limit", current_app.config["LOCATION_SEARCH_LIMIT"], int),
+        current_app.config["LOCATION_SEARCH_LIMIT"],
     )
+    names = location_index.search(request.args.get("q", ""), limit=limit)
+    return jsonify(locations=names)
+
+
+# the event behind an id from a url: its Event row, an Occurrence for a date
+# of a series that has no row yet, None when there is neither
+def find_event(event_id, query=None):
+    query = query or Event.query
+    if "-" not in event_id:
+        return query.filter_by(id=event_id).first()
+    occurrence = Occurrence.from_id(event_id)
+    if occurrence is None:
+        return None
+    event = query.filter_by(
+        series_id=occurrence.series.id, occurrence=occurrence.datetime
+    ).first()
+    return event or occurrence
 
 
 @bp.route("/join/<event_id>")
 @login_required
 def join_event(event_id):
-    event = Event.query.filter_by(id=event_id).first()
+    event = find_event(event_id)
     if event is None:
         flash("Event with id {} not found".format(event_id))
         return redirect(url_for("main.index"))
-    event.add_participant(current_user)
-    db.session.commit()
-    flash("You are now joining {}".format(event))
+    # pages list an occurrence by its date until it has a row; the user is
+    # expired by the commit and a materialized occurrence is expunged by a
+    # rollback, read what is shown before
+    listed_as, username, label = event.id, current_user.username, str(event)
+    try:
+        if isinstance(event, Occurrence):
+            event = event.series.materialize(event.datetime)
+        joined = event.join(current_user)
+        db.session.commit()
+    except EventFull:
+        db.session.rollback()
+        flash("Sorry, {} is full".format(label))
+        return redirect(url_for("main.index"))
+    if joined:
+        fragment_cache.bump(event.id)
+        delta = {"event": event.id, "user": username}
+        if listed_as != event.id:
+            delta["was"] = listed_as
+        live.publish("joined", **delta)
+    flash("You are now joining {}".format(label))
     return redirect(url_for("main.index"))
 
 
 @bp.route("/leave/<event_id>")
 @login_required
 def leave_event(event_id):
-    event = Event.query.filter_by(id=event_id).first()
+    event = find_event(event_id)
     if event is None:
         flash("Event with id {} not found".format(event_id))
         return redirect(url_for("main.index"))
-    event.remove_participant(current_user)
-    db.session.commit()
-    flash("You have left {}".format(event))
+    # nobody joined an occurrence without a row
+    username = current_user.username
+    if isinstance(event, Event) and event.leave(current_user):
+        db.session.commit()
+        fragment_cache.bump(event.id)
+        live.publish("left", event=event.id, user=username)
+        flash("You have left {}".format(event))
+    else:
+        flash("You were not joining {}".format(event))
     return redirect(url_for("main.index"))
 
 
 @bp.route("/delete/<event_id>")
 @login_required
 def delete_event(event_id):
-    event = Event.query.filter_by(id=event_id).first()
+    event = find_event(event_id)
     if event is None:
         flash("Event with id {} not found".format(event_id))
         return redirect(url_for("main.index"))
     if event.creator != current_user:
         flash("Only the creator of an event can delete it")
         return redirect(url_for("main.index"))
-    print(event.participants)
-    print(current_user)
-    if event.participants != [current_user] and event.participants != []:
+    if isinstance(event, Occurrence):
+        event.series.cancel(event.datetime)
+        db.session.commit()
+        live.publish("deleted", event=event.id)
+        flash("Event has been deleted")
+        return redirect(url_for("main.index"))
+    # or the series would list the date again
+    if event.series_id is not None:
+        event.series.cancel(event.occurrence)
+    others = db.session.query(
+        db.exists().where(
+            db.and_(
+                participants.c.event_id == event.id,
+                participants.c.participant_id != current_user.id,
+            )
+        )
+    ).scalar()
+    if others:
         flash(
             "Other people said they would join, please make sure they know the event is cancelled"
         )
+    deleted_id = event.id
     db.session.delete(event)
     db.session.commit()
+    fragment_cache.bump(deleted_id)
+    live.publish("deleted", event=deleted_id)
     flash("Event has been deleted".format(event))
     return redirect(url_for("main.index"))
 
 
+@bp.route("/series/<int:series_id>/end")
+@login_required
+def end_series(series_id):
+    series = Series.query.get_or_404(series_id)
+    if series.creator != current_user:
+        flash("Only the creator of an event can end it")
+        return redirect(url_for("main.index"))
+    series.end(datetime.now())
+    db.session.commit()
+    live.publish("deleted", series=series_id)
+    flash("The series has ended, the dates people already joined are kept")
+    return redirect(url_for("main.index"))
+
+
 @bp.route("/add_location/<location_id>", methods=["GET", "POST"])
 @login_required
 def add_location(location_id):
@@ -189,20 +436,77 @@ def add_location(location_id):
 
 @bp.route("/event_detail/<event_id>")
 @login_required
+@conditional()
 def event_detail(event_id):
-    event = Event.query.filter_by(id=event_id).first()
+    event = find_event(event_id, with_event_details(Event.query))
     if event is None:
         flash("Event with id {} not found".format(event_id))
         return redirect(url_for("main.index"))
     return render_template("event_detail.html", event=event)
 
 
+# an iCalendar feed for calendar apps, which poll without a session: the
+# signed token says which events, and an unchanged feed is a 304 after the
+# validator query alone; otherwise it is streamed as the rows are read
+@bp.route("/calendar/<token>.ics")
+@conditional()
+def calendar(token):
+    feed = ical.read_feed_token(token)
+    if feed is None:
+        abort(404)
+    scope, id = feed
+    name = "Spikeball Gent"
+    if scope == "user":
+        name += " - " + User.query.get_or_404(id).username
+    elif scope == "location":
+        name += " - " + Location.query.get_or_404(id).name
+    since = start_of_today() - timedelta(days=current_app.config["ICAL_PAST_DAYS"])
+
+    def components():
+        for series, first, exdates in calendar_series(scope, id, since):
+            yield ical.series_component(series, first, exdates)
+        for event in calendar_events(scope, id, since):
+            yield ical.event_component(event)
+
+    response = current_app.response_class(
+        stream_with_context(ical.calendar(name, components())),
+        mimetype="text/calendar",
+    )
+    response.headers["Content-Disposition"] = 'inline; filename="spikeball.ics"'
+    return response
+
+
+# changes to events as server-sent events, see app/live.py; the stream does
+# not keep the request context, so it holds no database connection. The
+# browser sends the last id it saw when it reconnects, live.js passes the
+# one of the page as ?last= the first time
+@bp.route("/live")
+@login_required
+def live_updates():
+    subscriber = live.subscribe(
+        request.headers.get("Last-Event-ID") or request.args.get("last")
+    )
+    if subscriber is None:
+        return "", 503, {"Retry-After": "30"}
+    response = current_app.response_class(
+        live.stream(subscriber), mimetype="text/event-stream"
+    )
+    # also when the stream never starts
+    response.call_on_close(lambda: live.unsubscribe(subscriber))
+    response.headers["Cache-Control"] = "no-cache"
+    # nginx would buffer the stream otherwise
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @bp.route("/events_today/")
 @login_required
+@conditional()
 def events_today():
-    today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    today = start_of_today()
     events_today = (
-        Event.query.filter(Event.datetime >= today)
+        with_event_details(Event.query)
+        .filter(Event.datetime >= today)
         .filter(Event.datetime < today + timedelta(days=1))
         .all()
     )
@@ -210,3 +514,70 @@ def events_today():
         flash("No events today")
         return redirect(url_for("main.index"))
     return render_template("events_today.html", events_today=events_today)
+
+
+def geojson_point(longitude, latitude, properties):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+        "properties": properties,
+    }
+
+
+def geojson_response(features):
+    response = jsonify(type="FeatureCollection", features=features)
+    response.mimetype = "application/geo+json"
+    return response
+
+
+@bp.route("/events/near")
+@login_required
+def events_near_me():
+    latitude = request.args.get("lat", type=float)
+    longitude = request.args.get("lon", type=float)
+    if latitude is None or longitude is None:
+        return jsonify(error="lat and lon are required"), 400
+    radius = min(
+        request.args.get("radius", current_app.config["EVENTS_NEAR_RADIUS_KM"], float),
+        current_app.config["EVENTS_NEAR_MAX_RADIUS_KM"],
+    )
+    days = request.args.get("days", 7, int)
+    start = datetime.now()
+    features = [
+        geojson_point(
+            event.location.longitude,
+            event.location.latitude,
+            {
+                "event_id": event.id,
+                "location": event.location.name,
+                "datetime": event.datetime.isoformat(),
+                "distance_km": round(distance, 2),
+                "url": url_for("main.event_detail", event_id=event.id),
+            },
+        )
+        for distance, event in events_near(
+            latitude, longitude, radius, start, start + timedelta(days=days)
+        )
+    ]
+    return geojson_response(features)
+
+
+@bp.route("/events/map.geojson")
+@login_required
+def events_map():
+    try:
+        day = datetime.strptime(request.args["day"], "%Y-%m-%d")
+    except (KeyError, ValueError):
+        day = start_of_today()
+    zoom = min(max(request.args.get("zoom", 13, int), 0), 20)
+    features = []
+    for cell, count, latitude, longitude, event_id, name in event_clusters(
+        day, day + timedelta(days=1), precision_for_zoom(zoom)
+    ):
+        properties = {"count": count, "cell": cell}
+        if count == 1:
+            properties["event_id"] = event_id
+            properties["location"] = name
+            properties["url"] = url_for("main.event_detail", event_id=event_id)
+        features.append(geojson_point(longitude, latitude, properties))
+    return geojson_response(features)
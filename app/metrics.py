@@ -0,0 +1,370 @@
+## Imports
+
+# standard library
+import os
+import json
+import atexit
+from time import time, perf_counter
+from bisect import bisect_left
+from threading import Lock
+from uuid import uuid4
+
+# flask
+from flask import (
+    g,
+    request,
+    abort,
+    has_request_context,
+    before_render_template,
+    template_rendered,
+)
+
+# sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+PREFIX = "spikeball_"
+# seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+HISTOGRAMS = {
+    "request_duration_seconds": DURATION_BUCKETS,
+    "request_sql_seconds": DURATION_BUCKETS,
+    "request_template_seconds": DURATION_BUCKETS,
+    "request_queries": QUERY_BUCKETS,
+}
+HELP = {
+    "request_duration_seconds": "Time from the first before_request to the response.",
+    "request_sql_seconds": "Time spent executing SQL per request.",
+    "request_template_seconds": "Time spent rendering templates per request.",
+    "request_queries": "SQL statements executed per request.",
+    "requests_total": "Requests answered.",
+    "slow_requests_total": "Requests slower than METRICS_SLOW_REQUEST_MS.",
+    "slow_queries_total": "Statements slower than METRICS_SLOW_QUERY_MS.",
+}
+
+
+# one sample line, name{label="value",...} value
+def _sample(name, labels, value):
+    if isinstance(value, float):
+        value = repr(value)
+    if not labels:
+        return "{}{} {}".format(PREFIX, name, value)
+    pairs = []
+    for label, text in labels:
+        text = str(text).replace("\\", r"\\").replace('"', r"\"")
+        pairs.append('{}="{}"'.format(label, text.replace("\n", r"\n")))
+    return "{}{}{{{}}} {}".format(PREFIX, name, ",".join(pairs), value)
+
+
+class Metrics(object):
+    """Per request query count, SQL time, template time and latency.
+
+    SQL is timed with engine events and templates with Flask's render
+    signals. Every request gets a `Server-Timing` header and is added to
+    histograms per endpoint, served in the Prometheus text format on
+    `/metrics` together with the `stats()` of the other extensions.
+    Requests slower than `METRICS_SLOW_REQUEST_MS` and statements slower
+    than `METRICS_SLOW_QUERY_MS` are logged.
+
+    Each worker process counts on its own. With `METRICS_DIR` set they write
+    their counts there every `METRICS_DUMP_INTERVAL` seconds and `/metrics`
+    adds up all of them, so any worker can answer the scrape.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = Lock()
+        self._listening = False
+        self._dumped = 0
+        self._histograms = {name: {} for name in HISTOGRAMS}
+        self._counters = {
+            "requests_total": {},
+            "slow_requests_total": {(): 0},
+            "slow_queries_total": {(): 0},
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("METRICS_ENABLED", True)
+        app.config.setdefault("METRICS_SERVER_TIMING", True)
+        app.config.setdefault("METRICS_SLOW_REQUEST_MS", 500)
+        app.config.setdefault("METRICS_SLOW_QUERY_MS", 100)
+        app.config.setdefault("METRICS_ALLOWED_ADDRESSES", ("127.0.0.1", "::1"))
+        app.config.setdefault("METRICS_DIR", None)
+        app.config.setdefault("METRICS_DUMP_INTERVAL", 5)
+        app.extensions["metrics"] = self
+        self.app = app
+        if not app.config["METRICS_ENABLED"]:
+            return
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule("/metrics", "metrics", self.view)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        if not self._listening:
+            # every engine, the mail queue and commands included; only
+            # queries run in a request are added to its timings
+            event.listen(Engine, "before_cursor_execute", self._query_started)
+            event.listen(Engine, "after_cursor_execute", self._query_finished)
+            atexit.register(self.dump)
+            self._listening = True
+
+    ## Collecting
+
+    def _start(self):
+        g.metrics = {
+            "started": perf_counter(),
+            "queries": 0,
+            "sql": 0.0,
+            "template": 0.0,
+            "depth": 0,
+        }
+
+    def _query_started(self, conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("metrics_started", []).append(perf_counter())
+
+    def _query_finished(self, conn, cursor, statement, parameters, context, many):
+        elapsed = perf_counter() - conn.info["metrics_started"].pop()
+        if has_request_context() and "metrics" in g:
+            g.metrics["queries"] += 1
+            g.metrics["sql"] += elapsed
+        if elapsed * 1000 >= self.app.config["METRICS_SLOW_QUERY_MS"]:
+            with self._lock:
+                self._counters["slow_queries_total"][()] += 1
+            self.app.logger.warning(
+                "Slow query (%.0f ms): %s", elapsed * 1000, " ".join(statement.split())
+            )
+
+    # render_template can be called while another template renders, only
+    # the outermost is timed
+    def _template_started(self, sender, template, context, **extra):
+        if "metrics" in g:
+            if g.metrics["depth"] == 0:
+                g.metrics["template_started"] = perf_counter()
+            g.metrics["depth"] += 1
+
+    def _template_finished(self, sender, template, context, **extra):
+        if "metrics" in g and g.metrics["depth"]:
+            g.metrics["depth"] -= 1
+            if g.metrics["depth"] == 0:
+                g.metrics["template"] += perf_counter() - g.metrics["template_started"]
+
+    def _finish(self, response):
+        timings = g.pop("metrics", None)
+        if timings is None:
+            return response
+        total = perf_counter() - timings["started"]
+        endpoint = request.endpoint or "unmatched"
+        labels = (("endpoint", endpoint),)
+        with self._lock:
+            self._observe("request_duration_seconds", labels, total)
+            self._observe("request_sql_seconds", labels, timings["sql"])
+            self._observe("request_template_seconds", labels, timings["template"])
+            self._observe("request_queries", labels, timings["queries"])
+            key = labels + (
+                ("method", request.method),
+                ("status", response.status_code),
+            )
+            counter = self._counters["requests_total"]
+            counter[key] = counter.get(key, 0) + 1
+            slow = total * 1000 >= self.app.config["METRICS_SLOW_REQUEST_MS"]
+            if slow:
+                self._counters["slow_requests_total"][()] += 1
+
+        if slow:
+            self.app.logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, "
+                "templates %.0f ms",
+                request.method,
+                request.full_path.rstrip("?"),
+                endpoint,
+                total * 1000,
+                timings["queries"],
+                timings["sql"] * 1000,
+                timings["template"] * 1000,
+            )
+        if self.app.config["METRICS_SERVER_TIMING"]:
+            response.headers["Server-Timing"] = (
+                'db;dur={:.1f};desc="{} queries", tpl;dur={:.1f}, '
+                "total;dur={:.1f}".format(
+                    timings["sql"] * 1000,
+                    timings["queries"],
+                    timings["template"] * 1000,
+                    total * 1000,
+                )
+            )
+        if (
+            self.app.config["METRICS_DIR"]
+            and time() - self._dumped >= self.app.config["METRICS_DUMP_INTERVAL"]
+        ):
+            self.dump()
+        return response
+
+    # counts per bucket (not cumulative) with +Inf last, then the sum
+    def _observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name]
+        series = self._histograms[name].get(labels)
+        if series is None:
+            series = self._histograms[name][labels] = [0] * (len(buckets) + 2)
+        series[bisect_left(buckets, value)] += 1
+        series[-1] += value
+
+    ## Sharing between workers
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {
+                name: [[list(labels), list(series)] for labels, series in data.items()]
+                for name, data in self._histograms.items()
+            }
+            counters = {
+                name: [[list(labels), value] for labels, value in data.items()]
+                for name, data in self._counters.items()
+            }
+        stats = {}
+        for name, extension in sorted(self.app.extensions.items()):
+            if extension is not self and callable(getattr(extension, "stats", None)):
+                stats[name] = extension.stats()
+        return {"histograms": histograms, "counters": counters, "stats": stats}
+
+    def _path(self, pid):
+        return os.path.join(self.app.config["METRICS_DIR"], "{}.json".format(pid))
+
+    def dump(self):
+        if self.app is None or not self.app.config["METRICS_DIR"]:
+            return
+        self._dumped = time()
+        path = self._path(os.getpid())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = "{}.{}.tmp".format(path, uuid4().hex)
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+    # the snapshots of all workers, the counts of exited workers are folded
+    # into dead.json so the totals never go down
+    def collect(self):
+        directory = self.app.config["METRICS_DIR"]
+        if not directory:
+            return {os.getpid(): self.snapshot()}
+        # unix only, like sharing the directory between workers
+        import fcntl
+
+        self.dump()
+        snapshots = {}
+        with open(os.path.join(directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead_path = os.path.join(directory, "dead.json")
+            dead = None
+            if os.path.exists(dead_path):
+                with open(dead_path) as f:
+                    dead = json.load(f)
+            exited = []
+            for name in os.listdir(directory):
+                pid, extension = os.path.splitext(name)
+                if extension != ".json" or not pid.isdigit():
+                    continue
+                try:
+                    with open(os.path.join(directory, name)) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if _alive(int(pid)):
+                    snapshots[int(pid)] = snapshot
+                else:
+                    snapshot["stats"] = {}
+                    dead = snapshot if dead is None else _merge(dead, snapshot)
+                    exited.append(os.path.join(directory, name))
+            if exited:
+                temporary = "{}.{}.tmp".format(dead_path, uuid4().hex)
+                with open(temporary, "w") as f:
+                    json.dump(dead, f)
+                os.replace(temporary, dead_path)
+                for path in exited:
+                    os.remove(path)
+        if dead is not None:
+            snapshots["dead"] = dead
+        return snapshots
+
+    ## Exposition
+
+    def render(self):
+        snapshots = self.collect()
+        total = None
+        for snapshot in snapshots.values():
+            total = snapshot if total is None else _merge(total, snapshot)
+        lines = []
+
+        for name, buckets in HISTOGRAMS.items():
+            lines.append("# HELP {}{} {}".format(PREFIX, name, HELP[name]))
+            lines.append("# TYPE {}{} histogram".format(PREFIX, name))
+            for labels, series in sorted(total["histograms"][name]):
+                cumulative = 0
+                for le, count in zip(buckets + ("+Inf",), series[:-1]):
+                    cumulative += count
+                    lines.append(
+                        _sample(name + "_bucket", labels + [["le", le]], cumulative)
+                    )
+                lines.append(_sample(name + "_sum", labels, float(series[-1])))
+                lines.append(_sample(name + "_count", labels, cumulative))
+
+        for name, series in sorted(total["counters"].items()):
+            lines.append("# HELP {}{} {}".format(PREFIX, name, HELP[name]))
+            lines.append("# TYPE {}{} counter".format(PREFIX, name))
+            for labels, value in sorted(series):
+                lines.append(_sample(name, labels, value))
+
+        # what the extensions report about themselves, per live worker
+        gauges = {}
+        for pid, snapshot in snapshots.items():
+            for extension, stats in snapshot["stats"].items():
+                for stat, value in stats.items():
+                    if isinstance(value, (int, float)):
+                        name = "{}_{}".format(extension, stat)
+                        gauges.setdefault(name, []).append((pid, value))
+        for name, values in sorted(gauges.items()):
+            lines.append("# TYPE {}{} gauge".format(PREFIX, name))
+            for pid, value in sorted(values):
+                lines.append(_sample(name, [["pid", pid]], value))
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        if request.remote_addr not in self.app.config["METRICS_ALLOWED_ADDRESSES"]:
+            abort(404)
+        return (
+            self.render(),
+            200,
+            {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# the sum of two snapshots; the stats of the first are kept
+def _merge(first, second):
+    merged = {"histograms": {}, "counters": {}, "stats": first["stats"]}
+    for kind in ("histograms", "counters"):
+        for name in set(first[kind]) | set(second[kind]):
+            series = {}
+            for labels, value in first[kind].get(name, []) + second[kind].get(name, []):
+                key = json.dumps(labels)
+                if key not in series:
+                    series[key] = value
+                elif kind == "histograms":
+                    series[key] = [a + b for a, b in zip(series[key], value)]
+                else:
+                    series[key] = series[key] + value
+            merged[kind][name] = [[json.loads(key), value] for key, value in series.items()]
+    return merged
@@ -3,28 +3,76 @@
 # standard library
 from time import time
 from hashlib import md5
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # flask
 import jwt  # jason web token
-from flask import current_app
+from flask import current_app, url_for
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 
 # relative
-from . import db, login
+from . import db, login, passwords, user_cache, search_index
+from .geo import geohash_encode
+from .avatars import avatar_size
+
+## Helpers
+
+# INSERT that silently skips rows violating a unique constraint
+def insert_ignore(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+
+        return insert(table).on_conflict_do_nothing()
+    if dialect == "mysql":
+        return table.insert().prefix_with("IGNORE")
+    return table.insert().prefix_with("OR IGNORE")
+
+
+class EventFull(Exception):
+    pass
+
 
 ## load logged in user
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return user_cache.load(int(id))
 
 
 ## Many-to-many connection tables
+# joining twice is refused by the unique index, see Event.join
 participants = db.Table(
     "participants",
     db.Column("participant_id", db.Integer, db.ForeignKey("user.id")),
     db.Column("event_id", db.Integer, db.ForeignKey("event.id")),
+    db.Index(
+        "uq_participants_event_id_participant_id",
+        "event_id",
+        "participant_id",
+        unique=True,
+    ),
+    db.Index("ix_participants_participant_id", "participant_id"),
+)
+
+# the words of every searchable text, for databases without FTS5; doc is
+# the key of the document, see app/search.py
+search_term = db.Table(
+    "search_term",
+    db.Column("doc", db.Integer, nullable=False),
+    db.Column("term", db.String(64), nullable=False),
+    db.Column("weight", db.Integer, nullable=False),
+    db.Index("ix_search_term_term_doc", "term", "doc"),
+    db.Index("ix_search_term_doc", "doc"),
+)
+
+# occurrences of a series that were cancelled, see Series.cancel
+series_skip = db.Table(
+    "series_skip",
+    db.Column("series_id", db.Integer, db.ForeignKey("series.id"), nullable=False),
+    db.Column("occurrence", db.DateTime, nullable=False),
+    db.Index(
+        "uq_series_skip_series_id_occurrence", "series_id", "occurrence", unique=True
+    ),
 )
 
 # connection between teams and players
@@ -32,6 +80,7 @@ team_player = db.Table(
     "team_player",
     db.Column("team_id", db.Integer, db.ForeignKey("team.id")),
     db.Column("player_id", db.Integer, db.ForeignKey("user.id")),
+    db.Index("ix_team_player_player_id", "player_id"),
 )
 
 # connection between matches and teams
@@ -50,7 +99,13 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(120), index=True, unique=True)
     password_hash = db.Column(db.String(128))
     about_me = db.Column(db.String(140))
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # written behind (app/last_seen.py) without bumping updated_at; the user
+    # page adds it to its validator
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # bumped on every change, feeds the page validators in app/main/conditional.py
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     # events created by user:
     events_created = db.relationship("Event", backref="creator", lazy="dynamic")
@@ -62,24 +117,32 @@ class User(db.Model, UserMixin):
         super(User, self).__init__(
             username=username.lower(),
             email=email.lower(),
-            password_hash=generate_password_hash(password),
+            password_hash=passwords.hash(password),
             about_me=about_me,
         )
 
     def __repr__(self):
         return "<User: {}>".format(self.username)
 
+    # both run in the password hasher's process pool and raise HasherBusy
+    # when it is saturated
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
+
+    # memoized per instance, recomputed when the email changes
+    @property
+    def email_digest(self):
+        cached = getattr(self, "_email_digest", None)
+        if cached is None or cached[0] != self.email:
+            cached = (self.email, md5(self.email.lower().encode("utf-8")).hexdigest())
+            self._email_digest = cached
+        return cached[1]
 
     def avatar(self, size):
-        digest = md5(self.email.lower().encode("utf-8")).hexdigest()
-        return "https://www.gravatar.com/avatar/{}?d=identicon&s={}".format(
-            digest, size
-        )
+        return url_for("main.avatar", digest=self.email_digest, size=avatar_size(size))
 
     def get_reset_password_token(self, expires_in=600):
         return jwt.encode(
@@ -132,18 +195,25 @@ class Match(db.Model):
     date = db.Column(db.DateTime)
     score1 = db.Column(db.Integer)
     score2 = db.Column(db.Integer)
+    team1_id = db.Column(
+        db.Integer, db.ForeignKey("team.id", name="fk_match_team1_id_team")
+    )
+    team2_id = db.Column(
+        db.Integer, db.ForeignKey("team.id", name="fk_match_team2_id_team")
+    )
 
-    # teams playing this match:
-    # NOTE: this should be limited to two; this can be achieved in a custom __init__ function
-    teams = db.relationship("Team", secondary=match_team, back_populates="matches")
+    # score1 belongs to team1, score2 to team2
+    team1 = db.relationship("Team", foreign_keys=[team1_id])
+    team2 = db.relationship("Team", foreign_keys=[team2_id])
 
-    @property
-    def team1(self):
-        return self.teams[0]
+    # teams playing this match, kept next to team1 / team2 for Team.matches
+    teams = db.relationship("Team", secondary=match_team, back_populates="matches")
 
-    @property
-    def team2(self):
-        return self.teams[1]
+    # both orders, so every team lookup and every pairing has a leading column
+    __table_args__ = (
+        db.Index("ix_match_team1_team2", "team1_id", "team2_id"),
+        db.Index("ix_match_team2_team1", "team2_id", "team1_id"),
+    )
 
     def __init__(self, team1=None, team2=None, score1=None, score2=None, date=None):
         if team1 is None and team2 is None:
@@ -157,12 +227,39 @@ class Match(db.Model):
         if score1 is None or score2 is None:
             raise ValueError("No valid score supplied for the match")
         super(Match, self).__init__(
-            teams=[team1, team2], date=date, score1=int(score1), score2=int(score2)
+            team1=team1,
+            team2=team2,
+            teams=[team1, team2],
+            date=date,
+            score1=int(score1),
+            score2=int(score2),
         )
 
     def __repr__(self):
-        t1, t2 = self.teams
-        return f"<Match {t1.teamname} v {t2.teamname}>"
+        return f"<Match {self.team1.teamname} v {self.team2.teamname}>"
+
+
+# materialized leaderboard: current rating of every team and player, kept up
+# to date by app.ratings when matches are added
+class Rating(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # "team" or "player"
+    kind = db.Column(db.String(10), nullable=False)
+    # team.id or user.id, depending on kind
+    subject_id = db.Column(db.Integer, nullable=False)
+    rating = db.Column(db.Float, nullable=False)
+    matches = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    losses = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("kind", "subject_id", name="uq_rating_kind_subject"),
+        db.Index("ix_rating_kind_rating", "kind", "rating"),
+    )
+
+    def __repr__(self):
+        return "<Rating {} {}: {:.0f}>".format(self.kind, self.subject_id, self.rating)
 
 
 # event table
@@ -170,13 +267,37 @@ class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     location_id = db.Column(db.Integer, db.ForeignKey("location.id"))
-    datetime = db.Column(db.DateTime, index=True)
+    # bumped on every change, feeds the page validators in app/main/conditional.py;
+    # declared first, the column below shadows the datetime module
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+    datetime = db.Column(db.DateTime)
     info = db.Column(db.String(500))
+    # kept equal to the rows in participants by join/leave, so listings show
+    # it without loading anybody
+    participant_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    # at most this many participants, no limit when empty
+    capacity = db.Column(db.Integer)
+    # set when the event is an occurrence of a Series that was joined or
+    # overridden: the date it had in the series, datetime may have moved
+    series_id = db.Column(db.Integer, db.ForeignKey("series.id"))
+    occurrence = db.Column(db.DateTime)
+
+    # listings seek on (datetime, id), see app.main.feed.event_page
+    __table_args__ = (
+        db.Index("ix_event_datetime_id", "datetime", "id"),
+        db.Index("ix_event_user_id_datetime_id", "user_id", "datetime", "id"),
+        db.Index(
+            "uq_event_series_id_occurrence", "series_id", "occurrence", unique=True
+        ),
+    )
 
     participants = db.relationship(
         "User",
         secondary=participants,
-        lazy="subquery",
         backref=db.backref("events_joined", lazy=True),
     )
 
@@ -185,19 +306,249 @@ class Event(db.Model):
             self.location.name, self.datetime.strftime("%A %d %B %Y, %H:%M")
         )
 
-    def add_participant(self, user):
-        self.participants.append(user)
+    @property
+    def is_full(self):
+        return self.capacity is not None and self.participant_count >= self.capacity
+
+    # the tie breaker of the (datetime, id) order, see Occurrence.cursor_id
+    @property
+    def cursor_id(self):
+        return self.id
+
+    # joining and leaving are single guarded statements in the current
+    # transaction instead of editing the participants list, so double clicks
+    # and concurrent joins cannot add duplicates or overfill the event
+
+    # True when the user joined, False when they already had; EventFull
+    def join(self, user):
+        result = db.session.execute(
+            insert_ignore(participants).values(event_id=self.id, participant_id=user.id)
+        )
+        if result.rowcount == 0:
+            return False
+        table = Event.__table__
+        result = db.session.execute(
+            table.update()
+            .where(table.c.id == self.id)
+            .where(
+                db.or_(
+                    table.c.capacity.is_(None),
+                    table.c.participant_count < table.c.capacity,
+                )
+            )
+            .values(
+                participant_count=table.c.participant_count + 1,
+                updated_at=datetime.utcnow(),
+            )
+        )
+        if result.rowcount == 0:
+            # nobody else can see the row inserted above yet
+            db.session.execute(participants.delete().where(self._is_row_of(user)))
+            raise EventFull(self)
+        db.session.expire(self, ["participant_count", "updated_at", "participants"])
+        return True
+
+    # True when the user left, False when they had not joined
+    def leave(self, user):
+        result = db.session.execute(
+            participants.delete().where(self._is_row_of(user))
+        )
+        if result.rowcount == 0:
+            return False
+        table = Event.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == self.id)
+            .values(
+                participant_count=table.c.participant_count - 1,
+                updated_at=datetime.utcnow(),
+            )
+        )
+        db.session.expire(self, ["participant_count", "updated_at", "participants"])
+        return True
+
+    def _is_row_of(self, user):
+        return db.and_(
+            participants.c.event_id == self.id,
+            participants.c.participant_id == user.id,
+        )
+
+
+# recurring events: "every interval_days from start", until the optional
+# last date; occurrences are computed per window and only stored as Event
+# rows once somebody joins one or it gets an override
+class Series(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    location_id = db.Column(db.Integer, db.ForeignKey("location.id"), nullable=False)
+    # the first occurrence, which also sets the weekday and time
+    start = db.Column(db.DateTime, nullable=False, index=True)
+    interval_days = db.Column(db.Integer, nullable=False, default=7)
+    # no occurrences after this, open ended when empty
+    until = db.Column(db.DateTime)
+    info = db.Column(db.String(500))
+    capacity = db.Column(db.Integer)
+    # also bumped when an occurrence is cancelled, feeds the page validators
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+
+    creator = db.relationship("User")
+    location = db.relationship("Location")
+    events = db.relationship("Event", backref="series", lazy=True)
+
+    def __repr__(self):
+        return "<Series {}: every {} days from {}>".format(
+            self.id, self.interval_days, self.start
+        )
+
+    # the occurrences in [start, end); the first one is computed instead of
+    # stepped to, so the cost depends on the window, not on the series' age
+    def occurrences(self, start, end):
+        step = timedelta(days=self.interval_days)
+        when = self.start
+        if start > when:
+            when += step * -((when - start) // step)
+        if self.until is not None:
+            end = min(end, self.until + timedelta(microseconds=1))
+        while when < end:
+            yield when
+            when += step
+
+    def is_occurrence(self, when):
+        first = next(self.occurrences(when, when + timedelta(microseconds=1)), None)
+        return first == when
+
+    # the Event row of an occurrence, inserted the first time it is needed;
+    # the unique index turns a concurrent insert of the same one into a no-op
+    def materialize(self, occurrence):
+        result = db.session.execute(
+            insert_ignore(Event.__table__).values(
+                series_id=self.id,
+                occurrence=occurrence,
+                datetime=occurrence,
+                user_id=self.user_id,
+                location_id=self.location_id,
+                info=self.info,
+                capacity=self.capacity,
+                participant_count=0,
+                updated_at=datetime.utcnow(),
+            )
+        )
+        event = Event.query.filter_by(series_id=self.id, occurrence=occurrence).one()
+        if result.rowcount == 1:
+            search_index.add(event)
+        return event
+
+    # one occurrence with other values (datetime, info, capacity, location_id)
+    def override(self, occurrence, **values):
+        event = self.materialize(occurrence)
+        for name, value in values.items():
+            setattr(event, name, value)
+        return event
+
+    # the occurrence is not shown anymore; an Event row of it is left to the
+    # caller to delete
+    def cancel(self, occurrence):
+        db.session.execute(
+            insert_ignore(series_skip).values(series_id=self.id, occurrence=occurrence)
+        )
+        self.updated_at = datetime.utcnow()
+
+    # no occurrences from when on; the ones that got an Event row stay, like
+    # other events they are deleted one by one
+    def end(self, when):
+        # a second before, the column may not keep microseconds
+        last = when - timedelta(seconds=1)
+        if self.until is None or self.until > last:
+            self.until = last
+
+
+STAMP_FORMAT = "%Y%m%d%H%M"
+
+
+class Occurrence(object):
+    """An occurrence of a Series without an Event row: enough of an event for
+    the listings and the detail page. Its id, "<series id>-<YYYYmmddHHMM>",
+    goes where event ids go in urls."""
+
+    participant_count = 0
+    participants = ()
+    is_full = False
+
+    def __init__(self, series, when):
+        self.series = series
+        self.datetime = when
+
+    def __repr__(self):
+        return "<Event: {} {}>".format(
+            self.location.name, self.datetime.strftime("%A %d %B %Y, %H:%M")
+        )
+
+    @property
+    def id(self):
+        return "{}-{}".format(self.series.id, self.datetime.strftime(STAMP_FORMAT))
+
+    # below every event id, so occurrences sort before events at the same time
+    @property
+    def cursor_id(self):
+        return -self.series.id
+
+    @property
+    def creator(self):
+        return self.series.creator
+
+    @property
+    def location(self):
+        return self.series.location
+
+    @property
+    def info(self):
+        return self.series.info
+
+    @property
+    def capacity(self):
+        return self.series.capacity
+
+    @property
+    def updated_at(self):
+        return self.series.updated_at
 
-    def remove_participant(self, user):
-        self.participants.remove(user)
+    # the occurrence behind an id from a url, None when it is not one
+    @staticmethod
+    def from_id(id):
+        series_id, _, stamp = id.partition("-")
+        try:
+            series_id, when = int(series_id), datetime.strptime(stamp, STAMP_FORMAT)
+        except ValueError:
+            return None
+        series = Series.query.get(series_id)
+        if series is None or not series.is_occurrence(when):
+            return None
+        cancelled = db.session.query(
+            db.exists().where(
+                db.and_(
+                    series_skip.c.series_id == series_id,
+                    series_skip.c.occurrence == when,
+                )
+            )
+        ).scalar()
+        return None if cancelled else Occurrence(series, when)
 
 
 # location table
 class Location(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(40), nullable=False)
+    # lowercased on write, so unique regardless of case
+    name = db.Column(db.String(40), nullable=False, unique=True, index=True)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    # derived from the coordinates, see update_geohash below
+    geohash = db.Column(db.String(12), index=True)
+    # bumped on every change, feeds the page validators in app/main/conditional.py
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     events = db.relationship("Event", backref="location", lazy=True)
 
@@ -208,3 +559,84 @@ class Location(db.Model):
 
     def __repr__(self):
         return "<Location: {}>".format(self.name)
+
+    @staticmethod
+    def get_or_create(name):
+        # returns (location, created); safe against a concurrent insert of the
+        # same name thanks to the unique index
+        name = name.strip().lower()
+        query = Location.query.filter(Location.name == name)
+        location = query.first()
+        if location is not None:
+            return location, False
+        result = db.session.execute(
+            insert_ignore(Location.__table__).values(name=name)
+        )
+        location = query.one()
+        if result.rowcount == 1:
+            search_index.add(location)
+        return location, result.rowcount == 1
+
+
+# outgoing mail spool, drained by app.mail_queue
+class OutgoingMail(db.Model):
+    __tablename__ = "outgoing_mail"
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255))
+    sender = db.Column(db.String(120))
+    # json encoded list of addresses
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+
+    # pending -> sending -> sent, or back to pending until it is failed
+    status = db.Column(db.String(10), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_outgoing_mail_status_next_attempt", status, next_attempt_at),
+    )
+
+    def __repr__(self):
+        return "<OutgoingMail {}: {} ({})>".format(self.id, self.subject, self.status)
+
+
+# keep the geohash in sync with the coordinates
+@db.event.listens_for(Location, "before_insert")
+@db.event.listens_for(Location, "before_update")
+def update_geohash(mapper, connection, location):
+    if location.latitude is None or location.longitude is None:
+        location.geohash = None
+    else:
+        location.geohash = geohash_encode(
+            float(location.latitude), float(location.longitude)
+        )
+
+
+# participants edited through the relationship (a new event, the shell) only
+# write the association table, and a deleted event leaves nothing behind to
+# compare; bump a timestamp for both and keep participant_count right
+@db.event.listens_for(db.session, "before_flush")
+def touch_updated_at(session, flush_context, instances):
+    now = datetime.utcnow()
+    for obj in session.new:
+        if isinstance(obj, Event):
+            obj.participant_count = len(obj.participants)
+    for obj in session.dirty:
+        participants = isinstance(obj, Event) and db.inspect(obj).attrs.participants
+        if participants and participants.history.has_changes():
+            history = participants.history
+            obj.participant_count = Event.participant_count + (
+                len(history.added) - len(history.deleted)
+            )
+            obj.updated_at = now
+    for obj in session.deleted:
+        if isinstance(obj, Event) and obj.location is not None:
+            obj.location.updated_at = now
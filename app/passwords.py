@@ -0,0 +1,176 @@
+## Imports
+
+# standard library
+import atexit
+from time import time
+from collections import deque
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+# werkzeug
+from werkzeug.security import (
+    generate_password_hash,
+    check_password_hash,
+    DEFAULT_PBKDF2_ITERATIONS,
+)
+
+# relative
+from app.per_process import PerProcess
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher(object):
+    """Runs password hashing in a small process pool.
+
+    PBKDF2 holds the GIL, so hashing inline stalls every other request of the
+    worker. At most `PASSWORD_HASH_MAX_PENDING` hashes are queued or running;
+    beyond that `HasherBusy` is raised immediately instead of waiting, as it
+    is for a hash not done within `PASSWORD_HASH_TIMEOUT` seconds, which
+    keeps its slot until it finishes. With `PASSWORD_HASH_WORKERS = 0` the
+    work is done inline.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pool = None
+        self._start_pool = PerProcess(self._new_pool)
+        self._slots = None
+        self._lock = Lock()
+        self.rejected = 0
+        self.timed_out = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+        app.config.setdefault("PASSWORD_HASH_WORKERS", 2)
+        app.config.setdefault("PASSWORD_HASH_MAX_PENDING", 8)
+        app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)
+        app.extensions["password_hasher"] = self
+        self.app = app
+        self._slots = BoundedSemaphore(app.config["PASSWORD_HASH_MAX_PENDING"])
+
+    @property
+    def method(self):
+        method = self.app.config["PASSWORD_HASH_METHOD"]
+        # spell out the iterations, so stored hashes can be compared to it
+        if method.startswith("pbkdf2:") and method.count(":") == 1:
+            method += ":{}".format(DEFAULT_PBKDF2_ITERATIONS)
+        return method
+
+    def _new_pool(self):
+        self._pool = ProcessPoolExecutor(self.app.config["PASSWORD_HASH_WORKERS"])
+        atexit.register(self._pool.shutdown, wait=False)
+
+    def _executor(self):
+        self._start_pool()
+        return self._pool
+
+    def _run(self, function, *args):
+        if self.app.config["PASSWORD_HASH_WORKERS"] < 1:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        try:
+            future = self._executor().submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # the slot is taken as long as the pool works on it, not as long as
+        # somebody waits for it
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(self.app.config["PASSWORD_HASH_TIMEOUT"])
+        except TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        # e.g. an account that never had a password
+        if password_hash is None:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    # whether the hash was made with another method or cost than configured
+    def needs_rehash(self, password_hash):
+        if password_hash is None:
+            return False
+        return password_hash.split("$", 1)[0] != self.method
+
+    def stats(self):
+        return {"rejected": self.rejected, "timed_out": self.timed_out}
+
+
+class AttemptLimiter(object):
+    """Counts failed logins per client address and per username in a sliding
+    window, so brute force is turned away before any password is hashed."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._failures = {}
+        self._lock = Lock()
+        self.blocked = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LOGIN_ATTEMPT_WINDOW", 300)
+        app.config.setdefault("LOGIN_MAX_FAILURES_PER_ADDRESS", 20)
+        app.config.setdefault("LOGIN_MAX_FAILURES_PER_USERNAME", 5)
+        app.config.setdefault("LOGIN_ATTEMPT_MAX_KEYS", 10000)
+        app.extensions["login_attempts"] = self
+        self.app = app
+
+    def _keys(self, address, username):
+        config = self.app.config
+        return [
+            (("address", address), config["LOGIN_MAX_FAILURES_PER_ADDRESS"]),
+            (("username", username), config["LOGIN_MAX_FAILURES_PER_USERNAME"]),
+        ]
+
+    def _recent(self, key, now):
+        failures = self._failures.get(key)
+        if failures is None:
+            return 0
+        start = now - self.app.config["LOGIN_ATTEMPT_WINDOW"]
+        while failures and failures[0] < start:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return 0
+        return len(failures)
+
+    def allowed(self, address, username):
+        now = time()
+        with self._lock:
+            for key, limit in self._keys(address, username):
+                if self._recent(key, now) >= limit:
+                    self.blocked += 1
+                    return False
+        return True
+
+    def failed(self, address, username):
+        now = time()
+        with self._lock:
+            if len(self._failures) >= self.app.config["LOGIN_ATTEMPT_MAX_KEYS"]:
+                for key in list(self._failures):
+                    self._recent(key, now)
+            for key, limit in self._keys(address, username):
+                self._failures.setdefault(key, deque(maxlen=limit)).append(now)
+
+    def succeeded(self, username):
+        with self._lock:
+            self._failures.pop(("username", username), None)
+
+    def stats(self):
+        with self._lock:
+            return {"blocked": self.blocked, "tracked": len(self._failures)}
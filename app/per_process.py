@@ -0,0 +1,31 @@
+## Imports
+
+# standard library
+import os
+from threading import Lock
+
+
+class PerProcess(object):
+    """Calls `start` once in every process that calls this.
+
+    Threads and process pools do not survive a fork: a worker forked from a
+    master that started them has the objects but nothing running behind
+    them, so each process starts its own the first time it needs them.
+    `reset` makes the next call start again, e.g. after a stop.
+    """
+
+    def __init__(self, start):
+        self._start = start
+        self._pid = None
+        self._lock = Lock()
+
+    def __call__(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+                self._pid = os.getpid()
+
+    def reset(self):
+        self._pid = None
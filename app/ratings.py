@@ -0,0 +1,328 @@
+## Imports
+
+# standard library
+from datetime import datetime
+from collections import defaultdict
+
+# flask
+from flask import current_app
+
+# sqlalchemy
+from sqlalchemy import event, and_, bindparam
+
+# relative
+from app import db
+from app.models import (
+    Match,
+    Rating,
+    Team,
+    User,
+    team_player,
+    insert_ignore,
+)
+
+
+TEAM = "team"
+PLAYER = "player"
+
+
+## Elo
+
+
+def expected(rating, opponent):
+    return 1.0 / (1.0 + 10 ** ((opponent - rating) / 400.0))
+
+
+def outcome(score1, score2):
+    if score1 > score2:
+        return 1.0
+    if score1 < score2:
+        return 0.0
+    return 0.5
+
+
+## Incremental updates
+
+
+def _players(connection, team_ids):
+    players = defaultdict(list)
+    rows = connection.execute(
+        db.select([team_player.c.team_id, team_player.c.player_id]).where(
+            team_player.c.team_id.in_(team_ids)
+        )
+    )
+    for team_id, player_id in rows:
+        players[team_id].append(player_id)
+    return players
+
+
+def _load(connection, kind, ids, initial):
+    table = Rating.__table__
+    connection.execute(
+        insert_ignore(table),
+        [
+            {
+                "kind": kind,
+                "subject_id": subject_id,
+                "rating": initial,
+                "matches": 0,
+                "wins": 0,
+                "losses": 0,
+            }
+            for subject_id in ids
+        ],
+    )
+    rows = connection.execute(
+        db.select([table]).where(
+            and_(table.c.kind == kind, table.c.subject_id.in_(ids))
+        )
+    )
+    return {row.subject_id: dict(row) for row in rows}
+
+
+def _record(state, delta, result):
+    state["rating"] += delta
+    state["matches"] += 1
+    if result == 1.0:
+        state["wins"] += 1
+    elif result == 0.0:
+        state["losses"] += 1
+
+
+def _store(connection, states):
+    table = Rating.__table__
+    now = datetime.utcnow()
+    connection.execute(
+        table.update()
+        .where(table.c.id == bindparam("_id"))
+        .values(
+            rating=bindparam("rating"),
+            matches=bindparam("matches"),
+            wins=bindparam("wins"),
+            losses=bindparam("losses"),
+            updated_at=now,
+        ),
+        [
+            {
+                "_id": state["id"],
+                "rating": state["rating"],
+                "matches": state["matches"],
+                "wins": state["wins"],
+                "losses": state["losses"],
+            }
+            for state in states
+        ],
+    )
+
+
+# apply (team1_id, team2_id, score1, score2) tuples, in order, to the stored
+# ratings; only the rows of the teams and players involved are touched
+def apply_matches(connection, matches):
+    if not matches:
+        return
+    k = current_app.config["RATING_K"]
+    initial = current_app.config["RATING_INITIAL"]
+    team_ids = {team_id for match in matches for team_id in match[:2]}
+    players = _players(connection, team_ids)
+    teams = _load(connection, TEAM, team_ids, initial)
+    player_ids = {p for team_id in team_ids for p in players[team_id]}
+    people = _load(connection, PLAYER, player_ids, initial) if player_ids else {}
+
+    for team1, team2, score1, score2 in matches:
+        result = outcome(score1, score2)
+        delta = k * (result - expected(teams[team1]["rating"], teams[team2]["rating"]))
+        _record(teams[team1], delta, result)
+        _record(teams[team2], -delta, 1.0 - result)
+
+        if players[team1] and players[team2]:
+            strength1 = sum(people[p]["rating"] for p in players[team1]) / len(
+                players[team1]
+            )
+            strength2 = sum(people[p]["rating"] for p in players[team2]) / len(
+                players[team2]
+            )
+            delta = k * (result - expected(strength1, strength2))
+            for p in players[team1]:
+                _record(people[p], delta, result)
+            for p in players[team2]:
+                _record(people[p], -delta, 1.0 - result)
+
+    _store(connection, list(teams.values()) + list(people.values()))
+
+
+@event.listens_for(db.session, "after_flush")
+def rate_new_matches(session, flush_context):
+    matches = sorted(
+        (obj for obj in session.new if isinstance(obj, Match)),
+        key=lambda match: (match.date or datetime.min, match.id),
+    )
+    if matches:
+        apply_matches(
+            session.connection(),
+            [
+                (match.team1_id, match.team2_id, match.score1, match.score2)
+                for match in matches
+            ],
+        )
+
+
+## Full recompute
+
+
+# split matches, in order, into runs in which no team or player occurs twice;
+# the matches of one run can then be rated simultaneously with the same
+# result as rating them one by one
+def _independent_runs(team1, team2, players):
+    runs, start = [], 0
+    teams_seen, players_seen = set(), set()
+    for i, (t1, t2) in enumerate(zip(team1, team2)):
+        involved = set(players[t1]) | set(players[t2])
+        if t1 in teams_seen or t2 in teams_seen or involved & players_seen:
+            runs.append((start, i))
+            start = i
+            teams_seen, players_seen = set(), set()
+        teams_seen.update((t1, t2))
+        players_seen.update(involved)
+    runs.append((start, len(team1)))
+    return runs
+
+
+# rebuild the whole leaderboard from the match history with numpy; used for
+# backfills and after changing the rating rules
+def recompute_all():
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("recomputing the ratings requires numpy")
+
+    k = current_app.config["RATING_K"]
+    initial = current_app.config["RATING_INITIAL"]
+    connection = db.session.connection()
+
+    history = connection.execute(
+        db.select([Match.team1_id, Match.team2_id, Match.score1, Match.score2])
+        .where(and_(Match.team1_id.isnot(None), Match.team2_id.isnot(None)))
+        .order_by(Match.date, Match.id)
+    ).fetchall()
+
+    team_ids = sorted({team_id for match in history for team_id in match[:2]})
+    team_index = {team_id: i for i, team_id in enumerate(team_ids)}
+    players = _players(connection, team_ids) if team_ids else {}
+    player_ids = sorted({p for team_id in team_ids for p in players[team_id]})
+    player_index = {player_id: i for i, player_id in enumerate(player_ids)}
+
+    n = len(history)
+    team1 = np.array([team_index[m[0]] for m in history], dtype=int)
+    team2 = np.array([team_index[m[1]] for m in history], dtype=int)
+    result = np.array([outcome(m[2], m[3]) for m in history], dtype=float)
+
+    # players per team as a padded matrix, -1 marks an empty slot
+    width = max([len(players[t]) for t in team_ids] + [1])
+    roster = np.full((len(team_ids), width), -1, dtype=int)
+    for team_id, i in team_index.items():
+        for j, player_id in enumerate(players[team_id]):
+            roster[i, j] = player_index[player_id]
+    roster_mask = roster >= 0
+    roster_size = np.maximum(roster_mask.sum(axis=1), 1)
+
+    team_rating = np.full(len(team_ids), initial, dtype=float)
+    player_rating = np.full(len(player_ids) + 1, initial, dtype=float)
+    # the extra slot absorbs updates aimed at empty roster positions
+    padded = np.where(roster_mask, roster, len(player_ids))
+
+    index_players = {team_index[t]: [player_index[p] for p in players[t]] for t in team_ids}
+    for start, end in _independent_runs(team1.tolist(), team2.tolist(), index_players):
+        t1, t2, s = team1[start:end], team2[start:end], result[start:end]
+
+        delta = k * (s - 1.0 / (1.0 + 10 ** ((team_rating[t2] - team_rating[t1]) / 400.0)))
+        team_rating[t1] += delta
+        team_rating[t2] -= delta
+
+        strength1 = (player_rating[padded[t1]] * roster_mask[t1]).sum(axis=1) / roster_size[t1]
+        strength2 = (player_rating[padded[t2]] * roster_mask[t2]).sum(axis=1) / roster_size[t2]
+        delta = k * (s - 1.0 / (1.0 + 10 ** ((strength2 - strength1) / 400.0)))
+        has_players = roster_mask[t1].any(axis=1) & roster_mask[t2].any(axis=1)
+        delta = np.where(has_players, delta, 0.0)
+        np.add.at(player_rating, padded[t1], delta[:, None] * roster_mask[t1])
+        np.add.at(player_rating, padded[t2], -delta[:, None] * roster_mask[t2])
+
+    def tally(size, index, weights=None):
+        return np.bincount(index, weights=weights, minlength=size)
+
+    both = np.concatenate([team1, team2])
+    team_matches = tally(len(team_ids), both)
+    team_wins = tally(len(team_ids), both, np.concatenate([result == 1.0, result == 0.0]))
+    team_losses = tally(len(team_ids), both, np.concatenate([result == 0.0, result == 1.0]))
+
+    # players are only rated, and counted, in matches where both teams have
+    # players, as in apply_matches; each gets the tallies of such matches of
+    # the teams they play in
+    rated = roster_mask[team1].any(axis=1) & roster_mask[team2].any(axis=1)
+    rated_twice = np.concatenate([rated, rated])
+    rated_matches = tally(len(team_ids), both, rated_twice)
+    rated_wins = tally(
+        len(team_ids),
+        both,
+        np.concatenate([result == 1.0, result == 0.0]) & rated_twice,
+    )
+    rated_losses = tally(
+        len(team_ids),
+        both,
+        np.concatenate([result == 0.0, result == 1.0]) & rated_twice,
+    )
+    player_matches = np.zeros(len(player_ids) + 1)
+    player_wins = np.zeros(len(player_ids) + 1)
+    player_losses = np.zeros(len(player_ids) + 1)
+    np.add.at(player_matches, padded, rated_matches[:, None] * roster_mask)
+    np.add.at(player_wins, padded, rated_wins[:, None] * roster_mask)
+    np.add.at(player_losses, padded, rated_losses[:, None] * roster_mask)
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "kind": TEAM,
+            "subject_id": team_id,
+            "rating": float(team_rating[i]),
+            "matches": int(team_matches[i]),
+            "wins": int(team_wins[i]),
+            "losses": int(team_losses[i]),
+            "updated_at": now,
+        }
+        for i, team_id in enumerate(team_ids)
+    ] + [
+        {
+            "kind": PLAYER,
+            "subject_id": player_id,
+            "rating": float(player_rating[i]),
+            "matches": int(player_matches[i]),
+            "wins": int(player_wins[i]),
+            "losses": int(player_losses[i]),
+            "updated_at": now,
+        }
+        for i, player_id in enumerate(player_ids)
+    ]
+    connection.execute(Rating.__table__.delete())
+    if rows:
+        connection.execute(Rating.__table__.insert(), rows)
+    db.session.commit()
+    return n, len(team_ids), len(player_ids)
+
+
+## Leaderboard
+
+
+# (rating, name) pairs, best first, straight from the materialized rows
+def leaderboard(kind, limit=50):
+    model, name = (Team, Team.teamname) if kind == TEAM else (User, User.username)
+    return (
+        db.session.query(Rating, name)
+        .join(model, model.id == Rating.subject_id)
+        .filter(Rating.kind == kind)
+        .order_by(Rating.rating.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def player_rating(user):
+    return Rating.query.filter_by(kind=PLAYER, subject_id=user.id).first()
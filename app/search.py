@@ -0,0 +1,307 @@
+## Imports
+
+# standard library
+import re
+import unicodedata
+from threading import Lock
+
+# sqlalchemy
+from sqlalchemy import event, inspect, text, select, case, func, and_, or_
+
+
+WORD = re.compile(r"\w+")
+# documents are keyed by id * 4 + the position of their kind, see doc_key
+KINDS = ("event", "location", "user", "series")
+FTS_TABLE = "search_fts"
+TITLE_WEIGHT = 2
+BODY_WEIGHT = 1
+
+
+def doc_key(kind, id):
+    return id * 4 + KINDS.index(kind) + 1
+
+
+def split_key(key):
+    return KINDS[(key - 1) % 4], (key - 1) // 4
+
+
+# lowercased words without accents, the way FTS5's unicode61 tokenizer sees
+# them, so both backends match the same
+def terms(value):
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    plain = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return [word[:64] for word in WORD.findall(plain.lower())]
+
+
+class SearchIndex(object):
+    """Full-text search over event and series info, location names,
+    usernames and about me texts. Uses the SQLite FTS5 table `search_fts` when the
+    migration could create it, else the `search_term` table of words, which
+    works on any database. Kept up to date from the session's flushes;
+    `reindex` rebuilds it."""
+
+    def __init__(self, app=None):
+        # per database url, the schema only changes with a migration
+        self._backends = {}
+        self._lock = Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SEARCH_PER_PAGE", 20)
+        app.extensions["search_index"] = self
+        if not self._listening:
+            from app import db
+
+            event.listen(db.session, "after_flush", self._after_flush)
+            self._listening = True
+
+    def backend(self, connection):
+        url = str(connection.engine.url)
+        with self._lock:
+            if url not in self._backends:
+                found = None
+                if connection.dialect.name == "sqlite":
+                    found = connection.execute(
+                        text(
+                            "SELECT 1 FROM sqlite_master "
+                            "WHERE type = 'table' AND name = :name"
+                        ),
+                        name=FTS_TABLE,
+                    ).scalar()
+                self._backends[url] = "fts5" if found else "terms"
+            return self._backends[url]
+
+    ## Documents
+
+    # (key, title, body) of an indexed object, None for anything else
+    @staticmethod
+    def document(obj):
+        from app.models import Event, Location, User, Series
+
+        if isinstance(obj, Event):
+            return doc_key("event", obj.id), "", obj.info or ""
+        if isinstance(obj, Series):
+            return doc_key("series", obj.id), "", obj.info or ""
+        if isinstance(obj, Location):
+            return doc_key("location", obj.id), obj.name or "", ""
+        if isinstance(obj, User):
+            return doc_key("user", obj.id), obj.username or "", obj.about_me or ""
+        return None
+
+    @staticmethod
+    def _changed(obj):
+        from app.models import Event, Location, User, Series
+
+        for model, fields in (
+            (Event, ("info",)),
+            (Series, ("info",)),
+            (Location, ("name",)),
+            (User, ("username", "about_me")),
+        ):
+            if isinstance(obj, model):
+                attrs = inspect(obj).attrs
+                return any(attrs[field].history.has_changes() for field in fields)
+        return False
+
+    # in the flush's transaction, so the index commits or rolls back with it
+    def _after_flush(self, session, flush_context):
+        documents, stale = [], []
+        for obj in session.new:
+            document = self.document(obj)
+            if document is not None:
+                documents.append(document)
+        for obj in session.dirty:
+            if self._changed(obj):
+                document = self.document(obj)
+                documents.append(document)
+                stale.append(document[0])
+        for obj in session.deleted:
+            document = self.document(obj)
+            if document is not None:
+                stale.append(document[0])
+        if documents or stale:
+            self._write(session.connection(), documents, stale)
+
+    # for new rows inserted with core statements, which the flush does not see
+    def add(self, obj):
+        from app import db
+
+        self._write(db.session.connection(), [self.document(obj)], [])
+
+    # drop the stale keys, then add the documents
+    def _write(self, connection, documents, stale):
+        from app.models import search_term
+
+        if self.backend(connection) == "fts5":
+            if stale:
+                connection.execute(
+                    text("DELETE FROM search_fts WHERE rowid = :key"),
+                    [{"key": key} for key in stale],
+                )
+            if documents:
+                connection.execute(
+                    text(
+                        "INSERT INTO search_fts (rowid, title, body) "
+                        "VALUES (:key, :title, :body)"
+                    ),
+                    [
+                        {"key": key, "title": title, "body": body}
+                        for key, title, body in documents
+                    ],
+                )
+            return
+        if stale:
+            connection.execute(search_term.delete().where(search_term.c.doc.in_(stale)))
+        rows = []
+        for key, title, body in documents:
+            weights = {}
+            for value, weight in ((title, TITLE_WEIGHT), (body, BODY_WEIGHT)):
+                for word in terms(value):
+                    weights[word] = weights.get(word, 0) + weight
+            rows.extend(
+                {"doc": key, "term": word, "weight": weight}
+                for word, weight in weights.items()
+            )
+        if rows:
+            connection.execute(search_term.insert(), rows)
+
+    ## Searching
+
+    def search(self, query, page=1, per_page=20):
+        """One page of [(kind, id)] with a word starting with each word of
+        the query, best first, and whether there is a next page."""
+        from app import db
+        from app.models import search_term
+
+        words = set(terms(query))
+        # a word that starts another one adds nothing
+        words = sorted(
+            word
+            for word in words
+            if not any(other != word and other.startswith(word) for other in words)
+        )
+        if not words:
+            return [], False
+        connection = db.session.connection()
+        offset = (max(page, 1) - 1) * per_page
+        if self.backend(connection) == "fts5":
+            rows = connection.execute(
+                text(
+                    "SELECT rowid FROM search_fts WHERE search_fts MATCH :match "
+                    "ORDER BY bm25(search_fts, :title, :body), rowid "
+                    "LIMIT :limit OFFSET :offset"
+                ),
+                match=" ".join('"{}"*'.format(word) for word in words),
+                title=float(TITLE_WEIGHT),
+                body=float(BODY_WEIGHT),
+                limit=per_page + 1,
+                offset=offset,
+            )
+        else:
+            # index range scans on term, one per word
+            prefixes = [
+                and_(search_term.c.term >= word, search_term.c.term < word + "\uffff")
+                for word in words
+            ]
+            matched = case(
+                [(prefix, index) for index, prefix in enumerate(prefixes)]
+            )
+            rows = connection.execute(
+                select([search_term.c.doc])
+                .where(or_(*prefixes))
+                .group_by(search_term.c.doc)
+                .having(func.count(matched.distinct()) == len(words))
+                .order_by(func.sum(search_term.c.weight).desc(), search_term.c.doc)
+                .limit(per_page + 1)
+                .offset(offset)
+            )
+        hits = [split_key(key) for key, in rows]
+        return hits[:per_page], len(hits) > per_page
+
+    # the objects of search hits in the same order, with one query per kind;
+    # a series is shown as its next date without an Event row, and left out
+    # when it has none
+    @staticmethod
+    def load(hits):
+        from app.models import Event, Location, User, Occurrence
+        from app.main.feed import (
+            with_event_details,
+            running_series,
+            start_of_today,
+            series_horizon,
+        )
+
+        queries = {
+            "event": with_event_details(Event.query),
+            "location": Location.query,
+            "user": User.query,
+        }
+        found = {}
+        for kind, query in queries.items():
+            ids = [id for hit_kind, id in hits if hit_kind == kind]
+            if ids:
+                model = query.column_descriptions[0]["entity"]
+                for obj in query.filter(model.id.in_(ids)):
+                    found[kind, obj.id] = obj
+        ids = {id for kind, id in hits if kind == "series"}
+        if ids:
+            series, taken = running_series()
+            today, horizon = start_of_today(), series_horizon()
+            for s in series:
+                if s.id not in ids:
+                    continue
+                for when in s.occurrences(today, horizon):
+                    if (s.id, when) not in taken:
+                        found["series", s.id] = Occurrence(s, when)
+                        break
+        return [
+            ("event" if kind == "series" else kind, found[kind, id])
+            for kind, id in hits
+            if (kind, id) in found
+        ]
+
+    ## Bulk rebuild
+
+    def reindex(self, chunk_size=1000):
+        """Index everything again, in chunks; returns the documents per
+        kind."""
+        from app import db
+        from app.models import Event, Location, User, Series, search_term
+
+        connection = db.session.connection()
+        if self.backend(connection) == "fts5":
+            connection.execute(text("DELETE FROM search_fts"))
+        else:
+            connection.execute(search_term.delete())
+        counts = {}
+        for kind, columns in (
+            ("event", (Event.id, db.literal(""), Event.info)),
+            ("location", (Location.id, Location.name, db.literal(""))),
+            ("user", (User.id, User.username, User.about_me)),
+            ("series", (Series.id, db.literal(""), Series.info)),
+        ):
+            counts[kind] = 0
+            last = 0
+            while True:
+                rows = connection.execute(
+                    select(columns)
+                    .where(columns[0] > last)
+                    .order_by(columns[0])
+                    .limit(chunk_size)
+                ).fetchall()
+                if not rows:
+                    break
+                self._write(
+                    connection,
+                    [
+                        (doc_key(kind, id), title or "", body or "")
+                        for id, title, body in rows
+                    ],
+                    [],
+                )
+                counts[kind] += len(rows)
+                last = rows[-1][0]
+        db.session.commit()
+        return counts
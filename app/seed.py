@@ -0,0 +1,237 @@
+## Imports
+
+# standard library
+import random
+from time import time
+from datetime import datetime, timedelta
+
+# relative
+from app import db, passwords
+from app.geo import geohash_encode
+from app.models import (
+    User,
+    Event,
+    Location,
+    Series,
+    Team,
+    Match,
+    participants,
+    team_player,
+    match_team,
+)
+from app.ratings import apply_matches
+
+
+# around Gent
+CENTER = (51.05, 3.72)
+CHUNK = 5000
+
+
+class Seeder(object):
+    """A synthetic data set for development and benchmarks: users, locations
+    of skewed popularity, events spread around today with a spread of
+    participants, weekly and fortnightly series, two player teams and the
+    matches they played (and the ratings those give). Rows are written with
+    executemany and explicit ids, so the database has to be empty. The same
+    `random_seed` gives the same data."""
+
+    def __init__(
+        self,
+        users=1000,
+        locations=50,
+        events=5000,
+        participants=6,
+        series=20,
+        teams=200,
+        matches=2000,
+        days=180,
+        password="password",
+        random_seed=1,
+    ):
+        self.users = users
+        self.locations = locations
+        self.events = events
+        self.participants = participants
+        self.series = series
+        self.teams = min(teams, users // 2)
+        self.matches = matches if self.teams > 1 else 0
+        self.days = days
+        self.password = password
+        self.random = random.Random(random_seed)
+        self.counts = {}
+
+    def is_empty(self):
+        return db.session.query(User.id).first() is None
+
+    def _insert(self, connection, table, rows):
+        for start in range(0, len(rows), CHUNK):
+            connection.execute(table.insert(), rows[start : start + CHUNK])
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+
+    def run(self):
+        started = time()
+        with db.engine.begin() as connection:
+            self._users(connection)
+            self._locations(connection)
+            self._events(connection)
+            self._series(connection)
+            self._teams(connection)
+            self._matches(connection)
+        self.seconds = time() - started
+        return self.counts
+
+    def _users(self, connection):
+        # hashing is slow on purpose, everybody gets the same password
+        password_hash = passwords.hash(self.password)
+        now = datetime.utcnow()
+        month = 60 * 24 * 30
+        self._insert(
+            connection,
+            User.__table__,
+            [
+                {
+                    "id": id,
+                    "username": "user{}".format(id),
+                    "email": "user{}@example.com".format(id),
+                    "password_hash": password_hash,
+                    "last_seen": now - timedelta(minutes=self.random.randint(0, month)),
+                }
+                for id in range(1, self.users + 1)
+            ],
+        )
+
+    def _locations(self, connection):
+        rows = []
+        for id in range(1, self.locations + 1):
+            latitude = CENTER[0] + self.random.uniform(-0.1, 0.1)
+            longitude = CENTER[1] + self.random.uniform(-0.15, 0.15)
+            rows.append(
+                {
+                    "id": id,
+                    "name": "veld {}".format(id),
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "geohash": geohash_encode(latitude, longitude),
+                }
+            )
+        self._insert(connection, Location.__table__, rows)
+
+    def _events(self, connection):
+        # a few locations host most of the sessions
+        weights = [1.0 / rank for rank in range(1, self.locations + 1)]
+        locations = self.random.choices(
+            range(1, self.locations + 1), weights=weights, k=self.events
+        )
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        events, joined = [], []
+        for id, location_id in zip(range(1, self.events + 1), locations):
+            creator = self.random.randint(1, self.users)
+            when = today + timedelta(
+                days=self.random.randint(-self.days, self.days),
+                hours=self.random.randint(9, 21),
+                minutes=self.random.choice((0, 15, 30, 45)),
+            )
+            # mostly around the mean, sometimes a crowd, always the creator
+            count = int(self.random.expovariate(1.0 / self.participants)) + 1
+            players = {creator}
+            while len(players) < min(count, self.users):
+                players.add(self.random.randint(1, self.users))
+            joined.extend(
+                {"participant_id": player, "event_id": id} for player in players
+            )
+            events.append(
+                {
+                    "id": id,
+                    "user_id": creator,
+                    "location_id": location_id,
+                    "datetime": when,
+                    "info": "Session {}".format(id),
+                    "participant_count": len(players),
+                }
+            )
+        self._insert(connection, Event.__table__, events)
+        self._insert(connection, participants, joined)
+
+    def _series(self, connection):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = []
+        for id in range(1, self.series + 1):
+            # most started long ago and keep going
+            start = today + timedelta(
+                days=self.random.randint(-self.days, 7),
+                hours=self.random.randint(9, 21),
+            )
+            until = None
+            if self.random.random() < 0.3:
+                until = start + timedelta(days=self.random.randint(30, 2 * self.days))
+            rows.append(
+                {
+                    "id": id,
+                    "user_id": self.random.randint(1, self.users),
+                    "location_id": self.random.randint(1, self.locations),
+                    "start": start,
+                    "interval_days": self.random.choice((7, 7, 14)),
+                    "until": until,
+                    "info": "Series {}".format(id),
+                }
+            )
+        self._insert(connection, Series.__table__, rows)
+
+    def _teams(self, connection):
+        players = self.random.sample(range(1, self.users + 1), self.teams * 2)
+        self._insert(
+            connection,
+            Team.__table__,
+            [
+                {"id": id, "teamname": "team {}".format(id)}
+                for id in range(1, self.teams + 1)
+            ],
+        )
+        self._insert(
+            connection,
+            team_player,
+            [
+                {"team_id": (index // 2) + 1, "player_id": player}
+                for index, player in enumerate(players)
+            ],
+        )
+
+    def _matches(self, connection):
+        start = datetime.utcnow() - timedelta(days=self.days)
+        matches = []
+        for _ in range(self.matches):
+            team1, team2 = self.random.sample(range(1, self.teams + 1), 2)
+            losing = self.random.randint(5, 19)
+            score1, score2 = (21, losing) if self.random.random() < 0.5 else (losing, 21)
+            date = start + timedelta(seconds=self.random.randint(0, self.days * 86400))
+            matches.append((date, team1, team2, score1, score2))
+        matches.sort()
+        self._insert(
+            connection,
+            Match.__table__,
+            [
+                {
+                    "id": id,
+                    "date": date,
+                    "team1_id": team1,
+                    "team2_id": team2,
+                    "score1": score1,
+                    "score2": score2,
+                }
+                for id, (date, team1, team2, score1, score2) in enumerate(matches, 1)
+            ],
+        )
+        self._insert(
+            connection,
+            match_team,
+            [
+                {"match_id": id, "team_id": team}
+                for id, match in enumerate(matches, 1)
+                for team in match[1:3]
+            ],
+        )
+        # in date order, like they were played
+        for start in range(0, len(matches), CHUNK):
+            apply_matches(
+                connection, [match[1:] for match in matches[start : start + CHUNK]]
+            )
@@ -0,0 +1,40 @@
+// loads the next page of every .event-list once the bottom of the list
+// comes into view; the server sends rendered rows and the next cursor
+$(function(){
+    $('.event-list').each(function(){
+        var list = $(this);
+        var loading = false;
+
+        var loadMore = function(){
+            var cursor = list.data('next');
+            if (!cursor || loading) {
+                return;
+            }
+            loading = true;
+            var params = {section: list.data('section'), cursor: cursor};
+            if (list.data('username')) {
+                params.username = list.data('username');
+            }
+            $.getJSON(list.data('url'), params, function(data){
+                $.each(data.events, function(i, html){
+                    list.append(html);
+                });
+                list.data('next', data.next || '');
+                loading = false;
+                check();
+            }).fail(function(){
+                loading = false;
+            });
+        };
+
+        var check = function(){
+            var bottom = list.offset().top + list.outerHeight();
+            if (bottom < $(window).scrollTop() + $(window).height() + 200) {
+                loadMore();
+            }
+        };
+
+        $(window).on('scroll resize', check);
+        check();
+    });
+});
@@ -0,0 +1,73 @@
+// keeps the participant counts on the page current from the server-sent
+// events of /live; for new or deleted events, and when the server could not
+// send everything since the page was made, it offers to reload instead.
+// The id of the last message seen goes with every connection, so nothing
+// is missed in between
+$(function(){
+    if (!window.EventSource) {
+        return;
+    }
+    var url = $('#live').data('url');
+    var lastId = $('#live').attr('data-last');
+    var delay = 5000;
+
+    var count = function(id, change){
+        $('.participant-count[data-event="' + id + '"]').each(function(){
+            $(this).text(parseInt($(this).text(), 10) + change);
+        });
+    };
+
+    var outdated = function(){
+        if ($('#live-outdated').length) {
+            return;
+        }
+        $('.container').first().prepend(
+            '<div id="live-outdated" class="alert alert-info" role="alert">' +
+            'Events have changed, <a href="">reload</a> to see them.</div>'
+        );
+    };
+
+    var seen = function(e){
+        if (e.lastEventId) {
+            lastId = e.lastEventId;
+        }
+    };
+
+    var connect = function(){
+        var source = new EventSource(
+            lastId ? url + '?last=' + encodeURIComponent(lastId) : url
+        );
+        source.addEventListener('open', function(){
+            delay = 5000;
+        });
+        source.addEventListener('joined', function(e){
+            seen(e);
+            var data = JSON.parse(e.data);
+            if (data.was) {
+                $('.participant-count[data-event="' + data.was + '"]')
+                    .attr('data-event', data.event);
+            }
+            count(data.event, 1);
+        });
+        source.addEventListener('left', function(e){
+            seen(e);
+            count(JSON.parse(e.data).event, -1);
+        });
+        $.each(['created', 'deleted', 'reset'], function(i, kind){
+            source.addEventListener(kind, function(e){
+                seen(e);
+                outdated();
+            });
+        });
+        // the browser retries by itself, except after an error status like
+        // the 503 of a full server
+        source.addEventListener('error', function(){
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connect, delay);
+                delay = Math.min(delay * 2, 300000);
+            }
+        });
+    };
+
+    connect();
+});
@@ -1,22 +1,9 @@
 var icon_url = 'https://cdn0.iconfinder.com/data/icons/small-n-flat/24/678111-map-marker-128.png'; //'/img/marker-icon.png'
-var coordinates = $('.coordinates');
-var n = coordinates.length;
-
-var lonLats = [];
-console.log(lonLats);
+var geojson_url = $('#map').data("url");
 
 map = new OpenLayers.Map("map");
 map.addLayer(new OpenLayers.Layer.OSM());
 
-for (i = 0; i < n; i++) {
-    lonLats[i] = new OpenLayers.LonLat( $(coordinates[i]).data("longitude"), $(coordinates[i]).data("latitude") )
-        .transform(
-            new OpenLayers.Projection("EPSG:4326"), // transform from WGS 1984
-            map.getProjectionObject() // to Spherical Mercator Projection
-        );
-}
-console.log(lonLats)
-
 var centerLonLat = new OpenLayers.LonLat( 3.7236719, 51.0504707 )
     .transform(
         new OpenLayers.Projection("EPSG:4326"), // transform from WGS 1984
@@ -38,8 +25,22 @@ var markerIcon = createMarkerIcon()
 var markers = new OpenLayers.Layer.Markers( "Markers" );
 map.addLayer(markers);
 
-for (i = 0; i < n; i++) {
-    markers.addMarker(new OpenLayers.Marker(lonLats[i], markerIcon.clone()));
+// the server clusters the events per zoom level, one feature per marker
+var loadMarkers = function() {
+    $.getJSON(geojson_url, {zoom: map.getZoom()}, function(data) {
+        markers.clearMarkers();
+        $.each(data.features, function(i, feature) {
+            var coordinates = feature.geometry.coordinates;
+            var lonLat = new OpenLayers.LonLat(coordinates[0], coordinates[1])
+                .transform(
+                    new OpenLayers.Projection("EPSG:4326"), // transform from WGS 1984
+                    map.getProjectionObject() // to Spherical Mercator Projection
+                );
+            markers.addMarker(new OpenLayers.Marker(lonLat, markerIcon.clone()));
+        });
+    });
 }
 
-map.setCenter (centerLonLat, zoom);
\ No newline at end of file
+map.events.register("zoomend", map, loadMarkers);
+map.setCenter (centerLonLat, zoom);
+loadMarkers();
@@ -0,0 +1,78 @@
+## Imports
+
+# standard library
+from collections import namedtuple
+
+# sqlalchemy
+from sqlalchemy import and_, or_, case, func
+
+# relative
+from app import db
+from app.models import Match, team_player
+
+
+class Record(
+    namedtuple(
+        "Record", ["matches", "wins", "losses", "draws", "points_for", "points_against"]
+    )
+):
+    @property
+    def differential(self):
+        return self.points_for - self.points_against
+
+    @property
+    def win_rate(self):
+        return self.wins / self.matches if self.matches else None
+
+
+# one aggregate row seen from the side whose score is `own`
+def _record(query, own, other):
+    row = query.with_entities(
+        func.count(Match.id),
+        func.sum(case([(own > other, 1)], else_=0)),
+        func.sum(case([(own < other, 1)], else_=0)),
+        func.sum(case([(own == other, 1)], else_=0)),
+        func.sum(own),
+        func.sum(other),
+    ).one()
+    return Record(*(value or 0 for value in row))
+
+
+def _scores(is_team1):
+    own = case([(is_team1, Match.score1)], else_=Match.score2)
+    other = case([(is_team1, Match.score2)], else_=Match.score1)
+    return own, other
+
+
+# record of team a against team b, from the two composite indexes
+def head_to_head(team_a, team_b):
+    query = db.session.query(Match).filter(
+        or_(
+            and_(Match.team1_id == team_a, Match.team2_id == team_b),
+            and_(Match.team1_id == team_b, Match.team2_id == team_a),
+        )
+    )
+    return _record(query, *_scores(Match.team1_id == team_a))
+
+
+def team_record(team_id):
+    query = db.session.query(Match).filter(
+        or_(Match.team1_id == team_id, Match.team2_id == team_id)
+    )
+    return _record(query, *_scores(Match.team1_id == team_id))
+
+
+# every match played in any of the teams the player was part of
+def player_record(user_id):
+    query = (
+        db.session.query(Match)
+        .join(
+            team_player,
+            or_(
+                team_player.c.team_id == Match.team1_id,
+                team_player.c.team_id == Match.team2_id,
+            ),
+        )
+        .filter(team_player.c.player_id == user_id)
+    )
+    return _record(query, *_scores(team_player.c.team_id == Match.team1_id))
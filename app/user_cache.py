@@ -0,0 +1,121 @@
+## Imports
+
+# standard library
+from time import time
+from threading import Lock
+from collections import OrderedDict
+
+# sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+
+
+class UserCache(object):
+    """Identity cache for the Flask-Login user loader.
+
+    Keeps a snapshot of the column values of recently seen users for
+    `USER_CACHE_TTL` seconds, at most `USER_CACHE_SIZE` of them. A hit is
+    rebuilt into a detached `User` and merged into the session without a
+    SELECT. Any flush touching a user drops its snapshot, which covers
+    edit_profile and reset_password; other processes see the change once
+    their snapshot expires.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._users = OrderedDict()
+        self._lock = Lock()
+        self._listening = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("USER_CACHE_ENABLED", True)
+        app.config.setdefault("USER_CACHE_TTL", 30)
+        app.config.setdefault("USER_CACHE_SIZE", 1000)
+        app.extensions["user_cache"] = self
+        self.app = app
+        if not self._listening:
+            from app import db
+
+            event.listen(db.session, "after_flush", self._after_flush)
+            self._listening = True
+
+    def load(self, id):
+        from app import db
+        from app.models import User
+
+        if not self.app.config["USER_CACHE_ENABLED"]:
+            return User.query.get(id)
+        snapshot = self._get(id)
+        if snapshot is None:
+            user = User.query.get(id)
+            if user is not None:
+                self._set(id, user)
+            return user
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in snapshot.items():
+            setattr(user, key, value)
+        # clears the attribute history, as if it had just been loaded
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def _get(self, id):
+        with self._lock:
+            entry = self._users.get(id)
+            if entry is not None and entry[0] > time():
+                self._users.move_to_end(id)
+                self.hits += 1
+                return entry[1]
+            self._users.pop(id, None)
+            self.misses += 1
+        return None
+
+    def _set(self, id, user):
+        snapshot = {
+            attribute.key: getattr(user, attribute.key)
+            for attribute in user.__mapper__.column_attrs
+        }
+        expires = time() + self.app.config["USER_CACHE_TTL"]
+        with self._lock:
+            self._users[id] = (expires, snapshot)
+            self._users.move_to_end(id)
+            while len(self._users) > self.app.config["USER_CACHE_SIZE"]:
+                self._users.popitem(last=False)
+
+    def invalidate(self, *ids):
+        with self._lock:
+            for id in ids:
+                if self._users.pop(id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def _after_flush(self, session, flush_context):
+        from app.models import User
+
+        changed = [
+            obj.id
+            for obj in list(session.dirty) + list(session.deleted)
+            if isinstance(obj, User)
+        ]
+        if changed:
+            self.invalidate(*changed)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                # every hit is a SELECT on user that was not run
+                "queries_saved": self.hits,
+                "invalidations": self.invalidations,
+                "size": len(self._users),
+            }
@@ -0,0 +1,279 @@
+"""Endpoint benchmarks through the Flask test client at several data scales.
+
+    python benchmarks/bench.py                      # compare with baseline.json
+    python benchmarks/bench.py --scales small,large --requests 100
+    python benchmarks/bench.py --save               # store a new baseline
+
+Every scale is seeded (app/seed.py) into its own temporary SQLite file and
+measured in a fresh process, so no cache carries over. Latency percentiles
+and the queries per request (from the Server-Timing header) are compared
+with the stored baseline; a slower p50 beyond the tolerance or more queries
+than before fails the run. Timings only compare on the same machine, run
+--save there first.
+"""
+
+## Imports
+
+# standard library
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+from random import Random
+from datetime import date, timedelta
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SCALES = {
+    "small": dict(
+        users=100, locations=10, events=500, series=5, teams=20, matches=200
+    ),
+    "medium": dict(
+        users=1000, locations=50, events=5000, series=50, teams=200, matches=2000
+    ),
+    "large": dict(
+        users=10000,
+        locations=200,
+        events=50000,
+        series=500,
+        teams=1000,
+        matches=20000,
+    ),
+}
+ENDPOINTS = ("login", "index", "event_detail", "create_event", "join_event")
+QUERIES = re.compile(r'desc="(\d+) queries"')
+PASSWORD = "password"
+
+
+## Requests, one function per endpoint: (client, scale, random) -> response
+
+
+def login(client, scale, random):
+    # a new session every time, like a user logging in
+    client.cookie_jar.clear()
+    return client.post(
+        "/auth/login",
+        data={
+            "username": "user{}".format(random.randint(1, scale["users"])),
+            "password": PASSWORD,
+        },
+    )
+
+
+def index(client, scale, random):
+    return client.get("/index")
+
+
+def event_detail(client, scale, random):
+    return client.get("/event_detail/{}".format(random.randint(1, scale["events"])))
+
+
+def create_event(client, scale, random):
+    return client.post(
+        "/create_event",
+        data={
+            "location": "veld {}".format(random.randint(1, scale["locations"])),
+            "date": (date.today() + timedelta(days=random.randint(1, 30))).isoformat(),
+            "time": "18:30",
+            "info": "benchmark",
+        },
+    )
+
+
+def join_event(client, scale, random):
+    return client.get("/join/{}".format(random.randint(1, scale["events"])))
+
+
+## Measuring, in the child process
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(name, requests, warmup):
+    sys.path.insert(0, ROOT)
+    # config.py insists on these; nothing is mailed or stored there
+    for variable, value in (
+        ("DATABASE_URI", "sqlite://"),
+        ("MAIL_SERVER", "localhost"),
+        ("MAIL_PORT", "25"),
+        ("MAIL_USE_TLS", ""),
+        ("MAIL_USERNAME", ""),
+        ("MAIL_PASSWORD", ""),
+    ):
+        os.environ.setdefault(variable, value)
+    from config import Config
+    from app import create_app, db
+    from app.seed import Seeder
+
+    directory = tempfile.mkdtemp(prefix="spikeball-bench-")
+
+    class BenchConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(directory, "bench.db")
+        BEHIND_PROXY = False
+        MAIL_QUEUE_WORKERS = 0
+        AVATAR_CACHE_DIR = os.path.join(directory, "avatars")
+        METRICS_SLOW_REQUEST_MS = 10 ** 6
+        METRICS_SLOW_QUERY_MS = 10 ** 6
+
+    scale = SCALES[name]
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        Seeder(password=PASSWORD, **scale).run()
+
+    random = Random(1)
+    client = app.test_client()
+    client.post("/auth/login", data={"username": "user1", "password": PASSWORD})
+    results = {}
+    for endpoint in ENDPOINTS:
+        request = globals()[endpoint]
+        for _ in range(warmup):
+            request(client, scale, random)
+        latencies, queries = [], []
+        for _ in range(requests):
+            started = perf_counter()
+            response = request(client, scale, random)
+            latencies.append(perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(
+                    "{} answered {}".format(endpoint, response.status_code)
+                )
+            match = QUERIES.search(response.headers.get("Server-Timing", ""))
+            if match:
+                queries.append(int(match.group(1)))
+            # the redirects are not followed, drop their flash messages
+            # before they pile up in the session cookie
+            with client.session_transaction() as session:
+                session.pop("_flashes", None)
+        latencies.sort()
+        results[endpoint] = {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "queries": sum(queries) / len(queries) if queries else None,
+        }
+    return results
+
+
+## Comparing, in the parent
+
+
+def run_scale(name, requests, warmup):
+    process = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--child",
+            name,
+            "--requests",
+            str(requests),
+            "--warmup",
+            str(warmup),
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+# lines describing what got worse, empty when nothing did
+def regressions(results, baseline, tolerance):
+    found = []
+    for scale, endpoints in sorted(results.items()):
+        for endpoint, now in sorted(endpoints.items()):
+            before = baseline.get(scale, {}).get(endpoint)
+            if before is None:
+                continue
+            # a millisecond of slack keeps the fastest pages from flapping
+            if now["p50"] > before["p50"] * (1 + tolerance) + 0.001:
+                found.append(
+                    "{} {}: p50 {:.1f} ms, was {:.1f} ms".format(
+                        scale, endpoint, now["p50"] * 1000, before["p50"] * 1000
+                    )
+                )
+            if (
+                now["queries"] is not None
+                and before["queries"] is not None
+                and now["queries"] > before["queries"] + 0.5
+            ):
+                found.append(
+                    "{} {}: {:.1f} queries, was {:.1f}".format(
+                        scale, endpoint, now["queries"], before["queries"]
+                    )
+                )
+    return found
+
+
+def report(results, baseline):
+    print(
+        "{:<8}{:<14}{:>10}{:>10}{:>10}{:>9}{:>12}".format(
+            "scale", "endpoint", "p50 ms", "p95 ms", "p99 ms", "queries", "p50 before"
+        )
+    )
+    for scale, endpoints in results.items():
+        for endpoint, now in endpoints.items():
+            before = baseline.get(scale, {}).get(endpoint)
+            print(
+                "{:<8}{:<14}{:>10.1f}{:>10.1f}{:>10.1f}{:>9}{:>12}".format(
+                    scale,
+                    endpoint,
+                    now["p50"] * 1000,
+                    now["p95"] * 1000,
+                    now["p99"] * 1000,
+                    "-" if now["queries"] is None else "{:.1f}".format(now["queries"]),
+                    "-" if before is None else "{:.1f}".format(before["p50"] * 1000),
+                )
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scales", default="small,medium")
+    parser.add_argument("--requests", type=int, default=50, help="Per endpoint.")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="Store as the baseline.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.requests, args.warmup)))
+        return 0
+
+    results = {}
+    for name in args.scales.split(","):
+        if name not in SCALES:
+            parser.error("unknown scale {}, pick from {}".format(name, ", ".join(SCALES)))
+        results[name] = run_scale(name, args.requests, args.warmup)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("saved {}".format(args.baseline))
+        return 0
+    found = regressions(results, baseline, args.tolerance)
+    for line in found:
+        print("regression: " + line)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
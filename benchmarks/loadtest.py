@@ -0,0 +1,110 @@
+"""Closed-loop HTTP load test against a running instance.
+
+    python benchmarks/loadtest.py http://localhost:8000 /index /user/someone \
+        --username someone --password secret --concurrency 16 --duration 30
+
+Every client logs in once (when a username is given), then requests the
+paths round robin as fast as the server answers. Prints throughput and
+latency percentiles per run; only the standard library is needed.
+"""
+
+## Imports
+
+# standard library
+import re
+import sys
+import argparse
+import threading
+from time import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor
+
+
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def client(base, username=None, password=None):
+    opener = build_opener(HTTPCookieProcessor(CookieJar()))
+    if username:
+        page = opener.open(base + "/auth/login").read().decode("utf-8")
+        token = CSRF.search(page)
+        form = {"username": username, "password": password}
+        if token:
+            form["csrf_token"] = token.group(1)
+        opener.open(base + "/auth/login", urlencode(form).encode("utf-8")).read()
+    return opener
+
+
+def worker(opener, base, paths, deadline, latencies, errors):
+    i = 0
+    while time() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time()
+        try:
+            opener.open(base + path).read()
+        except (HTTPError, OSError):
+            errors.append(path)
+            continue
+        latencies.append(time() - started)
+
+
+def run(base, paths, concurrency, duration, username=None, password=None):
+    openers = [client(base, username, password) for _ in range(concurrency)]
+    latencies, errors = [], []
+    deadline = time() + duration
+    threads = [
+        threading.Thread(
+            target=worker, args=(opener, base, paths, deadline, latencies, errors)
+        )
+        for opener in openers
+    ]
+    started = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2] if latencies else None,
+        "p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("base", help="e.g. http://localhost:8000")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    args = parser.parse_args(argv)
+
+    result = run(
+        args.base.rstrip("/"),
+        args.paths,
+        args.concurrency,
+        args.duration,
+        args.username,
+        args.password,
+    )
+    if not result["requests"]:
+        print("no successful requests, {errors} errors".format(**result))
+        return 1
+    print(
+        "{requests} requests, {errors} errors, {rps:.1f} req/s, "
+        "p50 {p50:.3f}s p95 {p95:.3f}s p99 {p99:.3f}s".format(**result)
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
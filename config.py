@@ -18,4 +18,98 @@ class Config(object):
     MAIL_PASSWORD = os.environ["MAIL_PASSWORD"]
     ADMINS = ["noreply@spikeballgent.be"]
 
+    # log to stdout (journald) instead of logs/microblog.log
+    LOG_TO_STDOUT = os.environ.get("LOG_TO_STDOUT") == "1"
+
+    # outgoing mail is spooled in the database and sent by background workers
+    MAIL_QUEUE_WORKERS = int(os.environ.get("MAIL_QUEUE_WORKERS", 2))
+    MAIL_QUEUE_BATCH_SIZE = 20
+    MAIL_QUEUE_MAX_ATTEMPTS = 5
+    MAIL_QUEUE_RETRY_DELAY = 30
+    # used for links in mail sent from the command line and calendar feeds
+    BASE_URL = os.environ.get("BASE_URL", "https://spikeballgent.be")
+
     POSTS_PER_PAGE = 25
+    # occurrences of recurring events are listed this many days ahead
+    SERIES_HORIZON_DAYS = int(os.environ.get("SERIES_HORIZON_DAYS", 90))
+    # .ics feeds, see app/ical.py: sessions since this many days ago, with a
+    # length calendar apps need; event times are local to ICAL_TIMEZONE
+    ICAL_PAST_DAYS = 90
+    ICAL_EVENT_MINUTES = 120
+    ICAL_TIMEZONE = os.environ.get("ICAL_TIMEZONE", "Europe/Brussels")
+
+    # password hashing runs in a process pool, see app/passwords.py; stored
+    # hashes made with another method are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:150000")
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_PENDING = 8
+    # failed logins tolerated per client address and per username; addresses
+    # are taken from X-Forwarded-For when running behind nginx
+    BEHIND_PROXY = os.environ.get("BEHIND_PROXY", "1") == "1"
+    LOGIN_ATTEMPT_WINDOW = 300
+    LOGIN_MAX_FAILURES_PER_ADDRESS = 20
+    LOGIN_MAX_FAILURES_PER_USERNAME = 5
+
+    # elo ratings of teams and players
+    RATING_K = 32
+    RATING_INITIAL = 1500.0
+    LEADERBOARD_SIZE = 50
+
+    # last_seen is written behind: at most this many seconds stale, or flushed
+    # as soon as this many users are pending
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get("LAST_SEEN_FLUSH_INTERVAL", 60))
+    LAST_SEEN_FLUSH_SIZE = int(os.environ.get("LAST_SEEN_FLUSH_SIZE", 100))
+
+    # `flask assets build` writes fingerprinted files to app/static/dist;
+    # images wider than this are scaled down, some to the size they are shown
+    ASSETS_IMAGE_MAX_WIDTH = 1920
+    ASSETS_IMAGE_WIDTHS = {
+        "LOGO_transparant.png": 141,
+        "logo_gent.png": 300,
+        "sport.png": 300,
+        "delete.png": 42,
+        "clicking_hand.png": 256,
+    }
+
+    # users loaded for current_user are kept this many seconds, see
+    # app/user_cache.py
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30))
+    USER_CACHE_SIZE = 1000
+
+    # rendered event fragments, see app/cache.py
+    FRAGMENT_CACHE_BACKEND = "app.cache.LRUBackend"
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get("FRAGMENT_CACHE_MAX_BYTES", 4194304))
+
+    # server-sent updates on /live, see app/live.py; gunicorn.conf.py picks
+    # app.live.SocketBackend for several workers, so a change reaches the
+    # pages of all of them. An open stream holds a thread, gunicorn.conf.py
+    # adds LIVE_MAX_SUBSCRIBERS threads per worker for them
+    LIVE_BACKEND = os.environ.get("LIVE_BACKEND", "app.live.LocalBackend")
+    LIVE_DIR = os.environ.get("LIVE_DIR", "/tmp/spikeball-live")
+    LIVE_BUFFER = 100
+    LIVE_REPLAY = 200
+    LIVE_HEARTBEAT = 15
+    LIVE_MAX_SECONDS = 300
+    LIVE_MAX_SUBSCRIBERS = int(os.environ.get("LIVE_MAX_SUBSCRIBERS", 16))
+
+    # location autocomplete on create_event
+    LOCATION_INDEX_TTL = 300
+    LOCATION_SEARCH_LIMIT = 10
+
+    # "events near me", distances in km
+    EVENTS_NEAR_RADIUS_KM = 10
+    EVENTS_NEAR_MAX_RADIUS_KM = 100
+
+    # timings per request in the Server-Timing header and on /metrics (only
+    # for these addresses); slower requests and queries are logged. With
+    # several workers set METRICS_DIR so /metrics adds all of them up
+    METRICS_SLOW_REQUEST_MS = int(os.environ.get("METRICS_SLOW_REQUEST_MS", 500))
+    METRICS_SLOW_QUERY_MS = int(os.environ.get("METRICS_SLOW_QUERY_MS", 100))
+    METRICS_ALLOWED_ADDRESSES = os.environ.get(
+        "METRICS_ALLOWED_ADDRESSES", "127.0.0.1,::1"
+    ).split(",")
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+
+    # `flask boot-profile` fails when a cold start (imports, create_app and
+    # the first request) takes longer, in milliseconds
+    BOOT_TARGET_MS = int(os.environ.get("BOOT_TARGET_MS", 1500))
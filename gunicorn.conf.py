@@ -0,0 +1,51 @@
+# gunicorn settings, used by spikeball.service:
+#     gunicorn -c gunicorn.conf.py "app:create_app()"
+# every value can be overridden from the environment (.flaskenv)
+
+import os
+import multiprocessing
+
+
+bind = os.environ.get("GUNICORN_BIND", "unix:/home/spikeball/spikeball.sock")
+umask = 0o007
+
+# a process per core for the cpu, threads for the time spent waiting on smtp;
+# password hashing has its own process pool (app/passwords.py). Pages are
+# rendered on the cpu and SQLite answers from the page cache, so more
+# processes than cores only make them take turns
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+# an open live update stream (app/live.py) holds a thread until it ends, so
+# each worker gets LIVE_MAX_SUBSCRIBERS threads for them on top of the
+# GUNICORN_THREADS for the pages; config.py reads the same default
+threads = int(os.environ.get("GUNICORN_THREADS", 4)) + int(
+    os.environ.get("LIVE_MAX_SUBSCRIBERS", 16)
+)
+worker_class = "gthread"
+
+# live updates (app/live.py) have to reach the pages of every worker; read
+# by config.py when the app is loaded, after this file
+if workers > 1:
+    os.environ.setdefault("LIVE_BACKEND", "app.live.SocketBackend")
+
+# import the app once in the master and fork it, the workers share its memory
+# and a broken app fails the start instead of every worker
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+timeout = 30
+graceful_timeout = 30
+# recycle workers now and then, bounding slow leaks
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG")
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # connections opened in the master (while preloading) must not be shared
+    # with the children; each worker opens its own
+    from app import db
+
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose()
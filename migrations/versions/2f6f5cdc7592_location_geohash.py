@@ -0,0 +1,46 @@
+"""location geohash
+
+Revision ID: 2f6f5cdc7592
+Revises: f37169b5d232
+Create Date: 2026-10-18 09:17:19.792577
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.geo import geohash_encode
+
+
+# revision identifiers, used by Alembic.
+revision = '2f6f5cdc7592'
+down_revision = 'f37169b5d232'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        batch_op.create_index(batch_op.f('ix_location_geohash'), ['geohash'], unique=False)
+
+    connection = op.get_bind()
+    rows = connection.execute(sa.text(
+        "SELECT id, latitude, longitude FROM location "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    )).fetchall()
+    for id, latitude, longitude in rows:
+        connection.execute(
+            sa.text("UPDATE location SET geohash = :geohash WHERE id = :id"),
+            {'geohash': geohash_encode(latitude, longitude), 'id': id},
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_location_geohash'))
+        batch_op.drop_column('geohash')
+
+    # sqlite drops the column by copying the table, which loses the
+    # expression index on the name
+    if op.get_bind().dialect.name == 'sqlite':
+        op.create_index('ix_location_name_lower', 'location', [sa.text('lower(name)')], unique=True)
@@ -0,0 +1,30 @@
+"""plain unique index on location names
+
+Revision ID: a9ce351037e8
+Revises: b819bcb8f5e6
+Create Date: 2026-10-18 10:52:37.849112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9ce351037e8'
+down_revision = 'b819bcb8f5e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # names are lowercased since f37169b5d232, a plain index keeps them
+    # unique; autogenerate of alembic 1.0 fails on the expression index
+    op.drop_index('ix_location_name_lower', table_name='location')
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_location_name'), ['name'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_location_name'))
+    op.create_index('ix_location_name_lower', 'location', [sa.text('lower(name)')], unique=True)
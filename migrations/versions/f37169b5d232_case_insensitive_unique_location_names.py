@@ -0,0 +1,45 @@
+"""case insensitive unique location names
+
+Revision ID: f37169b5d232
+Revises: 4fd067ecb14b
+Create Date: 2026-10-18 09:15:56.224182
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f37169b5d232'
+down_revision = '4fd067ecb14b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_event used to compare names case sensitively, so the same spot
+    # can exist several times: point the events to the oldest row and drop
+    # the duplicates before the unique index goes in
+    connection = op.get_bind()
+    duplicates = connection.execute(sa.text(
+        "SELECT lower(name), min(id) FROM location "
+        "GROUP BY lower(name) HAVING count(*) > 1"
+    )).fetchall()
+    for name, keep_id in duplicates:
+        params = {'name': name, 'keep_id': keep_id}
+        connection.execute(sa.text(
+            "UPDATE event SET location_id = :keep_id WHERE location_id IN "
+            "(SELECT id FROM location WHERE lower(name) = :name AND id != :keep_id)"
+        ), params)
+        connection.execute(sa.text(
+            "DELETE FROM location WHERE lower(name) = :name AND id != :keep_id"
+        ), params)
+    connection.execute(sa.text("UPDATE location SET name = lower(name)"))
+
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.create_index('ix_location_name_lower', [sa.text('lower(name)')], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.drop_index('ix_location_name_lower')
@@ -0,0 +1,172 @@
+## Imports
+
+# standard library
+import os
+import sys
+import socketserver
+from threading import Thread
+
+# pytest
+import pytest
+from sqlalchemy import event
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.py insists on these; nothing is mailed or stored there
+for variable, value in (
+    ("DATABASE_URI", "sqlite://"),
+    ("MAIL_SERVER", "localhost"),
+    ("MAIL_PORT", "25"),
+    ("MAIL_USE_TLS", ""),
+    ("MAIL_USERNAME", ""),
+    ("MAIL_PASSWORD", ""),
+):
+    os.environ.setdefault(variable, value)
+
+from config import Config  # noqa: E402
+from app import create_app, db  # noqa: E402
+
+
+PASSWORD = "password"
+
+
+# settings a test module needs on top of TestConfig, before the app exists
+@pytest.fixture
+def app_config():
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + str(tmp_path / "test.db")
+        BEHIND_PROXY = False
+        MAIL_QUEUE_WORKERS = 0
+        AVATAR_CACHE_DIR = str(tmp_path / "avatars")
+        LOG_TO_STDOUT = True
+        # the caches outlive an app, keep them out of the counts
+        USER_CACHE_ENABLED = False
+
+    for key, value in app_config.items():
+        setattr(TestConfig, key, value)
+    app = create_app(TestConfig)
+    # requests push their own context, a context kept open here would share
+    # one session between them
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def seed(app):
+    from app.seed import Seeder
+
+    def seed(**counts):
+        with app.app_context():
+            Seeder(password=PASSWORD, **counts).run()
+
+    return seed
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username):
+    response = client.post(
+        "/auth/login", data={"username": username, "password": PASSWORD}
+    )
+    assert response.status_code == 302
+    return response
+
+
+# counts the statements sent to the database while the block runs
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_queries(app):
+    return lambda: QueryCounter(db.get_engine(app))
+
+
+# a local smtp server that keeps what it receives, for the mail queue
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.messages = []
+        self.refuse = False
+        # recipients answered with a 550
+        self.unknown = set()
+        # messages taken per connection before it is closed, None for no limit
+        self.hang_up_after = None
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        if self.server.refuse:
+            self.reply("421 not now")
+            return
+        self.reply("220 stand-in")
+        taken = 0
+        while True:
+            line = self.rfile.readline().decode("utf-8").strip()
+            command = line[:4].upper()
+            if not line or command == "QUIT":
+                self.reply("221 bye")
+                return
+            if command == "MAIL" and taken == self.server.hang_up_after:
+                return
+            if command == "RCPT" and any(
+                "<{}>".format(address) in line for address in self.server.unknown
+            ):
+                self.reply("550 no such user")
+                continue
+            if command == "DATA":
+                self.reply("354 go ahead")
+                lines = []
+                for data in iter(self.rfile.readline, b""):
+                    if data.rstrip(b"\r\n") == b".":
+                        break
+                    lines.append(data.decode("utf-8"))
+                self.server.messages.append("".join(lines))
+                taken += 1
+            self.reply("250 ok")
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPStandIn()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,17 @@
+## Imports
+
+# relative
+from app.cache import LRUBackend
+
+
+def test_counters_are_bounded_and_never_go_back():
+    backend = LRUBackend(max_bytes=100)
+    first = backend.incr("event:0:version")
+    for event_id in range(1, 100):
+        last = backend.incr("event:{}:version".format(event_id))
+    assert backend.size <= 100
+    assert backend.info()["counters"] < 100
+    assert backend.counter("event:99:version") == last
+    # evicted, so it comes back higher than it was
+    assert backend.counter("event:0:version") > first
+    assert backend.incr("event:0:version") > first + 1
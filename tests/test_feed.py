@@ -0,0 +1,72 @@
+## Imports
+
+# pytest
+import pytest
+
+# relative
+from app import db
+from app.models import Event, participants
+from tests.conftest import login
+
+
+# statements per render of the index, however many events there are: the
+# logged in user, the validator of the conditional response, this week, the
+# running series with their taken dates, the later and past pages and the
+# user's joined events
+INDEX_QUERIES = 7
+# a next page of later events: the logged in user, the page, the running
+# series with their taken dates, and the joined events
+MORE_QUERIES = 4
+
+
+def render_index(client, count_queries):
+    with count_queries() as queries:
+        response = client.get("/index")
+    assert response.status_code == 200
+    return len(queries)
+
+
+@pytest.mark.parametrize("events", [50, 500])
+def test_index_query_budget(app, client, seed, count_queries, events):
+    seed(users=50, locations=10, events=events, series=5, teams=0, matches=0)
+    login(client, "user1")
+    assert render_index(client, count_queries) <= INDEX_QUERIES
+
+
+def test_index_queries_do_not_grow_with_the_events(app, client, seed, count_queries):
+    seed(users=50, locations=10, events=20, series=2, teams=0, matches=0)
+    login(client, "user1")
+    few = render_index(client, count_queries)
+
+    # more rows on the page, each with its own creator and participants
+    with app.app_context():
+        for id in range(21, 121):
+            event = Event.query.get((id % 20) + 1)
+            db.session.execute(
+                Event.__table__.insert().values(
+                    id=id,
+                    user_id=id % 50 + 1,
+                    location_id=id % 10 + 1,
+                    datetime=event.datetime,
+                    participant_count=1,
+                )
+            )
+            db.session.execute(
+                participants.insert().values(event_id=id, participant_id=id % 50 + 1)
+            )
+        db.session.commit()
+    assert render_index(client, count_queries) == few
+
+
+def test_more_events_query_budget(app, client, seed, count_queries):
+    seed(users=50, locations=10, events=500, series=5, teams=0, matches=0)
+    login(client, "user1")
+    cursor = client.get(
+        "/events/more", query_string={"section": "later"}
+    ).get_json()["next"]
+    with count_queries() as queries:
+        response = client.get(
+            "/events/more", query_string={"section": "later", "cursor": cursor}
+        )
+    assert response.status_code == 200
+    assert len(queries) <= MORE_QUERIES
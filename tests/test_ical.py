@@ -0,0 +1,52 @@
+## Imports
+
+# standard library
+from datetime import datetime, timedelta
+
+# flask
+from flask import url_for
+
+# relative
+from app import db, ical
+from app.models import Series, User, Location
+from app.main.feed import start_of_today
+from tests.conftest import PASSWORD
+
+
+def feed(app, client, scope="all", id=None):
+    with app.test_request_context():
+        token = ical.feed_token(scope, id)
+        path = url_for("main.calendar", token=token)
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.get_data(as_text=True).replace("\r\n ", "")
+
+
+def test_series_start_in_the_feed_window(app, client):
+    today = start_of_today()
+    with app.app_context():
+        user = User("maker", "maker@example.com", PASSWORD)
+        location = Location(name="veld")
+        db.session.add_all([user, location])
+        db.session.flush()
+        series = Series(
+            user_id=user.id,
+            location_id=location.id,
+            start=today - timedelta(days=203, hours=-18),
+            interval_days=7,
+        )
+        db.session.add(series)
+        db.session.flush()
+        old = next(series.occurrences(today - timedelta(days=150), datetime.max))
+        recent = next(series.occurrences(today, datetime.max))
+        series.cancel(old)
+        series.cancel(recent)
+        db.session.commit()
+        since = today - timedelta(days=app.config["ICAL_PAST_DAYS"])
+        first = next(series.occurrences(since, datetime.max))
+
+    text = feed(app, client)
+    assert "DTSTART:" + ical.stamp(first) in text
+    assert "EXDATE:" + ical.stamp(recent) in text
+    # before the rule starts, so no EXDATE needed
+    assert ical.stamp(old) not in text
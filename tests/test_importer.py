@@ -0,0 +1,75 @@
+## Imports
+
+# standard library
+import json
+from datetime import datetime
+
+# pytest
+import pytest
+
+# relative
+from app import db
+from app import importer
+from app.importer import MatchImporter, CheckpointError
+from app.models import Match, Team, User
+from tests.conftest import PASSWORD
+
+
+HEADER = (
+    "date,team1,team1_player1,team1_player2,"
+    "team2,team2_player1,team2_player2,score1,score2\n"
+)
+
+
+def write(path, *dates):
+    path.write_text(
+        HEADER
+        + "".join("{},a,p0,p1,b,p2,p3,21,15\n".format(date) for date in dates)
+    )
+
+
+@pytest.fixture
+def players(app):
+    with app.app_context():
+        users = [
+            User("p{}".format(i), "p{}@example.com".format(i), PASSWORD)
+            for i in range(4)
+        ]
+        db.session.add_all(users)
+        a, b = Team("a", users[0], users[1]), Team("b", users[2], users[3])
+        # already rated history, later than what the file brings
+        db.session.add(Match(a, b, 21, 10, datetime(2021, 1, 1)))
+        db.session.commit()
+
+
+def test_resume_recomputes_what_was_imported_out_of_order(
+    app, players, tmp_path, monkeypatch
+):
+    path = tmp_path / "matches.csv"
+    write(path, "2020-01-01", "not a date")
+    with app.app_context():
+        assert not MatchImporter(str(path), chunk_size=1).run()
+    checkpoint = json.loads((tmp_path / "matches.csv.checkpoint").read_text())
+    assert checkpoint["line"] == 2 and checkpoint["out_of_order"]
+
+    recomputed = []
+    monkeypatch.setattr(importer, "recompute_all", lambda: recomputed.append(True))
+    write(path, "2020-01-01", "2022-01-01")
+    with app.app_context():
+        assert MatchImporter(str(path), chunk_size=1).run(resume=True)
+        assert Match.query.count() == 3
+    assert recomputed
+
+
+def test_resume_against_another_file(app, players, tmp_path):
+    path = tmp_path / "matches.csv"
+    write(path, "2022-01-01", "not a date")
+    other = tmp_path / "other.csv"
+    write(other, "2022-01-01")
+    with app.app_context():
+        assert not MatchImporter(str(path), chunk_size=1).run()
+        with pytest.raises(CheckpointError):
+            MatchImporter(
+                str(other), checkpoint=str(path) + ".checkpoint"
+            ).run(resume=True)
+        assert Match.query.count() == 2
@@ -0,0 +1,56 @@
+## Imports
+
+# standard library
+from time import sleep, time
+from datetime import datetime
+
+# pytest
+import pytest
+
+# relative
+from app import db, last_seen
+from app.models import User
+from tests.conftest import login, PASSWORD
+
+
+@pytest.fixture
+def app_config():
+    return {"LAST_SEEN_FLUSH_INTERVAL": 0.2}
+
+
+def test_flushed_without_further_requests(app):
+    with app.app_context():
+        user = User("ann", "ann@example.com", PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    when = datetime(2030, 1, 1)
+    last_seen.touch(user_id, when)
+    # pending is emptied before the update is written, wait for the row
+    deadline = time() + 5
+    while True:
+        with app.app_context():
+            if User.query.get(user_id).last_seen == when:
+                break
+        assert time() < deadline
+        sleep(0.05)
+    assert not last_seen.pending()
+
+
+def test_user_page_shows_a_new_last_seen(app, client):
+    # only the flush below
+    app.config["LAST_SEEN_FLUSH_INTERVAL"] = 3600
+    with app.app_context():
+        db.session.add(User("ann", "ann@example.com", PASSWORD))
+        db.session.commit()
+    login(client, "ann")
+    etag = client.get("/user/ann").headers["ETag"].strip('"')
+    assert client.get("/user/ann", headers={"If-None-Match": etag}).status_code == 304
+
+    last_seen.touch(1, datetime(2030, 1, 1))
+    with app.app_context():
+        last_seen.flush()
+    response = client.get("/user/ann", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "2030-01-01" in response.get_data(as_text=True)
@@ -0,0 +1,74 @@
+## Imports
+
+# standard library
+from threading import Thread
+
+# relative
+from app.live import LiveBroker
+
+
+def broker(app, **config):
+    app.config.update(config)
+    live = LiveBroker()
+    live.init_app(app)
+    live.start()
+    return live
+
+
+def frames(live, subscriber):
+    stream = live.stream(subscriber)
+    assert next(stream).startswith("retry:")
+    try:
+        return next(stream)
+    finally:
+        stream.close()
+
+
+def test_publish_reaches_every_subscriber(app):
+    live = broker(app)
+    first, second = live.subscribe(), live.subscribe()
+    live.publish("joined", event=1, user="someone")
+    assert '"event":1' in frames(live, first)
+    assert '"event":1' in frames(live, second)
+    assert live.stats()["delivered"] == 2
+
+
+def test_reconnect_replays_what_was_missed(app):
+    live = broker(app)
+    live.publish("joined", event=1, user="a")
+    seen = live.last_id()
+    live.publish("left", event=1, user="a")
+    live.publish("joined", event=2, user="b")
+    missed = frames(live, live.subscribe(seen))
+    assert missed.count("event: ") == 2
+    assert "event: left" in missed and '"event":2' in missed
+
+
+def test_reconnect_too_late_is_a_reset(app):
+    live = broker(app, LIVE_REPLAY=2)
+    live.publish("joined", event=1, user="a")
+    seen = live.last_id()
+    for event in range(2, 5):
+        live.publish("joined", event=event, user="a")
+    assert "event: reset" in frames(live, live.subscribe(seen))
+
+
+def test_slow_subscriber_gets_a_reset(app):
+    live = broker(app, LIVE_BUFFER=2)
+    subscriber = live.subscribe()
+    for event in range(5):
+        live.publish("left", event=event, user="a")
+    assert "event: reset" in frames(live, subscriber)
+    assert live.stats()["dropped"] == 3
+
+
+def test_subscriber_cap_holds_under_concurrency(app):
+    live = broker(app, LIVE_MAX_SUBSCRIBERS=3)
+    granted = []
+    threads = [Thread(target=lambda: granted.append(live.subscribe())) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len([subscriber for subscriber in granted if subscriber]) == 3
+    assert live.stats()["rejected"] == 17
@@ -0,0 +1,105 @@
+## Imports
+
+# standard library
+from time import sleep
+from datetime import datetime, timedelta
+
+# pytest
+import pytest
+
+# flask
+from flask_mail import Message
+
+# relative
+from app import db, mail_queue
+from app.models import OutgoingMail
+
+
+@pytest.fixture
+def app_config(smtp_server):
+    return {
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": smtp_server.port,
+        "MAIL_USE_TLS": False,
+        "MAIL_SUPPRESS_SEND": False,
+    }
+
+
+def enqueue(app, subject="Hello", recipient="a@b.be"):
+    message = Message(subject, sender="no-reply@example.com", recipients=[recipient])
+    message.body = "See you on the field"
+    with app.app_context():
+        mail_queue.enqueue(message)
+
+
+def statuses(app):
+    with app.app_context():
+        return [
+            (row.status, row.attempts)
+            for row in OutgoingMail.query.order_by(OutgoingMail.id)
+        ]
+
+
+def test_drain_sends_the_spool_over_smtp(app, smtp_server):
+    enqueue(app, "First")
+    enqueue(app, "Second")
+    assert mail_queue.drain() == 2
+    assert [("sent", 1), ("sent", 1)] == statuses(app)
+    assert len(smtp_server.messages) == 2
+    assert "Subject: First" in smtp_server.messages[0]
+
+
+def test_unknown_recipient_fails_alone(app, smtp_server):
+    smtp_server.unknown.add("nobody@b.be")
+    enqueue(app, "First")
+    enqueue(app, "Lost", "nobody@b.be")
+    enqueue(app, "Third")
+    mail_queue.drain()
+    # a 550 is not worth retrying, and the connection is fine for the rest
+    assert statuses(app) == [("sent", 1), ("failed", 1), ("sent", 1)]
+    assert len(smtp_server.messages) == 2
+
+
+def test_unreachable_server_is_retried(app, smtp_server):
+    smtp_server.refuse = True
+    enqueue(app)
+    mail_queue.drain()
+    assert statuses(app) == [("pending", 1)]
+    assert smtp_server.messages == []
+
+    smtp_server.refuse = False
+    # once the delay is over
+    with app.app_context():
+        OutgoingMail.query.update({"next_attempt_at": datetime.utcnow()})
+        db.session.commit()
+    mail_queue.drain()
+    assert statuses(app) == [("sent", 2)]
+    assert len(smtp_server.messages) == 1
+
+
+def test_workers_start_with_the_first_request(app, client, smtp_server):
+    # left in the spool by a process that stopped
+    with app.app_context():
+        db.session.add(
+            OutgoingMail(
+                subject="Left over",
+                sender="no-reply@example.com",
+                recipients='["a@b.be"]',
+                body="",
+                status="pending",
+                attempts=0,
+                next_attempt_at=datetime.utcnow() - timedelta(minutes=5),
+                created_at=datetime.utcnow() - timedelta(minutes=5),
+            )
+        )
+        db.session.commit()
+    app.config["MAIL_QUEUE_WORKERS"] = 1
+    try:
+        client.get("/auth/login")
+        for _ in range(50):
+            if smtp_server.messages:
+                break
+            sleep(0.1)
+        assert "Subject: Left over" in smtp_server.messages[0]
+    finally:
+        mail_queue.stop()
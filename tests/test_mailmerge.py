@@ -0,0 +1,54 @@
+## Imports
+
+# pytest
+import pytest
+
+# relative
+from app import db
+from app.models import User
+from app.mailmerge import MailMerge, user_chunks
+from tests.conftest import PASSWORD
+
+
+@pytest.fixture
+def app_config(smtp_server):
+    return {
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": smtp_server.port,
+        "MAIL_USE_TLS": False,
+        "MAIL_SUPPRESS_SEND": False,
+    }
+
+
+def merge(app, *names):
+    with app.app_context():
+        for name in names:
+            db.session.add(User(name, "{}@example.com".format(name), PASSWORD))
+        db.session.commit()
+        with app.test_request_context():
+            return MailMerge("Hello", "email/reset_password").run(
+                user_chunks(2),
+                lambda users: ((user, {"token": "t"}) for user in users),
+            )
+
+
+def test_refused_recipient_is_reported(app, smtp_server):
+    smtp_server.unknown.add("bob@example.com")
+    report = merge(app, "ann", "bob", "cid")
+    assert report.messages == 2
+    assert report.failed == ["bob@example.com"]
+    assert len(smtp_server.messages) == 2
+
+
+def test_reconnects_after_a_lost_connection(app, smtp_server):
+    smtp_server.hang_up_after = 2
+    report = merge(app, "ann", "bob", "cid", "dirk", "els")
+    assert report.messages == 5 and report.failed == []
+    assert len(smtp_server.messages) == 5
+
+
+def test_server_down(app, smtp_server):
+    smtp_server.refuse = True
+    report = merge(app, "ann", "bob")
+    assert report.messages == 0
+    assert report.failed == ["ann@example.com", "bob@example.com"]
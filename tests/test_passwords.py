@@ -0,0 +1,46 @@
+## Imports
+
+# standard library
+from time import sleep, time
+
+# pytest
+import pytest
+
+# relative
+from app import passwords
+from app.passwords import HasherBusy
+
+
+@pytest.fixture
+def app_config():
+    return {
+        "PASSWORD_HASH_WORKERS": 1,
+        "PASSWORD_HASH_MAX_PENDING": 1,
+        "PASSWORD_HASH_TIMEOUT": 0.1,
+    }
+
+
+def test_timeout_is_busy_and_keeps_the_slot(app):
+    before = passwords.stats()
+    with pytest.raises(HasherBusy):
+        passwords._run(sleep, 1)
+    # the pool still works on it, so there is no room for another one
+    with pytest.raises(HasherBusy):
+        passwords._run(sleep, 0)
+    after = passwords.stats()
+    assert after["timed_out"] == before["timed_out"] + 1
+    assert after["rejected"] == before["rejected"] + 1
+
+    deadline = time() + 5
+    while True:
+        try:
+            passwords._run(sleep, 0)
+            break
+        except HasherBusy:
+            assert time() < deadline
+            sleep(0.1)
+
+
+def test_no_password_hash(app):
+    assert not passwords.needs_rehash(None)
+    assert not passwords.verify(None, "password")
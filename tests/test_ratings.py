@@ -0,0 +1,54 @@
+## Imports
+
+# standard library
+from datetime import datetime, timedelta
+
+# relative
+from app import db
+from app.models import Match, Rating, Team, User
+from app.ratings import recompute_all
+from tests.conftest import PASSWORD
+
+
+def ratings():
+    return {
+        (r.kind, r.subject_id): (round(r.rating, 6), r.matches, r.wins, r.losses)
+        for r in Rating.query
+    }
+
+
+def test_recompute_matches_the_incremental_updates(app):
+    with app.app_context():
+        users = [
+            User("p{}".format(i), "p{}@example.com".format(i), PASSWORD)
+            for i in range(4)
+        ]
+        a = Team("a", users[0], users[1])
+        b = Team("b", users[2], users[3])
+        # a team whose players are unknown, e.g. from an import
+        c = Team("c", users[0], users[2])
+        db.session.add_all([a, b, c])
+        db.session.commit()
+        c.players = []
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        for i, (team1, team2, score1, score2) in enumerate(
+            [(a, b, 21, 15), (a, c, 10, 21), (b, c, 21, 19), (b, a, 21, 12)]
+        ):
+            db.session.add(
+                Match(
+                    date=start + timedelta(days=i),
+                    team1=team1,
+                    team2=team2,
+                    score1=score1,
+                    score2=score2,
+                )
+            )
+            db.session.commit()
+        incremental = ratings()
+        # player 0 played three matches for a, but only two were rated
+        assert incremental["player", users[0].id][1:] == (2, 1, 1)
+
+        recompute_all()
+        assert ratings() == incremental
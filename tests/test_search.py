@@ -0,0 +1,30 @@
+## Imports
+
+# relative
+from app import search_index
+from app.search import doc_key, split_key
+from tests.conftest import login
+from tests.test_series import make_users, create_series, upcoming
+
+
+def test_keys_of_every_kind():
+    for kind in ("event", "location", "user", "series"):
+        assert split_key(doc_key(kind, 7)) == (kind, 7)
+
+
+def test_series_found_as_next_date(app, client):
+    make_users(app, "maker")
+    login(client, "maker")
+    create_series(client)
+    first, second = [occurrence.id for occurrence in upcoming(app)[:2]]
+
+    page = client.get("/search?q=train").get_data(as_text=True)
+    assert 'data-event="{}"'.format(first) in page
+    # the joined date is found as an event of its own
+    client.get("/join/" + first)
+    page = client.get("/search?q=train").get_data(as_text=True)
+    assert 'data-event="{}"'.format(second) in page
+
+    with app.app_context():
+        search_index.reindex()
+        assert ("series", 1) in search_index.search("training")[0]
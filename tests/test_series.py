@@ -0,0 +1,116 @@
+## Imports
+
+# standard library
+from datetime import date, datetime, timedelta
+
+# relative
+from app import db
+from app.models import Series, User
+from app.main.feed import occurrences_between, start_of_today
+from tests.conftest import login, PASSWORD
+
+
+def make_users(app, *names):
+    with app.app_context():
+        for name in names:
+            db.session.add(User(name, "{}@example.com".format(name), PASSWORD))
+        db.session.commit()
+
+
+def create_series(client):
+    return client.post(
+        "/create_event",
+        data={
+            "location": "veld",
+            "date": (date.today() - timedelta(days=14)).isoformat(),
+            "time": "18:30",
+            "repeat": 7,
+            "info": "training",
+        },
+    )
+
+
+def upcoming(app):
+    with app.test_request_context():
+        today = start_of_today()
+        return occurrences_between(today, today + timedelta(days=60))
+
+
+def test_creator_ends_a_series(app, client):
+    make_users(app, "maker")
+    login(client, "maker")
+    create_series(client)
+    assert upcoming(app)
+
+    response = client.get("/series/1/end")
+    assert response.status_code == 302
+    assert upcoming(app) == []
+    with app.app_context():
+        series = Series.query.get(1)
+        assert series.until < datetime.now()
+        # the past dates are still there
+        assert list(series.occurrences(series.start, datetime.now()))
+
+
+def test_only_the_creator_ends_a_series(app, client):
+    make_users(app, "maker", "other")
+    login(client, "maker")
+    create_series(client)
+    client.cookie_jar.clear()
+    login(client, "other")
+
+    client.get("/series/1/end")
+    assert upcoming(app)
+    assert client.get("/series/2/end").status_code == 404
+
+
+def test_joined_and_cancelled_dates_are_not_listed_again(app, client):
+    make_users(app, "maker")
+    login(client, "maker")
+    create_series(client)
+    first, second, third = [occurrence.id for occurrence in upcoming(app)[:3]]
+
+    client.get("/join/" + first)
+    client.get("/delete/" + second)
+    ids = [occurrence.id for occurrence in upcoming(app)]
+    assert first not in ids and second not in ids and third in ids
+    page = client.get("/index").get_data(as_text=True)
+    assert page.count('data-event="{}"'.format(third)) == 1
+
+
+def test_leaving_what_was_not_joined(app, client):
+    make_users(app, "maker")
+    login(client, "maker")
+    create_series(client)
+    first = upcoming(app)[0].id
+
+    page = client.get("/leave/" + first, follow_redirects=True)
+    assert "You were not joining" in page.get_data(as_text=True)
+    client.get("/join/" + first)
+    page = client.get("/leave/" + first, follow_redirects=True)
+    assert "You have left" in page.get_data(as_text=True)
+
+
+def test_rename_shows_in_the_occurrences(app, client):
+    make_users(app, "maker")
+    login(client, "maker")
+    create_series(client)
+    assert "maker" in client.get("/index").get_data(as_text=True)
+
+    client.post("/edit_profile", data={"username": "taker", "about_me": ""})
+    page = client.get("/index").get_data(as_text=True)
+    assert "taker" in page
+    assert "maker" not in page
+
+
+def test_joining_a_full_occurrence(app, client):
+    make_users(app, "maker")
+    login(client, "maker")
+    create_series(client)
+    with app.app_context():
+        Series.query.get(1).capacity = 0
+        db.session.commit()
+    occurrence = upcoming(app)[0]
+
+    response = client.get("/join/{}".format(occurrence.id), follow_redirects=True)
+    assert "is full" in response.get_data(as_text=True)